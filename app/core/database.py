@@ -6,10 +6,20 @@ from app.core.config import get_settings
 
 settings = get_settings()
 
+# Prepared statements cached per connection (asyncpg + SQLAlchemy), so repeated
+# INSERT/SELECT shapes are not re-planned on every execution
+STATEMENT_CACHE_SIZE = 2048
+
 # Create async engine
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=True,  # Set to False in production
+    pool_size=16,
+    pool_pre_ping=True,
+    connect_args={
+        "statement_cache_size": STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": STATEMENT_CACHE_SIZE,
+    },
 )
 
 # Create async session factory
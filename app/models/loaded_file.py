@@ -0,0 +1,14 @@
+# app/models/loaded_file.py
+from sqlalchemy import Column, Integer, BigInteger, Text, DateTime
+from datetime import datetime
+
+from app.models.base import Base
+
+class LoadedFile(Base):
+    """Registro de archivos CSV ya cargados (para reanudar cargas con --resume)"""
+    __tablename__ = "loaded_files"
+    
+    path = Column(Text, primary_key=True)
+    mtime = Column(BigInteger, nullable=False)  # st_mtime_ns del archivo al cargarlo
+    rows = Column(Integer, nullable=False, default=0)
+    loaded_at = Column(DateTime, default=datetime.utcnow)
@@ -1,5 +1,5 @@
 # app/models/movement_flow.py
-from sqlalchemy import Column, String, Integer, DateTime, Boolean, Index, Float
+from sqlalchemy import Column, String, Integer, DateTime, Boolean, Index, Float, text
 from app.models.base import BaseModel
 
 class MovementFlow(BaseModel):
@@ -60,4 +60,12 @@ class MovementFlow(BaseModel):
         Index('idx_flow_move_kind', 'ime_move_kind'),
         Index('idx_flow_category', 'iu_category'),
         Index('idx_flow_patio_bloque', 'patio', 'bloque'),
+        # Último bloque conocido por contenedor (DISTINCT ON ... ORDER BY ime_time DESC)
+        # sin ordenar la tabla completa
+        Index(
+            'idx_mf_gkey_time_notnull',
+            'ime_ufv_gkey', ime_time.desc(),
+            postgresql_include=['patio', 'bloque'],
+            postgresql_where=text('patio IS NOT NULL AND bloque IS NOT NULL'),
+        ),
     )
\ No newline at end of file
@@ -6,6 +6,7 @@ from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete, and_, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import logging
 from uuid import UUID
 import re
@@ -17,6 +18,7 @@ from app.models.camila import (
     ComparacionReal, FlujoModelo, ParametroCamila, LogProcesamientoCamila,
     EstadoProcesamiento, TipoOperacion, TipoAsignacion, SegregacionMapping
 )
+from app.utils.excel import EXCEL_ENGINE, open_excel
 
 logger = logging.getLogger(__name__)
 
@@ -152,7 +154,7 @@ class CamilaLoader:
             fecha_turno_fin = fecha_turno_inicio + timedelta(hours=8)
             
             # Cargar flujos reales
-            df_flujos = pd.read_excel(flujos_filepath)
+            df_flujos = pd.read_excel(flujos_filepath, engine=EXCEL_ENGINE)
             df_flujos['ime_time'] = pd.to_datetime(df_flujos['ime_time'])
             
             # NUEVO: Obtener segregaciones del modelo desde flujos_modelo
@@ -385,7 +387,7 @@ class CamilaLoader:
         logger.info("Cargando parámetros del modelo...")
         
         try:
-            xl = pd.ExcelFile(filepath)
+            xl = open_excel(filepath)
             
             parametros_map = {
                 'mu': ('Tiempo de servicio', 'minutos'),
@@ -401,37 +403,50 @@ class CamilaLoader:
                         valor = float(df.iloc[1, 0])
                         self.parametros_cache[param_code] = valor
                         
-                        # Actualizar o crear parámetro en BD
-                        query = select(ParametroCamila).where(ParametroCamila.codigo == param_code)
-                        result = await self.db.execute(query)
-                        param = result.scalar_one_or_none()
-                        
-                        if not param:
-                            param = ParametroCamila(
-                                codigo=param_code,
-                                descripcion=descripcion,
-                                valor_default=valor,
-                                valor_actual=valor,
-                                unidad=unidad
-                            )
-                            self.db.add(param)
-                        else:
-                            param.valor_actual = valor
-                            param.fecha_actualizacion = datetime.utcnow()
+                        # Actualizar o crear parámetro en BD (upsert: cargas de turnos
+                        # en paralelo pueden crear el mismo código a la vez)
+                        stmt = pg_insert(ParametroCamila).values(
+                            codigo=param_code,
+                            descripcion=descripcion,
+                            valor_default=valor,
+                            valor_actual=valor,
+                            unidad=unidad,
+                            activo=True,
+                            fecha_actualizacion=datetime.utcnow()
+                        )
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=['codigo'],
+                            set_={
+                                'valor_actual': stmt.excluded.valor_actual,
+                                'fecha_actualizacion': stmt.excluded.fecha_actualizacion
+                            }
+                        )
+                        await self._upsert_parametro(stmt)
             
-            await self.db.flush()
             logger.info(f"Parámetros cargados: {list(self.parametros_cache.keys())}")
             
         except Exception as e:
             logger.warning(f"Error cargando parámetros: {e}")
     
+    async def _upsert_parametro(self, stmt):
+        """
+        Ejecutar el upsert de un parámetro en una transacción corta propia: la fila
+        no queda bloqueada durante la carga del turno, así las cargas en paralelo
+        no se esperan entre sí.
+        """
+        if self.db.bind is None:
+            await self.db.execute(stmt)
+            return
+        async with self.db.bind.begin() as conn:
+            await conn.execute(stmt)
+    
     async def _load_resultado_file(self, filepath: str, resultado_id: UUID, segregacion_map: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         """Carga archivo de resultados de Camila (output del modelo)"""
         
         logger.info("Cargando archivo de resultados del modelo...")
         
         try:
-            df = pd.read_excel(filepath, header=None, names=['var', 'idx', 'val'])
+            df = pd.read_excel(filepath, header=None, names=['var', 'idx', 'val'], engine=EXCEL_ENGINE)
             logger.info(f"Archivo con {len(df)} filas")
             
             # Estructuras para tracking
@@ -641,7 +656,7 @@ class CamilaLoader:
         logger.info("Cargando archivo de instancia...")
         
         try:
-            xl = pd.ExcelFile(filepath)
+            xl = open_excel(filepath)
             stats = {
                 'parametros_cargados': len(self.parametros_cache),
                 'demanda_total': 0,
@@ -874,7 +889,7 @@ class CamilaLoader:
         logger.info("Cargando mapeo de segregaciones...")
         
         try:
-            xl = pd.ExcelFile(instancia_filepath)
+            xl = open_excel(instancia_filepath)
             segregacion_map = {}
             
             # Buscar hoja S (contiene el mapeo)
@@ -1,23 +1,58 @@
 # app/services/csv_loader.py
+import asyncio
+import io
+import time
 import pandas as pd
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime, date
 import logging
 import re
+import uuid
 from sqlalchemy import select, and_, text, case, or_, func  # ASEGÚRATE DE QUE 'case' ESTÉ AQUÍ
+from sqlalchemy import Table, MetaData, Column
 from app.models.historical_movements import HistoricalMovement
 from app.models.container_dwell_time import ContainerDwellTime
 from app.models.truck_turnaround_time import TruckTurnaroundTime
 from app.models.container_position import ContainerPosition
+from app.models.loaded_file import LoadedFile
 from pathlib import Path
 import glob
+from itertools import groupby, islice
 import numpy as np
 
 
 
 logger = logging.getLogger(__name__)
 
+# Filas por executemany al insertar posiciones
+POSITION_INSERT_CHUNK = 5000
+
+# Filas por trozo al leer los CSV TTT
+TTT_CSV_CHUNK = 50_000
+
+# Columnas de los CSV TTT que usa el loader (las demás no se parsean)
+TTT_CSV_COLUMNS = frozenset({
+    'iufv_gkey', 'gate_gkey', 'ttt', 'turn_time',
+    'cv_ata', 'cv_atd', 'cv_atay', 'cv_atdy',
+    'pregate_ss', 'pregate_se', 'ingate_ss', 'ingate_se', 'outgate_ss', 'outgate_se',
+    'raw_t_dispatch', 'raw_t_fetch', 'raw_t_put',
+    'truck_license_nbr', 'driver_card_id', 'driver_name', 'trucking_co_id', 'pos_yard_gate',
+    'ret_nominal_length', 'ret_nominal_height', 'ret_iso_group',
+    'iu_freight_kind', 'ig_hazardous', 'iu_requires_power', 'iu_category'
+})
+
+# Columnas que se leen de los CSV de posiciones (el resto se descarta al parsear)
+POSITION_CSV_DTYPES = {
+    'gkey': str,
+    'Posicion': str,
+    'category': str,
+    'tiempo': str,
+    'requires_power': str,
+    'nominal_length': str,
+    'hazardous': str
+}
+
 
 # Función mejorada para extract_patio_bloque
 def extract_patio_bloque(position: str) -> tuple[str, str]:
@@ -125,165 +160,248 @@ def clean_float_value(value, field_name=None, stats=None):
     except ValueError:
         return None
 
+def parse_container_positions_csv(file_path: str, fecha: date, turno: int, semana_iso: str, data: bytes = None) -> list:
+    """
+    Parsear un CSV de posiciones a la lista de registros a insertar
+    
+    Función de módulo (sin sesión) para poder ejecutarla en un ProcessPoolExecutor.
+    Si se entrega data (contenido ya leído del archivo) no se vuelve a leer de disco.
+    """
+    # Leer CSV
+    source = io.BytesIO(data) if data is not None else file_path
+    df = pd.read_csv(source, sep=';', usecols=list(POSITION_CSV_DTYPES), dtype=POSITION_CSV_DTYPES)
+    
+    if len(df) == 0:
+        return []
+    
+    # Filtrar posiciones válidas
+    df = df[df['Posicion'].notna() & (df['Posicion'].str.len() >= 6)].copy()
+    
+    # Procesar datos
+    df['patio'] = df['Posicion'].str[0]
+    df['bloque'] = df['Posicion'].str[1] 
+    df['bahia'] = pd.to_numeric(df['Posicion'].str[2:4], errors='coerce')
+    df['fila'] = df['Posicion'].str[4]
+    df['tier'] = pd.to_numeric(df['Posicion'].str[5], errors='coerce')
+    
+    df = df.dropna(subset=['bahia', 'tier'])
+    df['bahia'] = df['bahia'].astype(int)
+    df['tier'] = df['tier'].astype(int)
+    
+    df['gkey'] = df['gkey'].astype(str).str.strip()
+    df = df[df['gkey'] != '']
+    
+    df['category'] = df['category'].fillna('UNKNOWN').astype(str).str[:10]
+    df['nominal_length'] = df['nominal_length'].astype(str).str.extract('(\d+)').fillna(20).astype(int)
+    df['requires_power'] = df['requires_power'].fillna('0').astype(str).str.strip() == '1'
+    df['hazardous'] = df['hazardous'].fillna('0').astype(str).str.strip() == '1'
+    
+    # Manejar tiempo_permanencia
+    df['tiempo_clean'] = pd.to_numeric(df['tiempo'], errors='coerce')
+    df['tiempo_permanencia'] = pd.Series(
+        [int(t) if t > 0 else None for t in df['tiempo_clean']],
+        index=df.index, dtype=object
+    )
+    
+    # IMPORTANTE: Convertir timestamps a datetime de Python
+    now = datetime.utcnow()
+    
+    df['fecha'] = fecha
+    df['turno'] = turno
+    df['semana_iso'] = semana_iso
+    df['posicion'] = df['Posicion']
+    df['created_at'] = now  # Usar datetime de Python
+    df['updated_at'] = now  # Usar datetime de Python
+    df['is_active'] = True
+    
+    columns = [
+        'fecha', 'turno', 'semana_iso', 'gkey', 'posicion',
+        'patio', 'bloque', 'bahia', 'fila', 'tier',
+        'category', 'tiempo_permanencia', 'requires_power',
+        'nominal_length', 'hazardous', 'created_at', 'updated_at', 'is_active'
+    ]
+    
+    df_final = df[columns]
+    
+    # Convertir a diccionarios: NaN → None de una vez, sin iterrows
+    df_final = df_final.astype(object).where(df_final.notna(), None)
+    records = df_final.to_dict('records')
+    
+    return records
+
+
 class CSVLoaderService:
     def __init__(self, db: AsyncSession):
         self.db = db
-    async def load_container_positions_csv(self, file_path: str, fecha: date, turno: int, semana_iso: str):
+        # (parse_ms, insert_ms) del último CSV de posiciones cargado
+        self.last_file_timing = (0.0, 0.0)
+        # Si el último CSV de posiciones se procesó sin errores
+        self.last_file_ok = False
+        # Chunks que fallaron en la última llamada a insert_container_positions
+        self.last_failed_chunks = 0
+
+    async def insert_container_positions(self, records: list, commit: bool = True) -> int:
+        """
+        Insertar registros de posiciones ya parseados (ver parse_container_positions_csv)
+        
+        Con commit=False no se hace commit por chunk: cada chunk va en un
+        SAVEPOINT dentro de la transacción abierta por quien llama.
+        """
+        # INSERT de Core sobre la tabla (executemany), sin pasar por el ORM
+        table = ContainerPosition.__table__
+        stmt = insert(table).on_conflict_do_nothing(
+            index_elements=['fecha', 'turno', 'gkey']
+        ).returning(table.c.id)
+        
+        # Insertar en chunks
+        total_inserted = 0
+        self.last_failed_chunks = 0
+        pending = iter(records)
+        
+        while chunk := list(islice(pending, POSITION_INSERT_CHUNK)):
+            try:
+                if commit:
+                    result = await self.db.execute(stmt, chunk)
+                    await self.db.commit()
+                else:
+                    async with self.db.begin_nested():
+                        result = await self.db.execute(stmt, chunk)
+                total_inserted += len(result.all())
+                
+            except Exception as e:
+                if commit:
+                    await self.db.rollback()
+                self.last_failed_chunks += 1
+                logger.warning(f"Error en chunk: {str(e)[:50]}")
+                continue
+        
+        return total_inserted
+
+    async def load_container_positions_csv(self, file_path: str, fecha: date, turno: int, semana_iso: str, commit: bool = True, data: bytes = None):
         """
         Cargar CSV de posiciones de contenedores - VERSIÓN FINAL FUNCIONANDO
+        
+        Con commit=False no se hace commit por chunk: cada chunk va en un
+        SAVEPOINT dentro de la transacción abierta por quien llama.
+        Si se entrega data (contenido ya leído del archivo) no se vuelve a leer de disco.
         """
         try:
             filename = Path(file_path).name
+            t0 = time.perf_counter()
+            self.last_file_timing = (0.0, 0.0)
+            self.last_file_ok = False
             
-            # Leer CSV
-            df = pd.read_csv(file_path, sep=';', dtype={
-                'gkey': str,
-                'Posicion': str,
-                'category': str,
-                'tiempo': str,
-                'requires_power': str,
-                'nominal_length': str,
-                'hazardous': str
-            })
-            
-            if len(df) == 0:
-                return 0
-            
-            # Filtrar posiciones válidas
-            df = df[df['Posicion'].notna() & (df['Posicion'].str.len() >= 6)].copy()
-            
-            # Procesar datos
-            df['patio'] = df['Posicion'].str[0]
-            df['bloque'] = df['Posicion'].str[1] 
-            df['bahia'] = pd.to_numeric(df['Posicion'].str[2:4], errors='coerce')
-            df['fila'] = df['Posicion'].str[4]
-            df['tier'] = pd.to_numeric(df['Posicion'].str[5], errors='coerce')
-            
-            df = df.dropna(subset=['bahia', 'tier'])
-            df['bahia'] = df['bahia'].astype(int)
-            df['tier'] = df['tier'].astype(int)
-            
-            df['gkey'] = df['gkey'].astype(str).str.strip()
-            df = df[df['gkey'] != '']
-            
-            df['category'] = df['category'].fillna('UNKNOWN').astype(str).str[:10]
-            df['nominal_length'] = df['nominal_length'].astype(str).str.extract('(\d+)').fillna(20).astype(int)
-            df['requires_power'] = df['requires_power'].fillna('0').astype(str).str.strip() == '1'
-            df['hazardous'] = df['hazardous'].fillna('0').astype(str).str.strip() == '1'
-            
-            # Manejar tiempo_permanencia
-            df['tiempo_clean'] = pd.to_numeric(df['tiempo'], errors='coerce')
-            df['tiempo_permanencia'] = df['tiempo_clean'].where(df['tiempo_clean'] > 0, None)
-            
-            # IMPORTANTE: Convertir timestamps a datetime de Python
-            now = datetime.utcnow()
-            
-            df['fecha'] = fecha
-            df['turno'] = turno
-            df['semana_iso'] = semana_iso
-            df['posicion'] = df['Posicion']
-            df['created_at'] = now  # Usar datetime de Python
-            df['updated_at'] = now  # Usar datetime de Python
-            df['is_active'] = True
-            
-            columns = [
-                'fecha', 'turno', 'semana_iso', 'gkey', 'posicion',
-                'patio', 'bloque', 'bahia', 'fila', 'tier',
-                'category', 'tiempo_permanencia', 'requires_power',
-                'nominal_length', 'hazardous', 'created_at', 'updated_at', 'is_active'
-            ]
-            
-            df_final = df[columns]
-            
-            # Convertir a diccionarios y limpiar
-            records = []
-            for _, row in df_final.iterrows():
-                record = {}
-                for col in columns:
-                    val = row[col]
-                    if col == 'tiempo_permanencia':
-                        if pd.isna(val) or val is None or val == 0:
-                            record[col] = None
-                        else:
-                            record[col] = int(val)
-                    elif pd.isna(val):
-                        record[col] = None
-                    else:
-                        record[col] = val
-                records.append(record)
+            records = parse_container_positions_csv(file_path, fecha, turno, semana_iso, data)
             
             if not records:
+                self.last_file_ok = True
                 return 0
             
-            from sqlalchemy.dialects.postgresql import insert as pg_insert
-            
-            # Insertar en chunks
-            chunk_size = 1000
-            total_inserted = 0
-            
-            for i in range(0, len(records), chunk_size):
-                chunk = records[i:i+chunk_size]
-                
-                try:
-                    stmt = pg_insert(ContainerPosition).values(chunk)
-                    stmt = stmt.on_conflict_do_nothing(
-                        index_elements=['fecha', 'turno', 'gkey']
-                    )
-                    
-                    result = await self.db.execute(stmt)
-                    await self.db.commit()
-                    total_inserted += result.rowcount
-                    
-                except Exception as e:
-                    await self.db.rollback()
-                    logger.debug(f"Error en chunk: {str(e)[:50]}")
-                    continue
+            t_parsed = time.perf_counter()
+            total_inserted = await self.insert_container_positions(records, commit=commit)
             
-            if total_inserted > 0:
-                logger.info(f"✅ {filename}: {total_inserted} registros")
-            else:
-                logger.info(f"⚠️ {filename}: 0 registros (ya existen)")
+            # Tiempos del archivo: parseo (lectura + pandas) e inserción en BD
+            parse_ms = (t_parsed - t0) * 1000
+            insert_ms = (time.perf_counter() - t_parsed) * 1000
+            self.last_file_timing = (parse_ms, insert_ms)
+            logger.info("%s rows=%d parse_ms=%.1f insert_ms=%.1f", filename, total_inserted, parse_ms, insert_ms)
             
+            # Un chunk perdido deja el archivo incompleto: no se registra como cargado
+            self.last_file_ok = self.last_failed_chunks == 0
+            if not self.last_file_ok:
+                logger.error(f"{filename}: {self.last_failed_chunks} chunks con error")
             return total_inserted
             
         except Exception as e:
             logger.error(f"Error en {Path(file_path).name}: {str(e)}")
             return 0
 
-    async def load_container_positions_year(self, year: int = 2022):
+    async def get_loaded_files(self, mtimes: dict) -> set:
         """
-        Cargar todos los archivos de posiciones - VERSIÓN SECUENCIAL OPTIMIZADA
+        Retornar las rutas de mtimes ({ruta: st_mtime_ns}) ya cargadas con ese mismo mtime
+        
+        Una sola consulta con = ANY(...) para todo el conjunto de archivos.
+        """
+        if not mtimes:
+            return set()
+        
+        result = await self.db.execute(
+            select(LoadedFile.path, LoadedFile.mtime).where(LoadedFile.path == func.any(list(mtimes)))
+        )
+        return {row.path for row in result if mtimes.get(row.path) == row.mtime}
+
+    async def mark_file_loaded(self, path: str, mtime: int, rows: int):
+        """Registrar (o actualizar) un archivo como cargado"""
+        stmt = insert(LoadedFile).values(path=path, mtime=mtime, rows=rows, loaded_at=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['path'],
+            set_={'mtime': stmt.excluded.mtime, 'rows': stmt.excluded.rows, 'loaded_at': stmt.excluded.loaded_at}
+        )
+        await self.db.execute(stmt)
+
+    async def load_container_positions_year(self, year: int = 2022, commit: bool = True, resume: bool = False,
+                                            commit_semanal: bool = False):
         """
-        from datetime import datetime
+        Cargar todos los archivos de posiciones - VERSIÓN SECUENCIAL OPTIMIZADA
         
+        commit se propaga a load_container_positions_csv
+        Con resume=True se omiten los archivos registrados en loaded_files con el mismo mtime
+        Con commit_semanal=True se hace commit al terminar cada semana: las filas de
+        la semana quedan confirmadas junto con sus registros en loaded_files
+        """
         base_path = Path(f"/app/data/{year}")
-        if not base_path.exists():
+        if not await asyncio.to_thread(base_path.exists):
             logger.error(f"No existe el directorio: {base_path}")
             return 0
         
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         total_processed = 0
         total_files = 0
         files_error = 0
+        total_parse_ms = 0.0
+        total_insert_ms = 0.0
         
         turno_map = {"08-00": 1, "15-30": 2, "23-00": 3}
         
-        # Contar archivos totales primero
-        total_expected = sum(len(list(d.glob("*.csv"))) for d in base_path.iterdir() if d.is_dir())
+        # Un solo glob sobre el año: sirve para contar y para recorrer por semana
+        all_csv_files = await asyncio.to_thread(lambda: sorted(base_path.glob("*/*.csv")))
+        
+        # mtime de cada archivo: para reanudar y para registrar lo cargado
+        mtimes = await asyncio.to_thread(lambda: {str(p): p.stat().st_mtime_ns for p in all_csv_files})
+        
+        if resume:
+            already_loaded = await self.get_loaded_files(mtimes)
+            if already_loaded:
+                logger.info(f"Reanudando: se omiten {len(already_loaded)} archivos ya cargados")
+                all_csv_files = [p for p in all_csv_files if str(p) not in already_loaded]
+        
+        total_expected = len(all_csv_files)
         logger.info(f"Total de archivos esperados: {total_expected}")
         
+        # Lectura anticipada: el archivo siguiente se lee en un thread
+        # mientras el actual se parsea e inserta
+        file_index = 0
+        pending_read = (
+            asyncio.create_task(asyncio.to_thread(all_csv_files[0].read_bytes))
+            if all_csv_files else None
+        )
+        
         # Procesar secuencialmente
-        for semana_num, semana_dir in enumerate(sorted(base_path.iterdir()), 1):
-            if not semana_dir.is_dir():
-                continue
-                
+        for semana_num, (semana_dir, csv_files) in enumerate(groupby(all_csv_files, key=lambda p: p.parent), 1):
             semana_iso = semana_dir.name
             logger.info(f"\n[{semana_num}/52] Procesando semana: {semana_iso}")
             
-            csv_files = sorted(semana_dir.glob("*.csv"))
-            
             for csv_file in csv_files:
+                current_read = pending_read
+                file_index += 1
+                pending_read = (
+                    asyncio.create_task(asyncio.to_thread(all_csv_files[file_index].read_bytes))
+                    if file_index < total_expected else None
+                )
+                
                 try:
+                    data = await current_read
+                    
                     filename = csv_file.stem
                     parts = filename.split('_')
                     
@@ -306,15 +424,25 @@ class CSVLoaderService:
                         str(csv_file),
                         fecha,
                         turno,
-                        semana_iso
+                        semana_iso,
+                        commit=commit,
+                        data=data
                     )
                     
+                    if self.last_file_ok:
+                        await self.mark_file_loaded(str(csv_file), mtimes[str(csv_file)], processed)
+                        if commit:
+                            await self.db.commit()
+                    
                     total_processed += processed
                     total_files += 1
+                    parse_ms, insert_ms = self.last_file_timing
+                    total_parse_ms += parse_ms
+                    total_insert_ms += insert_ms
                     
                     # Mostrar progreso cada 10 archivos
                     if total_files % 10 == 0:
-                        elapsed = (datetime.now() - start_time).total_seconds()
+                        elapsed = time.perf_counter() - start_time
                         rate = total_files / elapsed
                         eta = (total_expected - total_files) / rate if rate > 0 else 0
                         
@@ -330,9 +458,12 @@ class CSVLoaderService:
                     logger.error(f"Error procesando {csv_file.name}: {str(e)}")
                     files_error += 1
                     continue
+            
+            if commit_semanal:
+                await self.db.commit()
         
         # Resumen final
-        duration = (datetime.now() - start_time).total_seconds()
+        duration = time.perf_counter() - start_time
         
         logger.info("\n=== RESUMEN DE CARGA DE POSICIONES ===")
         logger.info(f"Año: {year}")
@@ -340,12 +471,111 @@ class CSVLoaderService:
         logger.info(f"Archivos con error: {files_error}")
         logger.info(f"Total registros cargados: {total_processed:,}")
         logger.info(f"Tiempo total: {int(duration//60)}m {int(duration%60)}s")
+        logger.info(f"Tiempo de parseo: {total_parse_ms/1000:.1f}s - Tiempo de inserción: {total_insert_ms/1000:.1f}s")
         logger.info(f"Velocidad promedio: {total_files/duration:.1f} archivos/seg")
         logger.info(f"Registros/segundo: {total_processed/duration:.0f}")
         
         return total_processed
 
 
+    async def _copy_upsert(self, model, records: list, key_columns: list, upsert) -> int:
+        """
+        Insertar records con COPY a una tabla temporal y un solo INSERT ... SELECT con upsert
+        
+        upsert(stmt) aplica el ON CONFLICT propio de cada loader. Si el COPY falla
+        se vuelve al INSERT por lotes de 100 registros.
+        """
+        # Un registro por clave única (gana el último), como con los upserts por lote
+        records = list({tuple(r[k] for k in key_columns): r for r in records}.values())
+        if not records:
+            return 0
+        
+        table = model.__table__
+        columns = ['id'] + [c for c in records[0] if c != 'id']
+        staging = Table(f"staging_{table.name}", MetaData(), *(Column(c, table.c[c].type) for c in columns))
+        
+        try:
+            await self.db.execute(text(
+                f"CREATE TEMP TABLE {staging.name} ON COMMIT DROP AS "
+                f"SELECT {', '.join(columns)} FROM {table.name} WITH NO DATA"
+            ))
+            
+            # COPY binario por la conexión asyncpg de la sesión (misma transacción)
+            conn = await self.db.connection()
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                staging.name,
+                records=[(str(uuid.uuid4()), *(r[c] for c in columns[1:])) for r in records],
+                columns=columns
+            )
+            
+            await self.db.execute(upsert(insert(model).from_select(columns, select(*staging.c))))
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            logger.warning(f"COPY falló para {table.name} ({e}); usando INSERT por lotes")
+            for i in range(0, len(records), 100):
+                try:
+                    await self.db.execute(upsert(insert(model).values(records[i:i + 100])))
+                    await self.db.commit()
+                except Exception as e:
+                    await self.db.rollback()
+                    logger.error(f"Error insertando batch en {table.name}: {e}")
+        
+        return len(records)
+
+    async def _copy_insert(self, model, records: list, table_name: str = None) -> int:
+        """
+        Insertar records con un solo COPY directo a la tabla (sin tabla temporal ni upsert)
+        
+        Solo para tablas vacías y records ya únicos por clave: no hay conflictos que
+        resolver. table_name permite cargar en otra tabla con las mismas columnas del
+        modelo (p.ej. una tabla de staging). Si el COPY falla se vuelve al INSERT por lotes de 100.
+        """
+        if not records:
+            return 0
+        
+        table = model.__table__
+        if table_name:
+            table = Table(table_name, MetaData(), *(Column(c.name, c.type) for c in table.c))
+        columns = ['id'] + [c for c in records[0] if c != 'id']
+        
+        try:
+            # COPY binario por la conexión asyncpg de la sesión (misma transacción)
+            conn = await self.db.connection()
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                table.name,
+                records=[(str(uuid.uuid4()), *(r[c] for c in columns[1:])) for r in records],
+                columns=columns
+            )
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            logger.warning(f"COPY falló para {table.name} ({e}); usando INSERT por lotes")
+            # La tabla ad hoc no tiene el default del modelo: el id va en cada fila
+            records = [{**r, 'id': str(uuid.uuid4())} for r in records]
+            insertados = 0
+            fallidos = 0
+            for i in range(0, len(records), 100):
+                batch = records[i:i + 100]
+                try:
+                    await self.db.execute(insert(table).values(batch))
+                    await self.db.commit()
+                    insertados += len(batch)
+                except Exception as e:
+                    await self.db.rollback()
+                    fallidos += len(batch)
+                    logger.error(f"Error insertando batch en {table.name}: {e}")
+            if fallidos:
+                raise RuntimeError(
+                    f"{fallidos} de {len(records)} registros no se insertaron en {table.name} "
+                    f"({insertados} insertados)"
+                )
+            return insertados
+        
+        return len(records)
+
     async def load_historical_csv(self, file_path: str):
         """  
         Cargar CSV de movimientos históricos (congestión)
@@ -360,6 +590,8 @@ class CSVLoaderService:
         total_records = len(df)
         logger.info(f"Total de registros a procesar: {total_records}")
         
+        all_records = []
+        
         for i in range(0, total_records, batch_size):
             batch_df = df.iloc[i:i+batch_size]
             records = []
@@ -398,52 +630,48 @@ class CSVLoaderService:
                 }
                 records.append(record)
             
-            # Insertar este lote con ON CONFLICT para manejar duplicados
-            if records:
-                try:
-                    stmt = insert(HistoricalMovement).values(records)
-                    stmt = stmt.on_conflict_do_update(
-                        constraint='_bloque_hora_uc',
-                        set_={
-                            'gate_entrada_contenedores': stmt.excluded.gate_entrada_contenedores,
-                            'gate_entrada_teus': stmt.excluded.gate_entrada_teus,
-                            'gate_salida_contenedores': stmt.excluded.gate_salida_contenedores,
-                            'gate_salida_teus': stmt.excluded.gate_salida_teus,
-                            'muelle_entrada_contenedores': stmt.excluded.muelle_entrada_contenedores,
-                            'muelle_entrada_teus': stmt.excluded.muelle_entrada_teus,
-                            'muelle_salida_contenedores': stmt.excluded.muelle_salida_contenedores,
-                            'muelle_salida_teus': stmt.excluded.muelle_salida_teus,
-                            'remanejos_contenedores': stmt.excluded.remanejos_contenedores,
-                            'remanejos_teus': stmt.excluded.remanejos_teus,
-                            'patio_entrada_contenedores': stmt.excluded.patio_entrada_contenedores,
-                            'patio_entrada_teus': stmt.excluded.patio_entrada_teus,
-                            'patio_salida_contenedores': stmt.excluded.patio_salida_contenedores,
-                            'patio_salida_teus': stmt.excluded.patio_salida_teus,
-                            'terminal_entrada_contenedores': stmt.excluded.terminal_entrada_contenedores,
-                            'terminal_entrada_teus': stmt.excluded.terminal_entrada_teus,
-                            'terminal_salida_contenedores': stmt.excluded.terminal_salida_contenedores,
-                            'terminal_salida_teus': stmt.excluded.terminal_salida_teus,
-                            'minimo_contenedores': stmt.excluded.minimo_contenedores,
-                            'minimo_teus': stmt.excluded.minimo_teus,
-                            'maximo_contenedores': stmt.excluded.maximo_contenedores,
-                            'maximos_teus': stmt.excluded.maximos_teus,
-                            'promedio_contenedores': stmt.excluded.promedio_contenedores,
-                            'promedio_teus': stmt.excluded.promedio_teus,
-                            'updated_at': datetime.utcnow()
-                        }
-                    )
-                    
-                    await self.db.execute(stmt)
-                    await self.db.commit()
-                except Exception as e:
-                    await self.db.rollback()
-                    logger.error(f"Error insertando batch de movimientos: {e}")
-                    continue
+            all_records.extend(records)
             
             # Log progreso cada 1000 registros
             if i % 1000 == 0:
                 logger.info(f"Procesados {i}/{total_records} registros...")
         
+        # Insertar todo el archivo: COPY a tabla temporal + upsert
+        def upsert(stmt):
+            stmt = stmt.on_conflict_do_update(
+                constraint='_bloque_hora_uc',
+                set_={
+                    'gate_entrada_contenedores': stmt.excluded.gate_entrada_contenedores,
+                    'gate_entrada_teus': stmt.excluded.gate_entrada_teus,
+                    'gate_salida_contenedores': stmt.excluded.gate_salida_contenedores,
+                    'gate_salida_teus': stmt.excluded.gate_salida_teus,
+                    'muelle_entrada_contenedores': stmt.excluded.muelle_entrada_contenedores,
+                    'muelle_entrada_teus': stmt.excluded.muelle_entrada_teus,
+                    'muelle_salida_contenedores': stmt.excluded.muelle_salida_contenedores,
+                    'muelle_salida_teus': stmt.excluded.muelle_salida_teus,
+                    'remanejos_contenedores': stmt.excluded.remanejos_contenedores,
+                    'remanejos_teus': stmt.excluded.remanejos_teus,
+                    'patio_entrada_contenedores': stmt.excluded.patio_entrada_contenedores,
+                    'patio_entrada_teus': stmt.excluded.patio_entrada_teus,
+                    'patio_salida_contenedores': stmt.excluded.patio_salida_contenedores,
+                    'patio_salida_teus': stmt.excluded.patio_salida_teus,
+                    'terminal_entrada_contenedores': stmt.excluded.terminal_entrada_contenedores,
+                    'terminal_entrada_teus': stmt.excluded.terminal_entrada_teus,
+                    'terminal_salida_contenedores': stmt.excluded.terminal_salida_contenedores,
+                    'terminal_salida_teus': stmt.excluded.terminal_salida_teus,
+                    'minimo_contenedores': stmt.excluded.minimo_contenedores,
+                    'minimo_teus': stmt.excluded.minimo_teus,
+                    'maximo_contenedores': stmt.excluded.maximo_contenedores,
+                    'maximos_teus': stmt.excluded.maximos_teus,
+                    'promedio_contenedores': stmt.excluded.promedio_contenedores,
+                    'promedio_teus': stmt.excluded.promedio_teus,
+                    'updated_at': datetime.utcnow()
+                }
+            )
+            return stmt
+        
+        await self._copy_upsert(HistoricalMovement, all_records, ['bloque', 'hora'], upsert)
+        
         logger.info(f"✅ Cargados {total_records} registros de movimientos exitosamente")
         return total_records
 
@@ -469,6 +697,8 @@ class CSVLoaderService:
         
         logger.info(f"Total de registros CDT a procesar: {total_records}")
         
+        all_records = []
+        
         for i in range(0, total_records, batch_size):
             batch_df = df.iloc[i:i+batch_size]
             records = []
@@ -576,83 +806,89 @@ class CSVLoaderService:
                     logger.debug(f"Error procesando registro CDT: {e}")
                     continue
             
-            # Insertar lote
-            if records:
-                try:
-                    stmt = insert(ContainerDwellTime).values(records)
-                    stmt = stmt.on_conflict_do_update(
-                        constraint='_cdt_gkey_type_uc',
-                        set_={
-                            'cv_it': stmt.excluded.cv_it,
-                            'iufv_it': stmt.excluded.iufv_it,
-                            'ime_it': stmt.excluded.ime_it,
-                            'cv_ot': stmt.excluded.cv_ot,
-                            'iufv_ot': stmt.excluded.iufv_ot,
-                            'ime_ot': stmt.excluded.ime_ot,
-                            'cdt_hours': stmt.excluded.cdt_hours,
-                            'ime_in_fm_pos_name': stmt.excluded.ime_in_fm_pos_name,
-                            'ime_in_to_pos_name': stmt.excluded.ime_in_to_pos_name,
-                            'ime_out_fm_pos_name': stmt.excluded.ime_out_fm_pos_name,
-                            'ime_out_to_pos_name': stmt.excluded.ime_out_to_pos_name,
-                            'iufv_arrive_pos_name': stmt.excluded.iufv_arrive_pos_name,
-                            'iufv_last_pos_name': stmt.excluded.iufv_last_pos_name,
-                            'patio': stmt.excluded.patio,
-                            'bloque': stmt.excluded.bloque,
-                            'updated_at': datetime.utcnow()
-                        }
-                    )
-                    
-                    await self.db.execute(stmt)
-                    await self.db.commit()
-                except Exception as e:
-                    await self.db.rollback()
-                    logger.error(f"Error insertando batch CDT: {e}")
-                    continue
+            all_records.extend(records)
             
             if i % 1000 == 0:
                 logger.info(f"Procesados {i}/{total_records} registros CDT...")
         
+        # Insertar todo el archivo: COPY a tabla temporal + upsert
+        def upsert(stmt):
+            stmt = stmt.on_conflict_do_update(
+                constraint='_cdt_gkey_type_uc',
+                set_={
+                    'cv_it': stmt.excluded.cv_it,
+                    'iufv_it': stmt.excluded.iufv_it,
+                    'ime_it': stmt.excluded.ime_it,
+                    'cv_ot': stmt.excluded.cv_ot,
+                    'iufv_ot': stmt.excluded.iufv_ot,
+                    'ime_ot': stmt.excluded.ime_ot,
+                    'cdt_hours': stmt.excluded.cdt_hours,
+                    'ime_in_fm_pos_name': stmt.excluded.ime_in_fm_pos_name,
+                    'ime_in_to_pos_name': stmt.excluded.ime_in_to_pos_name,
+                    'ime_out_fm_pos_name': stmt.excluded.ime_out_fm_pos_name,
+                    'ime_out_to_pos_name': stmt.excluded.ime_out_to_pos_name,
+                    'iufv_arrive_pos_name': stmt.excluded.iufv_arrive_pos_name,
+                    'iufv_last_pos_name': stmt.excluded.iufv_last_pos_name,
+                    'patio': stmt.excluded.patio,
+                    'bloque': stmt.excluded.bloque,
+                    'updated_at': datetime.utcnow()
+                }
+            )
+            return stmt
+        
+        await self._copy_upsert(ContainerDwellTime, all_records, ['iufv_gkey', 'operation_type'], upsert)
+        
         logger.info(f"✅ Cargados {processed} registros CDT exitosamente")
         return processed
 
-    async def load_ttt_csv(self, file_path: str, operation_type: str = 'import'):
+    async def load_ttt_csv(self, file_path: str, operation_type: str = 'import', staging_table: str = None):
         """
         Cargar CSV de Truck Turnaround Time (TTT) - VERSIÓN CORREGIDA
         Calcula TTT desde timestamps en lugar de confiar en el campo ttt del CSV
+        
+        Con staging_table (tabla vacía con las columnas de truck_turnaround_times, como
+        en reload_ttt.py) los registros van con COPY directo a esa tabla, sin upsert.
         """
         logger.info(f"Cargando archivo TTT {operation_type}: {file_path}")
         
-        # Leer CSV
-        df = pd.read_csv(file_path, sep=';', decimal=',', low_memory=False)
+        # Leer CSV por trozos: el DataFrame en memoria es de un trozo, no del archivo completo.
+        # Solo las columnas usadas y todas como texto: sin inferencia de tipos por trozo
+        # (clean_numeric_value / clean_float_value ya convierten desde texto, coma decimal incluida)
+        reader = pd.read_csv(
+            file_path,
+            sep=';',
+            usecols=lambda col: col in TTT_CSV_COLUMNS,
+            dtype=str,
+            chunksize=TTT_CSV_CHUNK
+        )
         
-        # Convertir columnas de fecha
+        # Columnas de fecha
         date_columns = [
             'cv_ata', 'cv_atd', 'cv_atay', 'cv_atdy',
             'pregate_ss', 'pregate_se', 'ingate_ss', 'ingate_se', 
             'outgate_ss', 'outgate_se'
         ]
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
         
-        batch_size = 100
-        total_records = len(df)
+        total_records = 0
         processed = 0
         duplicates = 0
         ttt_calculados = 0
         ttt_originales_usados = 0
         cleaning_stats = {}
         
-        logger.info(f"Total de registros TTT a procesar: {total_records}")
-        
-        # Diccionario para rastrear registros únicos por (iufv_gkey, operation_type)
+        # Diccionario para rastrear registros únicos por (iufv_gkey, operation_type);
+        # se mantiene entre trozos, los duplicados pueden venir en trozos distintos
         seen_records = {}
         
-        for i in range(0, total_records, batch_size):
-            batch_df = df.iloc[i:i+batch_size]
-            records = []
+        all_records = []
+        
+        for df in reader:
+            # Convertir columnas de fecha del trozo
+            for col in date_columns:
+                if col in df.columns:
+                    df[col] = pd.to_datetime(df[col], errors='coerce')
             
-            for _, row in batch_df.iterrows():
+            for _, row in df.iterrows():
                 try:
                     # Obtener iufv_gkey
                     iufv_gkey = clean_numeric_value(row.get('iufv_gkey'), 'iufv_gkey', cleaning_stats)
@@ -715,7 +951,7 @@ class CSVLoaderService:
                         ttt_calculados += 1
                     
                     # Log para debugging (solo primeros registros)
-                    if i < 10 and ttt_calculado:
+                    if total_records == 0 and ttt_calculado:
                         logger.debug(f"TTT calculado: {ttt_calculado} min usando {metodo_calculo} "
                                 f"(original: {row.get('ttt')})")
                     
@@ -751,63 +987,60 @@ class CSVLoaderService:
                     )
                     
                     seen_records[unique_key] = record
-                    records.append(record)
+                    all_records.append(record)
                     processed += 1
                     
                 except Exception as e:
                     logger.debug(f"Error procesando registro TTT: {e}")
                     continue
             
-            # Insertar lote
-            if records:
-                try:
-                    stmt = insert(TruckTurnaroundTime).values(records)
-                    
-                    # En conflicto, mantener el registro con mejor TTT
-                    stmt = stmt.on_conflict_do_update(
-                        constraint='_ttt_gkey_type_uc',
-                        set_={
-                            'ttt': case(
-                                # Si el nuevo TTT es válido y el existente no, usar el nuevo
-                                (and_(stmt.excluded.ttt.isnot(None), 
-                                    stmt.excluded.ttt > 0,
-                                    stmt.excluded.ttt < 480), 
-                                stmt.excluded.ttt),
-                                # En otros casos, mantener el existente
-                                else_=TruckTurnaroundTime.ttt
-                            ),
-                            'turn_time': stmt.excluded.turn_time,
-                            'cv_ata': stmt.excluded.cv_ata,
-                            'cv_atd': stmt.excluded.cv_atd,
-                            'cv_atay': stmt.excluded.cv_atay,
-                            'cv_atdy': stmt.excluded.cv_atdy,
-                            'pregate_ss': stmt.excluded.pregate_ss,
-                            'pregate_se': stmt.excluded.pregate_se,
-                            'ingate_ss': stmt.excluded.ingate_ss,
-                            'ingate_se': stmt.excluded.ingate_se,
-                            'outgate_ss': stmt.excluded.outgate_ss,
-                            'outgate_se': stmt.excluded.outgate_se,
-                            'pregate_time': stmt.excluded.pregate_time,
-                            'ingate_time': stmt.excluded.ingate_time,
-                            'outgate_time': stmt.excluded.outgate_time,
-                            'gate_gkey': stmt.excluded.gate_gkey,
-                            'hora_inicio': stmt.excluded.hora_inicio,
-                            'dia_semana': stmt.excluded.dia_semana,
-                            'turno': stmt.excluded.turno,
-                            'updated_at': datetime.utcnow()
-                        }
-                    )
-                    
-                    await self.db.execute(stmt)
-                    await self.db.commit()
-                except Exception as e:
-                    await self.db.rollback()
-                    logger.error(f"Error insertando batch TTT: {e}")
-                    continue
-            
-            if i % 1000 == 0:
-                logger.info(f"Procesados {i}/{total_records} registros TTT... "
-                        f"(Duplicados: {duplicates}, TTT calculados: {ttt_calculados})")
+            total_records += len(df)
+            logger.info(f"Procesados {total_records} registros TTT... "
+                    f"(Duplicados: {duplicates}, TTT calculados: {ttt_calculados})")
+        
+        # Insertar todo el archivo: COPY a tabla temporal + upsert
+        def upsert(stmt):
+            # En conflicto, mantener el registro con mejor TTT
+            stmt = stmt.on_conflict_do_update(
+                constraint='_ttt_gkey_type_uc',
+                set_={
+                    'ttt': case(
+                        # Si el nuevo TTT es válido y el existente no, usar el nuevo
+                        (and_(stmt.excluded.ttt.isnot(None), 
+                            stmt.excluded.ttt > 0,
+                            stmt.excluded.ttt < 480), 
+                        stmt.excluded.ttt),
+                        # En otros casos, mantener el existente
+                        else_=TruckTurnaroundTime.ttt
+                    ),
+                    'turn_time': stmt.excluded.turn_time,
+                    'cv_ata': stmt.excluded.cv_ata,
+                    'cv_atd': stmt.excluded.cv_atd,
+                    'cv_atay': stmt.excluded.cv_atay,
+                    'cv_atdy': stmt.excluded.cv_atdy,
+                    'pregate_ss': stmt.excluded.pregate_ss,
+                    'pregate_se': stmt.excluded.pregate_se,
+                    'ingate_ss': stmt.excluded.ingate_ss,
+                    'ingate_se': stmt.excluded.ingate_se,
+                    'outgate_ss': stmt.excluded.outgate_ss,
+                    'outgate_se': stmt.excluded.outgate_se,
+                    'pregate_time': stmt.excluded.pregate_time,
+                    'ingate_time': stmt.excluded.ingate_time,
+                    'outgate_time': stmt.excluded.outgate_time,
+                    'gate_gkey': stmt.excluded.gate_gkey,
+                    'hora_inicio': stmt.excluded.hora_inicio,
+                    'dia_semana': stmt.excluded.dia_semana,
+                    'turno': stmt.excluded.turno,
+                    'updated_at': datetime.utcnow()
+                }
+            )
+            return stmt
+        
+        if staging_table:
+            # Tabla vacía: los registros ya son únicos por (iufv_gkey, operation_type)
+            await self._copy_insert(TruckTurnaroundTime, all_records, staging_table)
+        else:
+            await self._copy_upsert(TruckTurnaroundTime, all_records, ['iufv_gkey', 'operation_type'], upsert)
         
         # Mostrar estadísticas de limpieza
         logger.info("\n=== ESTADÍSTICAS DE LIMPIEZA TTT ===")
@@ -5,10 +5,18 @@ from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
 import logging
 import re
+import uuid
 from app.models.movement_flow import MovementFlow
 
 logger = logging.getLogger(__name__)
 
+# Posición de un flujo: "C3" o "Y-SAI-C3..." (una sola expresión compilada por línea)
+_POSITION_RE = re.compile(r'([CHT])(\d)|Y-SAI-([CHT])(\d).*', re.DOTALL)
+PATIO_POR_LETRA = {'C': 'costanera', 'H': 'ohiggins', 'T': 'tebas'}
+
+# Filas por trozo al leer el CSV de flujos
+FLOW_CSV_CHUNK = 200_000
+
 class MovementFlowLoaderService:
     def __init__(self, db: AsyncSession):
         self.db = db
@@ -23,96 +31,39 @@ class MovementFlowLoaderService:
         
         position = str(position).strip().upper()
         
-        # Ignorar posiciones especiales
-        if position in ['GATE', 'Y-SAI-RAMP', 'Y-SAI-M10', 'VESSEL']:
-            return None, None
-        
-        # Formato simple: C3, H5, T2
-        if len(position) == 2 and position[0] in ['C', 'H', 'T'] and position[1].isdigit():
-            letra = position[0]
-            if letra == 'C':
-                return 'costanera', position
-            elif letra == 'H':
-                return 'ohiggins', position
-            elif letra == 'T':
-                return 'tebas', position
-        
-        # Formato Y-SAI-XXX
-        if position.startswith('Y-SAI-') and len(position) > 6:
-            codigo = position[6:]
-            if len(codigo) >= 2 and codigo[0] in ['C', 'H', 'T'] and codigo[1].isdigit():
-                letra = codigo[0]
-                digito = codigo[1]
-                bloque = f"{letra}{digito}"
-                
-                if letra == 'C':
-                    return 'costanera', bloque
-                elif letra == 'H':
-                    return 'ohiggins', bloque
-                elif letra == 'T':
-                    return 'tebas', bloque
+        # Formato simple (C3, H5, T2) o Y-SAI-XXX; GATE, VESSEL, Y-SAI-RAMP, etc. no calzan
+        match = _POSITION_RE.fullmatch(position)
+        if match:
+            letra = match.group(1) or match.group(3)
+            digito = match.group(2) or match.group(4)
+            return PATIO_POR_LETRA[letra], f"{letra}{digito}"
         
         return None, None
     
-    async def load_movement_flows_csv(self, file_path: str, year_from: int = 2017, year_to: int = None):
+    def _prepare_flows_chunk(self, df: pd.DataFrame, year_from: int, year_to: int = None) -> tuple[pd.DataFrame, int]:
         """
-        Cargar CSV de flujos de movimiento filtrando por años
-        
-        Args:
-            file_path: Ruta del archivo CSV
-            year_from: Año desde el cual cargar datos (default: 2017)
-            year_to: Año hasta el cual cargar datos (default: None = hasta el último año)
+        Limpiar columnas, convertir tipos y filtrar por años un trozo del CSV de flujos.
+        Retorna el trozo filtrado y la cantidad de filas antes del filtro.
         """
-        logger.info(f"Cargando archivo de flujos: {file_path}")
-        logger.info(f"Filtrando datos desde {year_from} hasta {year_to or 'el último año'}")
-        
-        # Leer CSV con manejo de errores
-        df = pd.read_csv(
-            file_path, 
-            sep=';', 
-            dtype=str,  # Leer todo como string inicialmente
-            engine='python',
-            on_bad_lines='skip'
-        )
-        
         # Limpiar nombres de columnas
         df.columns = [col.strip() for col in df.columns]
         
-        # Eliminar columnas vacías
+        # Eliminar columnas sin nombre (no se descartan columnas vacías por trozo:
+        # una columna puede venir vacía en un trozo y con datos en otro)
         df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-        df = df.dropna(how='all', axis=1)
-        
-        # Convertir columnas
-        logger.info("Convirtiendo tipos de datos...")
         
         # Fecha/hora
         df['ime_time'] = pd.to_datetime(df['ime_time'], errors='coerce')
         
         # FILTRAR POR AÑO
-        df_before_filter = len(df)
+        before_filter = len(df)
         df = df[df['ime_time'].notna()]  # Eliminar fechas inválidas
         
         # Aplicar filtro de año
         df = df[df['ime_time'].dt.year >= year_from]
         if year_to:
             df = df[df['ime_time'].dt.year <= year_to]
-        
-        df_after_filter = len(df)
-        logger.info(f"Registros antes del filtro: {df_before_filter}")
-        logger.info(f"Registros después del filtro: {df_after_filter}")
-        logger.info(f"Registros eliminados: {df_before_filter - df_after_filter}")
-        
-        # Mostrar rango de fechas
-        if len(df) > 0:
-            min_date = df['ime_time'].min()
-            max_date = df['ime_time'].max()
-            logger.info(f"Rango de fechas: {min_date} hasta {max_date}")
-            
-            # Mostrar distribución por año
-            year_counts = df['ime_time'].dt.year.value_counts().sort_index()
-            logger.info("\nDistribución por año:")
-            for year, count in year_counts.items():
-                logger.info(f"  {year}: {count:,} registros")
+        df = df.copy()
         
         # Numéricos
         if 'ime_ufv_gkey' in df.columns:
@@ -122,21 +73,59 @@ class MovementFlowLoaderService:
         df['ig_hazardous'] = df['ig_hazardous'].fillna('0').astype(str).str.strip() == '1'
         df['iu_requires_power'] = df['iu_requires_power'].fillna('0').astype(str).str.strip() == '1'
         
-        # Filtrar registros válidos
-        df = df.dropna(subset=['ime_time', 'ime_ufv_gkey'])
+        return df, before_filter
+    
+    async def load_movement_flows_csv(self, file_path: str, year_from: int = 2017, year_to: int = None):
+        """
+        Cargar CSV de flujos de movimiento filtrando por años
         
-        # Procesar en lotes
-        batch_size = 1000
-        total_records = len(df)
-        processed = 0
+        Args:
+            file_path: Ruta del archivo CSV
+            year_from: Año desde el cual cargar datos (default: 2017)
+            year_to: Año hasta el cual cargar datos (default: None = hasta el último año)
+        """
+        logger.info(f"Cargando archivo de flujos: {file_path}")
+        logger.info(f"Filtrando datos desde {year_from} hasta {year_to or 'el último año'}")
         
-        logger.info(f"Total de registros a procesar: {total_records}")
+        # Leer CSV por trozos: la memoria queda acotada a un trozo, no al archivo completo.
+        # Parser en C (el de Python es mucho más lento y no aporta nada con separador de
+        # un carácter); también descarta las líneas mal formadas
+        reader = pd.read_csv(
+            file_path, 
+            sep=';', 
+            dtype=str,  # Leer todo como string inicialmente
+            engine='c',
+            on_bad_lines='skip',
+            chunksize=FLOW_CSV_CHUNK
+        )
+        
+        processed = 0
+        offset = 0
+        df_before_filter = 0
+        df_after_filter = 0
+        min_date = max_date = None
+        year_counts = pd.Series(dtype='int64')
         
-        for i in range(0, total_records, batch_size):
-            batch_df = df.iloc[i:i+batch_size]
+        for df in reader:
+            df, chunk_before_filter = self._prepare_flows_chunk(df, year_from, year_to)
+            df_before_filter += chunk_before_filter
+            df_after_filter += len(df)
+            
+            if len(df) > 0:
+                chunk_min = df['ime_time'].min()
+                chunk_max = df['ime_time'].max()
+                min_date = chunk_min if min_date is None else min(min_date, chunk_min)
+                max_date = chunk_max if max_date is None else max(max_date, chunk_max)
+                year_counts = year_counts.add(df['ime_time'].dt.year.value_counts(), fill_value=0)
+            
+            # Filtrar registros válidos
+            df = df.dropna(subset=['ime_time', 'ime_ufv_gkey'])
+            
+            # Construir los registros del trozo
             records = []
+            now = datetime.utcnow()  # una marca de tiempo por trozo, no dos por fila
             
-            for _, row in batch_df.iterrows():
+            for _, row in df.iterrows():
                 try:
                     # Extraer patio y bloque del ime_fm
                     patio, bloque = self.extract_patio_bloque(row.get('ime_fm'))
@@ -151,8 +140,8 @@ class MovementFlowLoaderService:
                         'criterio_ii': str(row.get('criterio_ii', ''))[:100] if pd.notna(row.get('criterio_ii')) else None,
                         'criterio_iii': str(row.get('criterio_iii', ''))[:100] if pd.notna(row.get('criterio_iii')) else None,
                         'iu_category': str(row.get('iu_category', ''))[:10] if pd.notna(row.get('iu_category')) else None,
-                        'ig_hazardous': row.get('ig_hazardous', False),
-                        'iu_requires_power': row.get('iu_requires_power', False),
+                        'ig_hazardous': bool(row.get('ig_hazardous', False)),
+                        'iu_requires_power': bool(row.get('iu_requires_power', False)),
                         'iu_freight_kind': str(row.get('iu_freight_kind', ''))[:10] if pd.notna(row.get('iu_freight_kind')) else None,
                         'ret_nominal_length': str(row.get('ret_nominal_length', ''))[:10] if pd.notna(row.get('ret_nominal_length')) else None,
                         'ibcv_id': str(row.get('ibcv_id', ''))[:50] if pd.notna(row.get('ibcv_id')) else None,
@@ -165,38 +154,37 @@ class MovementFlowLoaderService:
                         'iufv_stacking_factor': str(row.get('iufv_stacking_factor', ''))[:100] if pd.notna(row.get('iufv_stacking_factor')) else None,
                         'patio': patio,
                         'bloque': bloque,
-                        'created_at': datetime.utcnow(),
-                        'updated_at': datetime.utcnow(),
+                        'created_at': now,
+                        'updated_at': now,
                         'is_active': True
                     }
                     
                     records.append(record)
                     processed += 1
-                    
+                
                 except Exception as e:
                     logger.debug(f"Error procesando registro: {e}")
                     continue
             
-            # Insertar lote
-            if records:
-                try:
-                    stmt = insert(MovementFlow).values(records)
-                    await self.db.execute(stmt)
-                    await self.db.commit()
-                except Exception as e:
-                    await self.db.rollback()
-                    logger.error(f"Error insertando batch: {e}")
-                    # Intentar insertar uno por uno
-                    for record in records:
-                        try:
-                            stmt = insert(MovementFlow).values(record)
-                            await self.db.execute(stmt)
-                            await self.db.commit()
-                        except:
-                            continue
+            # Insertar el trozo completo
+            await self._copy_flows(records)
+            
+            logger.info(f"Procesados {offset + len(df):,} registros...")
+            
+            offset += len(df)
+        
+        logger.info(f"Registros antes del filtro: {df_before_filter}")
+        logger.info(f"Registros después del filtro: {df_after_filter}")
+        logger.info(f"Registros eliminados: {df_before_filter - df_after_filter}")
+        
+        # Mostrar rango de fechas
+        if min_date is not None:
+            logger.info(f"Rango de fechas: {min_date} hasta {max_date}")
             
-            if i % 10000 == 0:
-                logger.info(f"Procesados {i}/{total_records} registros...")
+            # Mostrar distribución por año
+            logger.info("\nDistribución por año:")
+            for year, count in year_counts.sort_index().items():
+                logger.info(f"  {int(year)}: {int(count):,} registros")
         
         logger.info(f"✅ Cargados {processed} registros de flujos exitosamente")
         
@@ -205,6 +193,50 @@ class MovementFlowLoaderService:
         
         return processed
     
+    async def _copy_flows(self, records: list):
+        """
+        Insertar registros de flujos con COPY binario (un solo envío por trozo);
+        si falla, INSERT por lotes y, ante error de un lote, fila por fila
+        """
+        if not records:
+            return
+        
+        columns = ['id'] + list(records[0])
+        try:
+            # COPY por la conexión asyncpg de la sesión (misma transacción)
+            conn = await self.db.connection()
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                MovementFlow.__tablename__,
+                records=[(str(uuid.uuid4()), *r.values()) for r in records],
+                columns=columns
+            )
+            await self.db.commit()
+            return
+        except Exception as e:
+            await self.db.rollback()
+            logger.warning(f"COPY falló para {MovementFlow.__tablename__} ({e}); usando INSERT por lotes")
+        
+        batch_size = 1000
+        for i in range(0, len(records), batch_size):
+            batch = records[i:i + batch_size]
+            try:
+                stmt = insert(MovementFlow).values(batch)
+                await self.db.execute(stmt)
+                await self.db.commit()
+            except Exception as e:
+                await self.db.rollback()
+                logger.error(f"Error insertando batch: {e}")
+                # Intentar insertar uno por uno
+                for record in batch:
+                    try:
+                        stmt = insert(MovementFlow).values(record)
+                        await self.db.execute(stmt)
+                        await self.db.commit()
+                    except:
+                        await self.db.rollback()
+                        continue
+    
     async def show_statistics(self):
         """Mostrar estadísticas de los datos cargados"""
         from sqlalchemy import select, func, extract
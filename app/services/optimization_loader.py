@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete, and_, func, update
 from sqlalchemy.sql import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import logging
 from uuid import UUID
 import re
@@ -13,18 +14,26 @@ import json
 from pathlib import Path
 
 from app.models.optimization import *
+from app.utils.excel import ParsedWorkbook, open_excel
 
 logger = logging.getLogger(__name__)
 
 class OptimizationLoader:
     """Servicio para cargar datos del modelo de optimización"""
     
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, workbooks: Optional[Dict[str, ParsedWorkbook]] = None):
         self.db = db
         self.validation_errors = []
         self.warnings = []
         self._distancias_cache = {}
         self.distancias_modelo_filepath = None
+        # Libros ya leídos fuera del event loop (ruta -> ParsedWorkbook)
+        self._workbooks = workbooks or {}
+    
+    def _open_excel(self, filepath: str):
+        """Libro ya leído si se entregó al crear el loader; si no, se abre desde disco"""
+        workbook = self._workbooks.get(str(filepath))
+        return workbook if workbook is not None else open_excel(filepath)
         
     async def load_optimization_results(
         self,
@@ -36,9 +45,15 @@ class OptimizationLoader:
         semana: int,
         anio: int,
         participacion: int,
-        con_dispersion: bool
+        con_dispersion: bool,
+        commit: bool = True
     ) -> UUID:
-        """Carga completa de resultados de optimización"""
+        """
+        Carga completa de resultados de optimización
+        
+        Con commit=False no confirma ni deshace la transacción: queda a cargo del
+        llamador (p. ej. un savepoint por carga y un solo commit por fecha).
+        """
         
         # Guardar referencia al archivo de distancias del modelo
         self.distancias_modelo_filepath = distancias_filepath
@@ -95,7 +110,8 @@ class OptimizationLoader:
             )
             
             # Commit final
-            await self.db.commit()
+            if commit:
+                await self.db.commit()
             
             # Log resumen
             self._log_summary(instancia.id, stats_resultado, stats_flujos, kpis_stats)
@@ -103,7 +119,8 @@ class OptimizationLoader:
             return instancia.id
             
         except Exception as e:
-            await self.db.rollback()
+            if commit:
+                await self.db.rollback()
             logger.error(f"❌ Error cargando optimización: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
@@ -212,11 +229,11 @@ class OptimizationLoader:
             
             if self.distancias_modelo_filepath and Path(self.distancias_modelo_filepath).exists():
                 logger.info(f"Leyendo distancias del modelo desde: {self.distancias_modelo_filepath}")
-                xl = pd.ExcelFile(self.distancias_modelo_filepath)
+                xl = self._open_excel(self.distancias_modelo_filepath)
                 
                 # Leer resumen semanal
                 if 'Resumen Semanal' in xl.sheet_names:
-                    df_resumen = pd.read_excel(xl, 'Resumen Semanal')
+                    df_resumen = xl.parse('Resumen Semanal')
                     if len(df_resumen) > 0:
                         distancia_modelo_total = int(df_resumen.iloc[0]['Distancia Total'])
                         distancia_modelo_load = int(df_resumen.iloc[0]['Distancia LOAD'])
@@ -611,7 +628,7 @@ class OptimizationLoader:
         logger.info("Cargando archivo de resultados...")
         
         try:
-            xl = pd.ExcelFile(filepath)
+            xl = self._open_excel(filepath)
             logger.info(f"Hojas disponibles: {xl.sheet_names}")
             
             stats = {
@@ -632,7 +649,7 @@ class OptimizationLoader:
             
             # 0. NUEVO: Actualizar capacidades de bloques desde hoja Ocupación Bloques
             if 'Ocupación Bloques' in xl.sheet_names:
-                df_ocupacion = pd.read_excel(xl, 'Ocupación Bloques')
+                df_ocupacion = xl.parse('Ocupación Bloques')
                 logger.info("Actualizando capacidades de bloques desde archivo...")
                 
                 # Obtener capacidades únicas por bloque
@@ -644,22 +661,13 @@ class OptimizationLoader:
                     if bloque_codigo and capacidad > 0 and bloque_codigo not in capacidades_bloques:
                         capacidades_bloques[bloque_codigo] = int(capacidad)
                 
-                # Actualizar capacidades en base de datos
-                for bloque_codigo, capacidad in capacidades_bloques.items():
-                    if bloque_codigo in bloques_map:
-                        await self.db.execute(
-                            update(Bloque)
-                            .where(Bloque.id == bloques_map[bloque_codigo])
-                            .values(capacidad_teus=capacidad)
-                        )
-                        logger.info(f"  - {bloque_codigo}: {capacidad} TEUs")
-                
-                await self.db.flush()
+                # Actualizar capacidades en base de datos (bloques compartidos entre fechas)
+                await self._update_capacidades(capacidades_bloques, bloques_map)
                 stats['capacidades_actualizadas'] = True
             
             # 1. Cargar hoja General (movimientos del modelo)
             if 'General' in xl.sheet_names:
-                df_general = pd.read_excel(xl, 'General')
+                df_general = xl.parse('General')
                 logger.info(f"Procesando {len(df_general)} registros de General")
                 
                 batch = []
@@ -708,7 +716,7 @@ class OptimizationLoader:
             
             # 2. Cargar Total bloques (asignaciones) - MEJORADO
             if 'Total bloques' in xl.sheet_names:
-                df_bloques = pd.read_excel(xl, 'Total bloques')
+                df_bloques = xl.parse('Total bloques')
                 logger.info(f"Procesando asignaciones de bloques")
                 
                 for idx, row in df_bloques.iterrows():
@@ -740,7 +748,7 @@ class OptimizationLoader:
             
             # 3. Cargar Workload bloques
             if 'Workload bloques' in xl.sheet_names:
-                df_workload = pd.read_excel(xl, 'Workload bloques')
+                df_workload = xl.parse('Workload bloques')
                 logger.info(f"Procesando {len(df_workload)} registros de Workload")
                 
                 batch = []
@@ -787,7 +795,7 @@ class OptimizationLoader:
             
             # 4. NUEVO: Cargar Carga máx-min si existe
             if 'Carga máx-min' in xl.sheet_names:
-                df_carga_maxmin = pd.read_excel(xl, 'Carga máx-min')
+                df_carga_maxmin = xl.parse('Carga máx-min')
                 logger.info("Procesando cargas máximas y mínimas por periodo")
                 
                 for idx, row in df_carga_maxmin.iterrows():
@@ -815,7 +823,7 @@ class OptimizationLoader:
             
             # 5. Cargar Contenedores Turno-Bloque (ocupación) - MEJORADO
             if 'Contenedores Turno-Bloque' in xl.sheet_names:
-                df_contenedores = pd.read_excel(xl, 'Contenedores Turno-Bloque')
+                df_contenedores = xl.parse('Contenedores Turno-Bloque')
                 logger.info(f"Procesando ocupación por turno-bloque")
                 
                 batch = []
@@ -830,8 +838,10 @@ class OptimizationLoader:
                             contenedores = int(row.get(bloque_codigo, 0))
                             
                             # Obtener capacidad actualizada del bloque
+                            # populate_existing: la capacidad se actualizó en otra transacción
                             bloque_result = await self.db.execute(
                                 select(Bloque).where(Bloque.codigo == bloque_codigo)
+                                .execution_options(populate_existing=True)
                             )
                             bloque = bloque_result.scalar_one()
                             
@@ -865,7 +875,7 @@ class OptimizationLoader:
             # 6. Procesar hoja de Variación Carga de trabajo
             if 'Variación Carga de trabajo' in xl.sheet_names:
                 try:
-                    df_var = pd.read_excel(xl, 'Variación Carga de trabajo')
+                    df_var = xl.parse('Variación Carga de trabajo')
                     logger.info(f"Procesando hoja Variación Carga de trabajo")
                     
                     variacion_valor = None
@@ -956,19 +966,10 @@ class OptimizationLoader:
         dispersion_str = 'K' if con_dispersion else 'N'
         codigo = f"{fecha_str}_{participacion}_{dispersion_str}"
         
-        # Buscar instancia existente
-        query = select(Instancia).where(Instancia.codigo == codigo)
-        result = await self.db.execute(query)
-        instancia = result.scalar_one_or_none()
-        
-        if instancia:
-            logger.info(f"Actualizando instancia existente: {instancia.id}")
-            # Limpiar datos anteriores
-            await self._delete_instancia_data(instancia.id)
-            instancia.fecha_procesamiento = datetime.utcnow()
-        else:
-            logger.info("Creando nueva instancia")
-            instancia = Instancia(
+        # Crear la instancia si no existe (INSERT ... ON CONFLICT: con cargas en paralelo
+        # no hay ventana entre buscar e insertar); sin id retornado, ya existía
+        result = await self.db.execute(
+            pg_insert(Instancia).values(
                 codigo=codigo,
                 fecha_inicio=fecha_inicio,
                 fecha_fin=fecha_fin,
@@ -982,9 +983,20 @@ class OptimizationLoader:
                 turnos_por_dia=3,
                 estado='procesando',
                 fecha_procesamiento=datetime.utcnow()
-            )
-            self.db.add(instancia)
-            await self.db.flush()
+            ).on_conflict_do_nothing(index_elements=['codigo']).returning(Instancia.id)
+        )
+        nueva_id = result.scalar_one_or_none()
+        
+        if nueva_id is not None:
+            logger.info("Creando nueva instancia")
+            instancia = await self.db.get(Instancia, nueva_id)
+        else:
+            result = await self.db.execute(select(Instancia).where(Instancia.codigo == codigo))
+            instancia = result.scalar_one()
+            logger.info(f"Actualizando instancia existente: {instancia.id}")
+            # Limpiar datos anteriores
+            await self._delete_instancia_data(instancia.id)
+            instancia.fecha_procesamiento = datetime.utcnow()
         
         logger.info(f"Instancia ID: {instancia.id}, Código: {codigo}")
         return instancia
@@ -1019,30 +1031,72 @@ class OptimizationLoader:
                 'C5': 490, 'C6': 1015, 'C7': 1015, 'C8': 980, 'C9': 420
             }
             
-            for codigo, capacidad in capacidades.items():
-                bloque = Bloque(
-                    codigo=codigo,
-                    capacidad_teus=capacidad,
-                    capacidad_bahias=35,  # Por defecto
-                    capacidad_original=capacidad  # Guardar original
-                )
-                self.db.add(bloque)
-            
-            await self.db.flush()
+            # Otra carga en paralelo puede estar creándolos: ON CONFLICT, confirmado aparte
+            await self._insert_referencia(
+                pg_insert(Bloque).values([
+                    {
+                        'codigo': codigo,
+                        'capacidad_teus': capacidad,
+                        'capacidad_bahias': 35,  # Por defecto
+                        'capacidad_original': capacidad  # Guardar original
+                    }
+                    for codigo, capacidad in capacidades.items()
+                ]).on_conflict_do_nothing(index_elements=['codigo'])
+            )
             logger.info(f"✓ Creados {len(capacidades)} bloques")
     
+    async def _insert_referencia(self, stmt):
+        """
+        Ejecutar un INSERT ... ON CONFLICT DO NOTHING de datos de referencia (bloques,
+        segregaciones) en una transacción corta propia, confirmada al instante.
+        Así la fila no queda bloqueada durante la transacción larga de la carga: las
+        cargas en paralelo no esperan por ella ni pueden entrar en deadlock.
+        """
+        if self.db.bind is None:
+            await self.db.execute(stmt)
+            return
+        async with self.db.bind.begin() as conn:
+            await conn.execute(stmt)
+    
+    async def _update_capacidades(self, capacidades: Dict[str, int], bloques_map: Dict[str, int]):
+        """
+        Actualizar la capacidad de los bloques en una transacción corta propia (como
+        _insert_referencia): los bloques son compartidos por todas las fechas y el lock
+        de fila no debe durar toda la carga. Se actualizan ordenados por código para
+        que cargas en paralelo tomen los locks en el mismo orden.
+        """
+        stmts = []
+        for bloque_codigo, capacidad in sorted(capacidades.items()):
+            if bloque_codigo in bloques_map:
+                stmts.append(
+                    update(Bloque)
+                    .where(Bloque.id == bloques_map[bloque_codigo])
+                    .values(capacidad_teus=capacidad)
+                )
+                logger.info(f"  - {bloque_codigo}: {capacidad} TEUs")
+        
+        if not stmts:
+            return
+        if self.db.bind is None:
+            for stmt in stmts:
+                await self.db.execute(stmt)
+            return
+        async with self.db.bind.begin() as conn:
+            for stmt in stmts:
+                await conn.execute(stmt)
+    
     async def _load_instancia_file(self, filepath: str, instancia_id: UUID) -> Dict[str, Any]:
         """Carga archivo de instancia con parámetros"""
         
         logger.info("Cargando archivo de instancia...")
         
         try:
-            xl = pd.ExcelFile(filepath)
+            xl = self._open_excel(filepath)
             stats = {'parametros': 0, 'segregaciones_info': 0}
             
             # Cargar información de segregaciones si existe
             if 'S' in xl.sheet_names:
-                df_s = pd.read_excel(xl, 'S')
+                df_s = xl.parse('S')
                 for idx, row in df_s.iterrows():
                     if pd.notna(row.iloc[0]):
                         codigo = str(row.iloc[0]).strip()
@@ -1065,7 +1119,7 @@ class OptimizationLoader:
         logger.info("Cargando archivo de flujos reales...")
         
         try:
-            df = pd.read_excel(filepath)
+            df = self._open_excel(filepath).parse(0)
             logger.info(f"Procesando {len(df)} movimientos reales")
             
             stats = {
@@ -1159,7 +1213,7 @@ class OptimizationLoader:
             filename = Path(filepath).name
             es_costanera = 'Costanera' in filename
             
-            xl = pd.ExcelFile(filepath)
+            xl = self._open_excel(filepath)
             logger.info(f"Hojas de distancias disponibles: {xl.sheet_names}")
             logger.info(f"Es archivo Costanera: {'Sí' if es_costanera else 'No'}")
             
@@ -1169,7 +1223,7 @@ class OptimizationLoader:
             if es_costanera:
                 # 1. Cargar distancias entre bloques (hoja "Remanejo")
                 if 'Remanejo' in xl.sheet_names:
-                    df_remanejo = pd.read_excel(xl, 'Remanejo')
+                    df_remanejo = xl.parse('Remanejo')
                     logger.info("Cargando distancias entre bloques desde hoja Remanejo...")
                     
                     # La primera columna tiene los bloques origen
@@ -1193,7 +1247,7 @@ class OptimizationLoader:
                 
                 # 2. Cargar distancias bloque-gate (hoja "All")
                 if 'All' in xl.sheet_names:
-                    df_all = pd.read_excel(xl, 'All')
+                    df_all = xl.parse('All')
                     logger.info("Cargando distancias bloque-gate y bloque-sitio desde hoja All...")
                     
                     for idx, row in df_all.iterrows():
@@ -1233,7 +1287,7 @@ class OptimizationLoader:
                 
                 # 3. Cargar hoja "Distancias" si existe (formato ime_fm, ime_to)
                 if 'Distancias' in xl.sheet_names:
-                    df_dist = pd.read_excel(xl, 'Distancias')
+                    df_dist = xl.parse('Distancias')
                     logger.info("Cargando distancias desde hoja 'Distancias'...")
                     
                     for idx, row in df_dist.iterrows():
@@ -1253,7 +1307,7 @@ class OptimizationLoader:
                 
                 # 4. Cargar distancias de carga promedio si existe
                 if 'CargaAvg' in xl.sheet_names:
-                    df_carga = pd.read_excel(xl, 'CargaAvg')
+                    df_carga = xl.parse('CargaAvg')
                     logger.info("Cargando distancias promedio de carga...")
                     
                     for idx, row in df_carga.iterrows():
@@ -1426,11 +1480,10 @@ class OptimizationLoader:
         return {b.codigo: b.id for b in bloques}
     
     async def _get_or_create_segregacion(self, codigo: str, descripcion: str = '') -> Segregacion:
-        """Obtiene o crea una segregación"""
+        """Obtiene o crea una segregación (ON CONFLICT: segura con cargas en paralelo)"""
         
-        result = await self.db.execute(
-            select(Segregacion).where(Segregacion.codigo == codigo)
-        )
+        query = select(Segregacion).where(Segregacion.codigo == codigo)
+        result = await self.db.execute(query)
         segregacion = result.scalar_one_or_none()
         
         if not segregacion:
@@ -1456,15 +1509,19 @@ class OptimizationLoader:
                 elif '-40-' in descripcion:
                     tamano = 40
             
-            segregacion = Segregacion(
-                codigo=codigo,
-                descripcion=descripcion,
-                tipo=tipo,
-                categoria=categoria,
-                tamano=tamano
+            await self._insert_referencia(
+                pg_insert(Segregacion).values(
+                    codigo=codigo,
+                    descripcion=descripcion,
+                    tipo=tipo,
+                    categoria=categoria,
+                    tamano=tamano
+                ).on_conflict_do_nothing(index_elements=['codigo'])
             )
-            self.db.add(segregacion)
-            await self.db.flush()
+            
+            # Creada aquí o por otra carga: ya confirmada, visible para esta sesión
+            result = await self.db.execute(query)
+            segregacion = result.scalar_one()
         
         return segregacion
     
@@ -9,11 +9,13 @@ from datetime import datetime
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from app.models.sai_flujos import (
     SAIConfiguration, SAIFlujo, SAIVolumenBloque, SAIVolumenSegregacion,
     SAISegregacion, SAICapacidadBloque, SAIMapeoCriterios
 )
+from app.utils.excel import EXCEL_ENGINE, open_excel
 
 logger = logging.getLogger(__name__)
 
@@ -45,20 +47,22 @@ class SAIFlujosLoader:
         logger.info(f"Cargando instancia desde {file_path}")
         
         try:
-            excel_data = pd.ExcelFile(file_path)
+            excel_data = open_excel(file_path)
             
             # 1. Cargar segregaciones
             if 'S' in excel_data.sheet_names:
-                df_segregaciones = pd.read_excel(file_path, sheet_name='S')
+                df_segregaciones = excel_data.parse(sheet_name='S')
                 
                 # Cargar TEUs
                 teus_map = {}
                 if 'TEU_s' in excel_data.sheet_names:
-                    df_teus = pd.read_excel(file_path, sheet_name='TEU_s')
+                    df_teus = excel_data.parse(sheet_name='TEU_s')
                     for _, row in df_teus.iterrows():
                         teus_map[str(row['S'])] = int(row['TEU'])
                 
-                # Procesar segregaciones
+                # Procesar segregaciones (insert único; las existentes se omiten en la base,
+                # así varias fechas pueden cargar instancias en paralelo sin chocar)
+                segregaciones = []
                 for idx, row in df_segregaciones.iterrows():
                     seg_id = str(row['S'])
                     seg_nombre = str(row['Segregacion'])
@@ -69,28 +73,30 @@ class SAIFlujosLoader:
                     categoria = 'reefer' if 'reefer' in seg_nombre else 'dry'
                     direccion = 'impo' if 'impo' in seg_nombre else 'expo'
                     
-                    # Verificar si ya existe
-                    existing = await self.db.execute(
-                        select(SAISegregacion).where(SAISegregacion.id == seg_id)
+                    segregaciones.append(dict(
+                        id=seg_id,
+                        nombre=seg_nombre,
+                        teus=teus,
+                        tipo=tipo,
+                        categoria=categoria,
+                        direccion=direccion,
+                        color=self.segregacion_colors[idx % len(self.segregacion_colors)]
+                    ))
+                
+                if segregaciones:
+                    # Ordenadas por id: cargas en paralelo toman los locks del índice
+                    # único en el mismo orden y no pueden entrar en deadlock
+                    segregaciones.sort(key=lambda s: s['id'])
+                    await self.db.execute(
+                        pg_insert(SAISegregacion).values(segregaciones).on_conflict_do_nothing()
                     )
-                    if not existing.scalar():
-                        segregacion = SAISegregacion(
-                            id=seg_id,
-                            nombre=seg_nombre,
-                            teus=teus,
-                            tipo=tipo,
-                            categoria=categoria,
-                            direccion=direccion,
-                            color=self.segregacion_colors[idx % len(self.segregacion_colors)]
-                        )
-                        self.db.add(segregacion)
                 
                 logger.info(f"Cargadas {len(df_segregaciones)} segregaciones")
             
             # 2. Cargar capacidades de bloques
             capacidades = {}
             if 'C_b' in excel_data.sheet_names:
-                df_capacidades = pd.read_excel(file_path, sheet_name='C_b')
+                df_capacidades = excel_data.parse(sheet_name='C_b')
                 for _, row in df_capacidades.iterrows():
                     bloque = str(row['B'])
                     capacidades[bloque] = int(row['C'])
@@ -98,7 +104,7 @@ class SAIFlujosLoader:
             # Cargar VS_b (contenedores por bahía)
             vs_map = {}
             if 'VS_b' in excel_data.sheet_names:
-                df_vs = pd.read_excel(file_path, sheet_name='VS_b')
+                df_vs = excel_data.parse(sheet_name='VS_b')
                 for _, row in df_vs.iterrows():
                     vs_map[str(row['B'])] = int(row['VS'])
             
@@ -124,24 +130,20 @@ class SAIFlujosLoader:
                 'T1': 0, 'T2': 0, 'T3': 0, 'T4': 0
             }
             
-            # Crear registros de capacidad
-            for bloque, capacidad_contenedores in BLOCK_CAPACITIES.items():
-                existing = await self.db.execute(
-                    select(SAICapacidadBloque).where(SAICapacidadBloque.bloque == bloque)
-                )
-                if not existing.scalar():
-                    bahias_totales = BLOCK_TOTAL_BAYS.get(bloque, 30)
-                    contenedores_por_bahia = vs_map.get(bloque, 35)
-                    
-                    capacidad = SAICapacidadBloque(
+            # Crear registros de capacidad (los bloques existentes se omiten en la base)
+            await self.db.execute(
+                pg_insert(SAICapacidadBloque).values([
+                    dict(
                         bloque=bloque,
                         capacidad_contenedores=capacidad_contenedores,
                         capacidad_teus=capacidades.get(bloque, capacidad_contenedores * 2),
-                        bahias_totales=bahias_totales,
+                        bahias_totales=BLOCK_TOTAL_BAYS.get(bloque, 30),
                         bahias_reefer=BLOCK_REEFER_BAYS.get(bloque, 0),
-                        contenedores_por_bahia=contenedores_por_bahia
+                        contenedores_por_bahia=vs_map.get(bloque, 35)
                     )
-                    self.db.add(capacidad)
+                    for bloque, capacidad_contenedores in BLOCK_CAPACITIES.items()
+                ]).on_conflict_do_nothing()
+            )
             
             await self.db.commit()
             
@@ -178,7 +180,7 @@ class SAIFlujosLoader:
             await self.db.flush()
             
             # Leer flujos
-            df_flujos = pd.read_excel(file_path)
+            df_flujos = pd.read_excel(file_path, engine=EXCEL_ENGINE)
             
             # Obtener mapeo de segregaciones
             seg_query = await self.db.execute(select(SAISegregacion))
@@ -225,19 +227,20 @@ class SAIFlujosLoader:
                             criterios_map[criterio] = seg_id
                             break
             
-            # Crear mapeo de criterios
-            for criterio, seg_id in criterios_map.items():
-                existing = await self.db.execute(
-                    select(SAIMapeoCriterios).where(SAIMapeoCriterios.criterio == criterio)
+            # Crear mapeo de criterios (los criterios existentes se omiten en la base).
+            # Ordenados por criterio: mismo orden de locks en cargas en paralelo
+            if criterios_map:
+                await self.db.execute(
+                    pg_insert(SAIMapeoCriterios).values([
+                        dict(
+                            criterio=criterio,
+                            segregacion_id=seg_id,
+                            frecuencia_uso=1,
+                            fecha_ultimo_uso=fecha
+                        )
+                        for criterio, seg_id in sorted(criterios_map.items())
+                    ]).on_conflict_do_nothing(index_elements=['criterio'])
                 )
-                if not existing.scalar():
-                    mapeo = SAIMapeoCriterios(
-                        criterio=criterio,
-                        segregacion_id=seg_id,
-                        frecuencia_uso=1,
-                        fecha_ultimo_uso=fecha
-                    )
-                    self.db.add(mapeo)
             
             await self.db.commit()
             logger.info(f"Cargados {flujos_count} flujos, {len(criterios_map)} mapeos de criterios")
@@ -258,7 +261,7 @@ class SAIFlujosLoader:
         logger.info(f"Cargando evolución desde {file_path}")
         
         try:
-            excel_data = pd.ExcelFile(file_path)
+            excel_data = open_excel(file_path)
             
             # Obtener configuración
             config_query = await self.db.execute(
@@ -270,7 +273,7 @@ class SAIFlujosLoader:
             
             # 1. Cargar volumen por bloques
             if 'Volumen_Bloques' in excel_data.sheet_names:
-                df_volumen = pd.read_excel(file_path, sheet_name='Volumen_Bloques')
+                df_volumen = excel_data.parse(sheet_name='Volumen_Bloques')
                 
                 for _, row in df_volumen.iterrows():
                     fecha = pd.to_datetime(row['Fecha'])
@@ -322,7 +325,7 @@ class SAIFlujosLoader:
             
             # 2. Cargar volumen por segregación - CORREGIDO
             if 'Bloques_Seg_Volumen' in excel_data.sheet_names:
-                df_seg_volumen = pd.read_excel(file_path, sheet_name='Bloques_Seg_Volumen')
+                df_seg_volumen = excel_data.parse(sheet_name='Bloques_Seg_Volumen')
                 
                 # Procesar cada fila directamente
                 for _, row in df_seg_volumen.iterrows():
@@ -0,0 +1,36 @@
+# app/utils/excel.py
+"""
+Lectura de archivos Excel compartida por los loaders
+"""
+import pandas as pd
+
+# calamine (lector en Rust) es bastante más rápido que openpyxl para .xlsx;
+# pandas lo soporta desde 2.2. Si no está instalado se usa openpyxl.
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine" if tuple(map(int, pd.__version__.split('.')[:2])) >= (2, 2) else None
+except ImportError:
+    EXCEL_ENGINE = None
+
+def open_excel(filepath) -> pd.ExcelFile:
+    """Abrir un libro Excel con el motor más rápido disponible"""
+    return pd.ExcelFile(filepath, engine=EXCEL_ENGINE)
+
+class ParsedWorkbook:
+    """
+    Libro Excel ya leído en memoria, con la misma interfaz que usan los loaders
+    de pd.ExcelFile (sheet_names y parse)
+    """
+    
+    def __init__(self, sheets: dict):
+        self.sheets = sheets
+        self.sheet_names = list(sheets)
+    
+    def parse(self, sheet_name=0) -> pd.DataFrame:
+        if isinstance(sheet_name, int):
+            sheet_name = self.sheet_names[sheet_name]
+        return self.sheets[sheet_name].copy()
+
+def read_workbook(filepath) -> ParsedWorkbook:
+    """Leer todas las hojas de un libro (función de módulo para poder usarla en un ProcessPoolExecutor)"""
+    return ParsedWorkbook(pd.read_excel(filepath, sheet_name=None, engine=EXCEL_ENGINE))
@@ -0,0 +1,61 @@
+# scripts/_engine.py
+"""
+Engine y sesiones compartidos por los scripts de carga masiva
+"""
+import asyncio
+import sys
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
+
+from app.core.config import get_settings
+from app.core.database import STATEMENT_CACHE_SIZE
+from app.models.base import Base
+
+# Tamaño del pool: permite varias cargas concurrentes sobre conexiones propias
+POOL_SIZE = 16
+
+# Parámetros de servidor solo para las conexiones de estos scripts
+BULK_SERVER_SETTINGS = {
+    "synchronous_commit": "off",  # COPY/INSERT masivos sin esperar el fsync
+    "work_mem": "256MB",          # GROUP BY / DISTINCT de las estadísticas en memoria
+}
+
+def build_engine() -> AsyncEngine:
+    """Crear engine ajustado para cargas masivas"""
+    settings = get_settings()
+    return create_async_engine(
+        settings.DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=0,
+        pool_pre_ping=False,
+        pool_recycle=-1,
+        connect_args={
+            "server_settings": BULK_SERVER_SETTINGS,
+            "statement_cache_size": STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": STATEMENT_CACHE_SIZE,
+        },
+    )
+
+def build_session_factory(engine: AsyncEngine) -> async_sessionmaker:
+    """Crear fábrica de sesiones para el engine"""
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+async def prewarm_pool(engine: AsyncEngine, connections: int = POOL_SIZE):
+    """Abrir de antemano las conexiones que se usarán en paralelo y devolverlas al pool"""
+    conns = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+    await asyncio.gather(*(conn.close() for conn in conns))
+
+async def create_tables(engine: AsyncEngine):
+    """Crear tablas si no existen (solo con --init-schema: son varias consultas por tabla)"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+def install_uvloop():
+    """Usar uvloop como event loop si está disponible (no existe en Windows)"""
+    if sys.platform == "win32":
+        return
+    try:
+        import uvloop
+    except ImportError:
+        return
+    uvloop.install()
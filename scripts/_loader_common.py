@@ -0,0 +1,122 @@
+# scripts/_loader_common.py
+"""
+Utilidades compartidas por los scripts de carga de optimización (Magdalena y Camila)
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Ruta local usada cuando no existe la ruta de datos de Docker
+LOCAL_DATA_PATH = Path('/home/nejoo/gurobi/resultados_generados')
+
+@dataclass(frozen=True, slots=True)
+class FileRec:
+    """Archivo de un listado: nombre y ruta como str, obtenidos una sola vez del os.scandir"""
+    name: str
+    path: str
+
+# Nombre de directorio con fecha ISO (YYYY-MM-DD): descarte barato antes de construir la fecha
+ISO_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+def resolve_base_path():
+    """Ruta base de datos de optimización (OPTIMIZATION_DATA_PATH o ruta local); None si no existe"""
+    optimization_path = os.environ.get('OPTIMIZATION_DATA_PATH', '/app/optimization_data')
+    base_path = Path(optimization_path)
+
+    # Fallback a ruta local si no existe en Docker
+    if base_path.exists():
+        return base_path
+    if LOCAL_DATA_PATH.exists():
+        return LOCAL_DATA_PATH
+
+    logger.error(f"❌ No se encontró la ruta de datos en: {optimization_path}")
+    return None
+
+def parse_iso_date(dirname: str):
+    """Fecha de un texto YYYY-MM-DD si es una fecha válida, si no None"""
+    if not ISO_DATE_RE.fullmatch(dirname):
+        return None
+    # Cortes fijos en vez de strptime (no reinterpreta el formato en cada llamada)
+    try:
+        return datetime(int(dirname[0:4]), int(dirname[5:7]), int(dirname[8:10]))
+    except ValueError:
+        return None
+
+def scan_subdirs(directory: Path) -> list:
+    """Subdirectorios en un solo listado (os.scandir, sin stat por entrada); vacío si no existe"""
+    try:
+        with os.scandir(directory) as entries:
+            return [Path(entry.path) for entry in entries if entry.is_dir()]
+    except FileNotFoundError:
+        return []
+
+def scan_date_dirs(directory: Path) -> list:
+    """
+    Subdirectorios con nombre de fecha ISO, ordenados por fecha: [(Path, datetime)].
+    Se filtra por el nombre del DirEntry y solo se crea Path para los que calzan.
+    """
+    fechas = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                fecha = parse_iso_date(entry.name)
+                if fecha and entry.is_dir():
+                    fechas.append((entry.name, entry.path, fecha))
+    except FileNotFoundError:
+        return []
+    fechas.sort()
+    return [(Path(path), fecha) for _, path, fecha in fechas]
+
+def list_files(directory) -> list:
+    """Nombres de archivo de un directorio en un solo listado (os.scandir); vacío si no existe"""
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.name for entry in entries if entry.is_file()]
+    except FileNotFoundError:
+        return []
+
+def dir_signature(*directories) -> str:
+    """Huella (nombre, tamaño, mtime) de los archivos de uno o más directorios; los que no existen se ignoran"""
+    entradas = []
+    for i, directory in enumerate(directories):
+        if directory is None:
+            continue
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        entradas.append((i, entry.name, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            continue
+    entradas.sort()
+    return hashlib.sha1(repr(entradas).encode()).hexdigest()
+
+def manifest_path(base_path: Path, nombre: str) -> Path:
+    """Ruta del manifiesto de fechas ya cargadas por un script"""
+    return base_path / f'.loader_manifest_{nombre}.json'
+
+def load_manifest(path: Path) -> dict:
+    """Manifiesto fecha -> huella de la última carga completa; vacío si no existe o está dañado"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(path: Path, manifest: dict):
+    """Guardar el manifiesto (si la ruta de datos es de solo lectura se avisa y se sigue)"""
+    try:
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"⚠️  No se pudo guardar el manifiesto {path}: {e}")
@@ -1,8 +1,9 @@
 # app/scripts/load_camila_data_complete.py
 
 import asyncio
+import logging
+import logging.handlers
 import os
-from pathlib import Path
 import sys
 import traceback
 from datetime import datetime
@@ -11,13 +12,21 @@ import re
 # Agregar el directorio raíz al path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.core.database import AsyncSessionLocal
+from app.core.database import AsyncSessionLocal, engine
+from scripts._engine import install_uvloop
+from scripts._loader_common import list_files, parse_iso_date, resolve_base_path, scan_subdirs
 from app.services.camila_loader import CamilaLoader
 
-def get_week_from_date(date_str):
-    """Obtiene el número de semana ISO desde una fecha YYYY-MM-DD"""
-    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-    return date_obj.isocalendar()[1]
+# Logging con buffer: los mensajes se escriben en bloque (al llenarse el buffer,
+# ante un error o al terminar cada fecha) en vez de una escritura por línea
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_buffer = logging.handlers.MemoryHandler(capacity=256, flushLevel=logging.ERROR, target=_stream_handler)
+logging.basicConfig(level=logging.INFO, handlers=[log_buffer])
+logger = logging.getLogger(__name__)
+
+# Participación (60-80) como segmento del nombre, p. ej. resultados_20220103_68_T01 -> 68
+PARTICIPACION_RE = re.compile(r'(?:^|_)0?(6\d|7\d|80)(?=_|$)')
 
 def parse_turno_from_filename(filename):
     """Extrae el número de turno del nombre del archivo"""
@@ -27,17 +36,36 @@ def parse_turno_from_filename(filename):
         return int(match.group(1))
     return None
 
+def is_turno_file(nombre, prefijo):
+    """Equivale a fnmatch(nombre, f'{prefijo}*_T*.xlsx') con comparaciones directas de texto"""
+    return (
+        nombre.startswith(prefijo)
+        and nombre.endswith('.xlsx')
+        and '_T' in nombre[len(prefijo):-5]
+    )
+
+def index_instancias(instancia_names):
+    """Indexa nombres de archivo de instancia por (turno, participación) en una sola pasada"""
+    # Ejemplo: Instancia_20220103_68_T01.xlsx -> (1, '68')
+    index = {}
+    for nombre in instancia_names:
+        turnos = {int(t) for t in re.findall(r'_T(\d+)', nombre)}
+        segmentos = re.findall(r'(?<=_)(\d+)(?=_)', nombre)
+        for turno in turnos:
+            for segmento in segmentos:
+                index.setdefault((turno, segmento), nombre)
+    return index
+
 def get_flujos_filepath(base_path, fecha_str):
     """Construye la ruta al archivo de flujos reales para una fecha dada"""
     # Los flujos están en: instancias_magdalena/YYYY-MM-DD/Flujos_wYYYY-MM-DD.xlsx
-    flujos_path = base_path / 'instancias_magdalena' / fecha_str / f'Flujos_w{fecha_str}.xlsx'
-    if flujos_path.exists():
-        return str(flujos_path)
+    flujos_dir = base_path / 'instancias_magdalena' / fecha_str
+    nombres = set(list_files(flujos_dir))
     
-    # Intentar sin guión en el nombre del archivo
-    flujos_path_alt = base_path / 'instancias_magdalena' / fecha_str / f'Flujos_w{fecha_str.replace("-", "")}.xlsx'
-    if flujos_path_alt.exists():
-        return str(flujos_path_alt)
+    # Con guión o, si no, sin guión en el nombre del archivo
+    for nombre in (f'Flujos_w{fecha_str}.xlsx', f'Flujos_w{fecha_str.replace("-", "")}.xlsx'):
+        if nombre in nombres:
+            return str(flujos_dir / nombre)
     
     return None
 
@@ -45,50 +73,42 @@ async def load_camila_data():
     """Carga datos de Camila desde la estructura de directorios"""
     
     # Usar variable de entorno específica para datos de optimización
-    optimization_path = os.environ.get('OPTIMIZATION_DATA_PATH', '/app/optimization_data')
-    base_path = Path(optimization_path)
-    
-    # Fallback a ruta local si no existe en Docker
-    if not base_path.exists():
-        local_path = Path('/home/nejoo/gurobi/resultados_generados')
-        if local_path.exists():
-            base_path = local_path
-        else:
-            print(f"❌ No se encontró la ruta de datos en: {optimization_path}")
-            return
+    base_path = resolve_base_path()
+    if base_path is None:
+        return
     
     # Definir rutas
     resultados_camila_path = base_path / 'resultados_camila'
     instancias_camila_path = base_path / 'instancias_camila'
     instancias_magdalena_path = base_path / 'instancias_magdalena'
     
-    print(f"🔍 Buscando datos de Camila en:")
-    print(f"   - Resultados Camila: {resultados_camila_path}")
-    print(f"   - Instancias Camila: {instancias_camila_path}")
-    print(f"   - Instancias Magdalena (flujos): {instancias_magdalena_path}")
-    print(f"{'='*80}")
+    logger.info(f"🔍 Buscando datos de Camila en:")
+    logger.info(f"   - Resultados Camila: {resultados_camila_path}")
+    logger.info(f"   - Instancias Camila: {instancias_camila_path}")
+    logger.info(f"   - Instancias Magdalena (flujos): {instancias_magdalena_path}")
+    logger.info(f"{'='*80}")
     
     # Verificar existencia de directorios
     if not resultados_camila_path.exists():
-        print(f"❌ No existe el directorio de resultados: {resultados_camila_path}")
+        logger.error(f"❌ No existe el directorio de resultados: {resultados_camila_path}")
         return
     
     if not instancias_camila_path.exists():
-        print(f"⚠️  No existe el directorio de instancias Camila: {instancias_camila_path}")
+        logger.warning(f"⚠️  No existe el directorio de instancias Camila: {instancias_camila_path}")
     
     if not instancias_magdalena_path.exists():
-        print(f"⚠️  No existe el directorio de instancias Magdalena: {instancias_magdalena_path}")
+        logger.warning(f"⚠️  No existe el directorio de instancias Magdalena: {instancias_magdalena_path}")
     
     # Listar contenido de resultados_camila para debug
-    print(f"\n📂 Contenido de {resultados_camila_path}:")
+    logger.info(f"\n📂 Contenido de {resultados_camila_path}:")
     try:
         items = list(resultados_camila_path.iterdir())
         for item in items[:10]:  # Mostrar primeros 10 items
-            print(f"   - {item.name} {'[DIR]' if item.is_dir() else ''}")
+            logger.info(f"   - {item.name} {'[DIR]' if item.is_dir() else ''}")
         if len(items) > 10:
-            print(f"   ... y {len(items) - 10} más")
+            logger.info(f"   ... y {len(items) - 10} más")
     except Exception as e:
-        print(f"   ❌ Error listando directorio: {e}")
+        logger.error(f"   ❌ Error listando directorio: {e}")
     
     # Contadores
     total_archivos = 0
@@ -96,98 +116,97 @@ async def load_camila_data():
     archivos_fallidos = 0
     archivos_sin_flujos = 0
     
-    # Validar formato de fecha ISO
-    def is_valid_iso_date(dirname):
-        """Valida si el nombre del directorio es una fecha ISO válida (YYYY-MM-DD)"""
-        if len(dirname) != 10:
-            return False
-        try:
-            datetime.strptime(dirname, '%Y-%m-%d')
-            return True
-        except ValueError:
-            return False
-    
     # Buscar directorios con formato resultados_turno_YYYY-MM-DD
-    all_dirs = [d for d in resultados_camila_path.iterdir() if d.is_dir()]
+    all_dirs = scan_subdirs(resultados_camila_path)
     turno_dirs = []
     
     for d in all_dirs:
-        # Extraer fecha del nombre del directorio
+        # Extraer fecha del nombre del directorio (se parsea una sola vez)
         if d.name.startswith('resultados_turno_'):
             fecha_part = d.name.replace('resultados_turno_', '')
-            if is_valid_iso_date(fecha_part):
-                turno_dirs.append((d, fecha_part))
         # También buscar directorios que sean solo fechas
-        elif is_valid_iso_date(d.name):
-            turno_dirs.append((d, d.name))
+        else:
+            fecha_part = d.name
+        fecha = parse_iso_date(fecha_part)
+        if fecha:
+            turno_dirs.append((d, fecha_part, fecha))
     
     # Ordenar por fecha
     turno_dirs = sorted(turno_dirs, key=lambda x: x[1])
     
-    print(f"\n📅 Encontradas {len(turno_dirs)} fechas con resultados de Camila\n")
+    logger.info(f"\n📅 Encontradas {len(turno_dirs)} fechas con resultados de Camila\n")
     
     if len(turno_dirs) == 0:
-        print("⚠️  No se encontraron directorios con formato de fecha válido")
-        print("    Esperado: resultados_turno_YYYY-MM-DD o YYYY-MM-DD")
+        logger.warning("⚠️  No se encontraron directorios con formato de fecha válido")
+        logger.info("    Esperado: resultados_turno_YYYY-MM-DD o YYYY-MM-DD")
         return
     
-    for fecha_dir, fecha_str in turno_dirs:
+    # Directorios de instancias Camila: un listado en vez de exists() por fecha
+    instancias_camila_dirs = {d.name for d in scan_subdirs(instancias_camila_path)}
+    
+    # Cargas a ejecutar (una por turno); se lanzan en paralelo al final
+    pending_loads = []
+    
+    for fecha_dir, fecha_str, fecha_inicio in turno_dirs:
         
         try:
-            fecha_inicio = datetime.strptime(fecha_str, '%Y-%m-%d')
-            semana = get_week_from_date(fecha_str)
+            semana = fecha_inicio.isocalendar()[1]
             anio = fecha_inicio.year
             
-            print(f"\n📁 Procesando {fecha_str} (Año {anio}, Semana {semana})")
-            print(f"{'-'*60}")
+            logger.info(f"\n📁 Procesando {fecha_str} (Año {anio}, Semana {semana})")
+            logger.info(f"{'-'*60}")
             
             # Buscar archivo de flujos reales para esta semana
             flujos_real_filepath = get_flujos_filepath(base_path, fecha_str)
             if flujos_real_filepath:
-                print(f"   ✓ Archivo de flujos reales encontrado: {Path(flujos_real_filepath).name}")
+                logger.info(f"   ✓ Archivo de flujos reales encontrado: {os.path.basename(flujos_real_filepath)}")
             else:
-                print(f"   ⚠️ No se encontró archivo de flujos reales para {fecha_str}")
+                logger.warning(f"   ⚠️ No se encontró archivo de flujos reales para {fecha_str}")
                 archivos_sin_flujos += 1
             
-            # Buscar archivos de resultado por turno en Camila
-            resultado_files = sorted(list(fecha_dir.glob('resultados_*_T*.xlsx')))
+            # Buscar archivos de resultado por turno en Camila (un solo listado del directorio)
+            # Se trabaja con nombres (str); la ruta completa se arma una vez, al encolar la carga
+            fecha_dir_str = os.fspath(fecha_dir)
+            fecha_files = list_files(fecha_dir_str)
+            resultado_files = sorted(f for f in fecha_files if is_turno_file(f, 'resultados_'))
             
             if len(resultado_files) == 0:
                 # Intentar con otro patrón
-                resultado_files = sorted(list(fecha_dir.glob('resultado_*_T*.xlsx')))
+                resultado_files = sorted(f for f in fecha_files if is_turno_file(f, 'resultado_'))
             
             # Buscar archivos de instancia en Camila
-# Buscar archivos de instancia en Camila
             # Primero intentar con el formato instancias_turno_YYYY-MM-DD
             instancia_dir = instancias_camila_path / f"instancias_turno_{fecha_str}"
             instancia_files = []
             
-            if instancia_dir.exists():
-                instancia_files = sorted(list(instancia_dir.glob('Instancia_*_T*.xlsx')))
-            else:
+            if instancia_dir.name not in instancias_camila_dirs:
                 # Si no existe, intentar con el formato directo YYYY-MM-DD
                 instancia_dir = instancias_camila_path / fecha_str
-                if instancia_dir.exists():
-                    instancia_files = sorted(list(instancia_dir.glob('Instancia_*_T*.xlsx')))
+            instancia_dir_str = os.fspath(instancia_dir)
+            if instancia_dir.name in instancias_camila_dirs:
+                instancia_files = sorted(
+                    f for f in list_files(instancia_dir_str) if is_turno_file(f, 'Instancia_')
+                )
             
-            print(f"   Encontrados:")
-            print(f"   - {len(resultado_files)} archivos de resultado Camila")
-            print(f"   - {len(instancia_files)} archivos de instancia Camila en {instancia_dir.name}")
+            logger.info(f"   Encontrados:")
+            logger.info(f"   - {len(resultado_files)} archivos de resultado Camila")
+            logger.info(f"   - {len(instancia_files)} archivos de instancia Camila en {instancia_dir.name}")
             
             if len(resultado_files) == 0:
-                print(f"   ⚠️ No se encontraron archivos de resultado en {fecha_dir}")
+                logger.warning(f"   ⚠️ No se encontraron archivos de resultado en {fecha_dir}")
                 continue
             
             # Procesar cada turno
             turnos_procesados = set()
+            instancias_por_clave = index_instancias(instancia_files)
             
-            for resultado_file in resultado_files:
+            for resultado_name in resultado_files:
                 total_archivos += 1
                 
                 # Extraer información del archivo
-                turno = parse_turno_from_filename(resultado_file.name)
+                turno = parse_turno_from_filename(resultado_name)
                 if turno is None:
-                    print(f"   ⚠️ No se pudo extraer turno de: {resultado_file.name}")
+                    logger.warning(f"   ⚠️ No se pudo extraer turno de: {resultado_name}")
                     archivos_fallidos += 1
                     continue
                 
@@ -198,16 +217,11 @@ async def load_camila_data():
                 
                 # Extraer participación del nombre
                 # Formato: resultados_20220103_68_T01.xlsx
-                parts = resultado_file.stem.split('_')
-                participacion = None
-                
-                for part in parts:
-                    if part.isdigit() and 60 <= int(part) <= 80 and len(part) <= 3:
-                        participacion = int(part)
-                        break
+                match = PARTICIPACION_RE.search(os.path.splitext(resultado_name)[0])
+                participacion = int(match.group(1)) if match else None
                 
                 if participacion is None:
-                    print(f"   ⚠️ No se pudo extraer participación de: {resultado_file.name}")
+                    logger.warning(f"   ⚠️ No se pudo extraer participación de: {resultado_name}")
                     archivos_fallidos += 1
                     continue
                 
@@ -215,74 +229,85 @@ async def load_camila_data():
                 turno_del_dia = ((turno - 1) % 3) + 1
                 hora_inicio = {1: "08:00", 2: "16:00", 3: "00:00"}[turno_del_dia]
                 
-                print(f"\n   📊 Procesando Turno {turno:02d} - P{participacion} (Hora: {hora_inicio})")
+                logger.info(f"\n   📊 Procesando Turno {turno:02d} - P{participacion} (Hora: {hora_inicio})")
                 
                 # Buscar instancia correspondiente de Camila
-                instancia_file = None
-                for inst in instancia_files:
-                    # Buscar coincidencia por turno y participación
-                    if (f"_T{turno:02d}" in inst.name or f"_T{turno}" in inst.name) and f"_{participacion}_" in inst.name:
-                        instancia_file = inst
-                        break
+                instancia_name = instancias_por_clave.get((turno, str(participacion)))
                 
                 # Determinar si es con dispersión (K) o sin dispersión (N)
                 # Por defecto asumimos K si no se puede determinar
                 con_dispersion = True
-                if '_N_' in resultado_file.name or (instancia_file and '_N_' in instancia_file.name):
+                if '_N_' in resultado_name or (instancia_name and '_N_' in instancia_name):
                     con_dispersion = False
-                elif '_K_' in resultado_file.name or (instancia_file and '_K_' in instancia_file.name):
+                elif '_K_' in resultado_name or (instancia_name and '_K_' in instancia_name):
                     con_dispersion = True
                 
-                print(f"      - Resultado Camila: {resultado_file.name}")
-                print(f"      - Instancia Camila: {instancia_file.name if instancia_file else 'No encontrada'}")
-                print(f"      - Flujos reales: {Path(flujos_real_filepath).name if flujos_real_filepath else 'No disponible'}")
-                print(f"      - Dispersión: {'K' if con_dispersion else 'N'}")
+                logger.info(f"      - Resultado Camila: {resultado_name}")
+                logger.info(f"      - Instancia Camila: {instancia_name or 'No encontrada'}")
+                logger.info(f"      - Flujos reales: {os.path.basename(flujos_real_filepath) if flujos_real_filepath else 'No disponible'}")
+                logger.info(f"      - Dispersión: {'K' if con_dispersion else 'N'}")
                 
-                try:
-                    async with AsyncSessionLocal() as db:
-                        # Crear el loader con la sesión de base de datos
-                        loader = CamilaLoader(db)
-                        
-                        # Cargar resultados de Camila con comparación contra datos reales
-                        resultado_id = await loader.load_camila_results(
-                            resultado_filepath=str(resultado_file),
-                            instancia_filepath=str(instancia_file) if instancia_file else None,
-                            flujos_real_filepath=flujos_real_filepath,  # Ahora incluimos los flujos reales
-                            fecha_inicio=fecha_inicio,
-                            semana=semana,
-                            anio=anio,
-                            turno=turno,
-                            participacion=participacion,
-                            con_dispersion=con_dispersion
-                        )
-                        
-                        await db.commit()
-                        print(f"   ✅ Cargado exitosamente (ID: {resultado_id})")
-                        archivos_exitosos += 1
-                        
-                except Exception as e:
-                    print(f"   ❌ Error: {str(e)}")
-                    if os.environ.get("DEBUG"):
-                        traceback.print_exc()
-                    archivos_fallidos += 1
+                pending_loads.append((f"{fecha_str} T{turno:02d} P{participacion}", dict(
+                    resultado_filepath=os.path.join(fecha_dir_str, resultado_name),
+                    instancia_filepath=os.path.join(instancia_dir_str, instancia_name) if instancia_name else None,
+                    flujos_real_filepath=flujos_real_filepath,  # Ahora incluimos los flujos reales
+                    fecha_inicio=fecha_inicio,
+                    semana=semana,
+                    anio=anio,
+                    turno=turno,
+                    participacion=participacion,
+                    con_dispersion=con_dispersion
+                )))
                     
         except Exception as e:
-            print(f"⚠️ Error procesando {fecha_str}: {str(e)}")
+            logger.warning(f"⚠️ Error procesando {fecha_str}: {str(e)}")
             continue
+        finally:
+            log_buffer.flush()
+    
+    # Cargar turnos en paralelo, sin superar el pool de conexiones
+    semaphore = asyncio.Semaphore(max(1, min(len(pending_loads), engine.pool.size() - 1)))
+    
+    async def load_turno(etiqueta, params):
+        """Cargar un turno en su propia sesión; retorna True si se cargó"""
+        async with semaphore:
+            try:
+                async with AsyncSessionLocal() as db:
+                    # Crear el loader con la sesión de base de datos
+                    loader = CamilaLoader(db)
+                    
+                    # Cargar resultados de Camila con comparación contra datos reales
+                    resultado_id = await loader.load_camila_results(**params)
+                    
+                    await db.commit()
+                    logger.info(f"   ✅ {etiqueta} cargado exitosamente (ID: {resultado_id})")
+                    return True
+                    
+            except Exception as e:
+                logger.error(f"   ❌ {etiqueta} Error: {str(e)}")
+                if os.environ.get("DEBUG"):
+                    traceback.print_exc()
+                return False
+            finally:
+                log_buffer.flush()
+    
+    cargas = await asyncio.gather(*(load_turno(etiqueta, params) for etiqueta, params in pending_loads))
+    archivos_exitosos += sum(cargas)
+    archivos_fallidos += len(cargas) - sum(cargas)
     
     # Resumen final
-    print(f"\n{'='*80}")
-    print(f"✅ CARGA COMPLETA DE CAMILA - {datetime.now()}")
-    print(f"{'='*80}")
-    print(f"📊 RESUMEN FINAL:")
-    print(f"   - Total archivos procesados: {total_archivos}")
-    print(f"   - Exitosos: {archivos_exitosos}")
-    print(f"   - Fallidos: {archivos_fallidos}")
-    print(f"   - Sin flujos reales: {archivos_sin_flujos}")
-    print(f"   - Tasa de éxito: {(archivos_exitosos/total_archivos*100):.1f}%" if total_archivos > 0 else "N/A")
+    logger.info(f"\n{'='*80}")
+    logger.info(f"✅ CARGA COMPLETA DE CAMILA - {datetime.now()}")
+    logger.info(f"{'='*80}")
+    logger.info(f"📊 RESUMEN FINAL:")
+    logger.info(f"   - Total archivos procesados: {total_archivos}")
+    logger.info(f"   - Exitosos: {archivos_exitosos}")
+    logger.info(f"   - Fallidos: {archivos_fallidos}")
+    logger.info(f"   - Sin flujos reales: {archivos_sin_flujos}")
+    logger.info(f"   - Tasa de éxito: {(archivos_exitosos/total_archivos*100):.1f}%" if total_archivos > 0 else "N/A")
     
     # Verificación en base de datos
-    print(f"\n📊 VERIFICACIÓN EN BASE DE DATOS:")
+    logger.info(f"\n📊 VERIFICACIÓN EN BASE DE DATOS:")
     try:
         async with AsyncSessionLocal() as db:
             from sqlalchemy import text
@@ -298,16 +323,25 @@ async def load_camila_data():
                 'flujos_modelo': "SELECT COUNT(*) FROM flujos_modelo"
             }
             
-            for tabla, query in queries.items():
-                try:
-                    result = await db.execute(text(query))
-                    count = result.scalar()
-                    print(f"   - {tabla}: {count:,}")
-                except Exception as e:
-                    print(f"   - {tabla}: Error - {str(e)}")
+            # Todos los conteos en una sola consulta; si alguna tabla falla, uno por uno
+            try:
+                combined = ", ".join(f"({query})" for query in queries.values())
+                result = await db.execute(text(f"SELECT {combined}"))
+                for tabla, count in zip(queries, result.one()):
+                    logger.info(f"   - {tabla}: {count:,}")
+            except Exception:
+                await db.rollback()
+                for tabla, query in queries.items():
+                    try:
+                        result = await db.execute(text(query))
+                        count = result.scalar()
+                        logger.info(f"   - {tabla}: {count:,}")
+                    except Exception as e:
+                        await db.rollback()
+                        logger.info(f"   - {tabla}: Error - {str(e)}")
             
             # Estadísticas por año
-            print(f"\n📅 RESULTADOS POR AÑO:")
+            logger.info(f"\n📅 RESULTADOS POR AÑO:")
             try:
                 year_query = """
                     SELECT anio, COUNT(*) as total, 
@@ -325,16 +359,16 @@ async def load_camila_data():
                 if rows:
                     for row in rows:
                         accuracy_str = f"{row.accuracy_promedio:.1f}%" if row.accuracy_promedio else "N/A"
-                        print(f"   - {row.anio}: {row.total} resultados, {row.semanas} semanas, "
+                        logger.info(f"   - {row.anio}: {row.total} resultados, {row.semanas} semanas, "
                               f"{row.turnos} turnos únicos, {row.participaciones} participaciones, "
                               f"Accuracy promedio: {accuracy_str}")
                 else:
-                    print("   No hay datos completados por año")
+                    logger.info("   No hay datos completados por año")
             except Exception as e:
-                print(f"   Error obteniendo estadísticas por año: {e}")
+                logger.info(f"   Error obteniendo estadísticas por año: {e}")
             
             # Comparaciones con datos reales
-            print(f"\n📊 COMPARACIONES CON DATOS REALES:")
+            logger.info(f"\n📊 COMPARACIONES CON DATOS REALES:")
             try:
                 comp_query = """
                     SELECT tipo_comparacion, 
@@ -348,17 +382,17 @@ async def load_camila_data():
                 rows = result.fetchall()
                 if rows:
                     for row in rows:
-                        print(f"   - {row.tipo_comparacion}: {row.total} comparaciones, "
+                        logger.info(f"   - {row.tipo_comparacion}: {row.total} comparaciones, "
                               f"Accuracy: {row.accuracy_promedio:.1f}%, "
                               f"Diferencia: {row.diferencia_promedio:+.1f}%")
                 else:
-                    print("   No hay datos de comparaciones")
+                    logger.info("   No hay datos de comparaciones")
             except Exception as e:
-                print(f"   Error obteniendo comparaciones: {e}")
+                logger.info(f"   Error obteniendo comparaciones: {e}")
                 
     except Exception as e:
-        print(f"\n⚠️ Error en verificación de base de datos: {str(e)}")
-    print(f"\n📊 VERIFICACIÓN DE MAPEO DE SEGREGACIONES:")
+        logger.warning(f"\n⚠️ Error en verificación de base de datos: {str(e)}")
+    logger.info(f"\n📊 VERIFICACIÓN DE MAPEO DE SEGREGACIONES:")
     try:
         async with AsyncSessionLocal() as db:
             # Importar el modelo si no está importado
@@ -377,11 +411,11 @@ async def load_camila_data():
             row = result.fetchone()
             
             if row and row.total_mapeos > 0:
-                print(f"   ✓ Resultados con mapeo: {row.resultados}")
-                print(f"   ✓ Total mapeos: {row.total_mapeos}")
-                print(f"   ✓ Códigos únicos: {row.codigos_unicos} (S1, S2, ...)")
-                print(f"   ✓ Nombres únicos: {row.nombres_unicos}")
-                print(f"   ✓ Tipos: {row.tipos}")
+                logger.info(f"   ✓ Resultados con mapeo: {row.resultados}")
+                logger.info(f"   ✓ Total mapeos: {row.total_mapeos}")
+                logger.info(f"   ✓ Códigos únicos: {row.codigos_unicos} (S1, S2, ...)")
+                logger.info(f"   ✓ Nombres únicos: {row.nombres_unicos}")
+                logger.info(f"   ✓ Tipos: {row.tipos}")
                 
                 # Mostrar algunos ejemplos
                 ejemplos_query = """
@@ -393,23 +427,25 @@ async def load_camila_data():
                 ejemplos = ejemplos_result.fetchall()
                 
                 if ejemplos:
-                    print(f"\n   📋 Ejemplos de mapeo:")
+                    logger.info(f"\n   📋 Ejemplos de mapeo:")
                     for ej in ejemplos:
-                        print(f"      {ej.codigo} → {ej.nombre} ({ej.tipo})")
+                        logger.info(f"      {ej.codigo} → {ej.nombre} ({ej.tipo})")
             else:
-                print(f"   ⚠️ No se encontraron mapeos de segregación en la BD")
-                print(f"      Esto causará que las comparaciones con datos reales sean incorrectas")
+                logger.warning(f"   ⚠️ No se encontraron mapeos de segregación en la BD")
+                logger.info(f"      Esto causará que las comparaciones con datos reales sean incorrectas")
                 
     except Exception as e:
-        print(f"   ❌ Error verificando mapeos: {e}")
+        logger.error(f"   ❌ Error verificando mapeos: {e}")
 
     # Continuar con el resumen final existente...
-    print(f"\n{'='*80}")
-    print(f"✅ CARGA COMPLETA DE CAMILA - {datetime.now()}")
+    logger.info(f"\n{'='*80}")
+    logger.info(f"✅ CARGA COMPLETA DE CAMILA - {datetime.now()}")
+    log_buffer.flush()
 if __name__ == "__main__":
-    print(f"🚀 Iniciando carga de datos de Camila con comparación real - {datetime.now()}")
-    print(f"="*80)
-    print("NOTA: Este script ahora carga automáticamente los flujos reales")
-    print("      desde instancias_magdalena/YYYY-MM-DD/Flujos_wYYYY-MM-DD.xlsx")
-    print(f"="*80)
+    logger.info(f"🚀 Iniciando carga de datos de Camila con comparación real - {datetime.now()}")
+    logger.info(f"="*80)
+    logger.info("NOTA: Este script ahora carga automáticamente los flujos reales")
+    logger.info("      desde instancias_magdalena/YYYY-MM-DD/Flujos_wYYYY-MM-DD.xlsx")
+    logger.info(f"="*80)
+    install_uvloop()
     asyncio.run(load_camila_data())
\ No newline at end of file
@@ -1,21 +1,25 @@
 # scripts/load_container_positions.py
 import asyncio
+import os
 import sys
 from pathlib import Path
 import argparse
 import logging
-from datetime import datetime
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from datetime import datetime, date, timedelta
 from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
 
-from app.core.config import get_settings
-from app.services.csv_loader import CSVLoaderService
-from app.models.base import Base
+from scripts._engine import build_engine, build_session_factory, create_tables, install_uvloop
+from app.services.csv_loader import CSVLoaderService, parse_container_positions_csv
 from app.models.container_position import ContainerPosition
+from app.models.loaded_file import LoadedFile
 
 # Configurar logging
 logging.basicConfig(
@@ -24,9 +28,102 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-settings = get_settings()
+# Turnos según el nombre del archivo: YYYY-MM-DD_HH-MM.csv
+TURNO_MAP = {"08-00": 1, "15-30": 2, "23-00": 3}
+_DATE_RE = re.compile(r'(\d{4}-\d{2}-\d{2})_([0-9-]+)')
 
-async def main(year: int = 2022, week: str = None, specific_date: str = None):
+# Pipeline de --date/--week: archivos parseados en espera y sesiones que insertan
+PIPELINE_QUEUE_SIZE = 4
+PIPELINE_CONSUMERS = 4
+
+@lru_cache(maxsize=None)
+def _parse_fecha(fecha_str: str):
+    """Parsear YYYY-MM-DD una sola vez por fecha (hay 3 turnos por día)"""
+    return datetime.strptime(fecha_str, "%Y-%m-%d").date()
+
+def find_csvs(base, date_prefix):
+    """
+    Buscar los CSV de una fecha en todas las semanas usando os.scandir
+
+    Solo compara nombres (sin stat por archivo) y retorna tuplas (semana, ruta)
+    """
+    found = []
+    with os.scandir(base) as weeks:
+        for week_entry in weeks:
+            if not week_entry.is_dir():
+                continue
+            with os.scandir(week_entry.path) as files:
+                for entry in files:
+                    if entry.name.startswith(date_prefix) and entry.name.endswith('.csv'):
+                        found.append((week_entry.name, entry.path))
+    return found
+
+async def load_files_pipeline(async_session, files):
+    """
+    Cargar archivos (ruta, fecha, turno, semana) solapando parseo e inserción
+
+    Los productores parsean en un ProcessPoolExecutor y dejan los registros en
+    una cola acotada; los consumidores los insertan, cada uno con su propia sesión.
+    """
+    if not files:
+        return 0
+    
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    pending = iter(files)
+    n_producers = min(len(files), max(4, os.cpu_count() or 1))
+    n_consumers = min(len(files), PIPELINE_CONSUMERS)
+    inserted_per_file = []
+    
+    async def producer(ppool):
+        for csv_path, fecha, turno, semana in pending:
+            t0 = time.perf_counter()
+            try:
+                records = await loop.run_in_executor(
+                    ppool, parse_container_positions_csv, csv_path, fecha, turno, semana
+                )
+            except Exception as e:
+                logger.error(f"Error parseando {Path(csv_path).name}: {e}")
+                continue
+            await queue.put((csv_path, records, (time.perf_counter() - t0) * 1000))
+    
+    async def consumer():
+        async with async_session() as db:
+            service = CSVLoaderService(db)
+            while (item := await queue.get()) is not None:
+                csv_path, records, parse_ms = item
+                t0 = time.perf_counter()
+                try:
+                    inserted = await service.insert_container_positions(records) if records else 0
+                except Exception as e:
+                    logger.error(f"Error insertando {Path(csv_path).name}: {e}")
+                    continue
+                insert_ms = (time.perf_counter() - t0) * 1000
+                logger.info("%s rows=%d parse_ms=%.1f insert_ms=%.1f", Path(csv_path).name, inserted, parse_ms, insert_ms)
+                inserted_per_file.append(inserted)
+    
+    async def run_producers(ppool):
+        await asyncio.gather(*(producer(ppool) for _ in range(n_producers)))
+        # Un centinela por consumidor
+        for _ in range(n_consumers):
+            await queue.put(None)
+    
+    with ProcessPoolExecutor(max_workers=n_producers) as ppool:
+        tasks = [asyncio.create_task(run_producers(ppool))]
+        tasks += [asyncio.create_task(consumer()) for _ in range(n_consumers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Si un lado falla se cancela el otro: con la cola acotada, un consumidor
+            # caído dejaría a los productores bloqueados para siempre en queue.put
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    
+    return sum(inserted_per_file)
+
+async def main(year: int = 2022, week: str = None, specific_date: str = None, init_schema: bool = False, resume: bool = False):
     """
     Función principal para cargar posiciones de contenedores
     
@@ -34,18 +131,20 @@ async def main(year: int = 2022, week: str = None, specific_date: str = None):
         year: Año de los datos a cargar (default: 2022)
         week: Semana específica en formato ISO (ej: 2022-01-03)
         specific_date: Fecha específica (ej: 2022-01-03)
+        init_schema: Si True, crea las tablas que falten antes de cargar
+        resume: Si True, omite los archivos del año ya registrados en loaded_files
     """
-    start_time = datetime.now()
+    start_time = time.perf_counter()
     
     # Crear engine
-    engine = create_async_engine(settings.DATABASE_URL)
+    engine = build_engine()
     
     # Crear tablas si no existen
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if init_schema:
+        await create_tables(engine)
     
     # Crear sesión
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async_session = build_session_factory(engine)
     
     async with async_session() as db:
         service = CSVLoaderService(db)
@@ -66,29 +165,24 @@ async def main(year: int = 2022, week: str = None, specific_date: str = None):
                 base_path = Path(f"/app/data/{year}")
                 files_found = 0
                 
-                for semana_dir in base_path.iterdir():
-                    if semana_dir.is_dir():
-                        pattern = f"{specific_date}_*.csv"
-                        csv_files = list(semana_dir.glob(pattern))
-                        
-                        if csv_files:
-                            logger.info(f"Encontrados {len(csv_files)} archivos para {specific_date}")
-                            files_found += len(csv_files)
-                            
-                            for csv_file in csv_files:
-                                # Procesar cada archivo
-                                filename = csv_file.stem
-                                turno_str = filename.split('_')[1]
-                                turno_map = {"08-00": 1, "15-30": 2, "23-00": 3}
-                                turno = turno_map.get(turno_str, 0)
-                                
-                                if turno:
-                                    await service.load_container_positions_csv(
-                                        str(csv_file),
-                                        fecha,
-                                        turno,
-                                        semana_dir.name
-                                    )
+                csv_files = await asyncio.get_running_loop().run_in_executor(
+                    None, find_csvs, base_path, f"{specific_date}_"
+                )
+                
+                if csv_files:
+                    logger.info(f"Encontrados {len(csv_files)} archivos para {specific_date}")
+                    files_found = len(csv_files)
+                
+                # Archivos con turno reconocido
+                files = []
+                for semana_name, csv_path in csv_files:
+                    match = _DATE_RE.match(Path(csv_path).stem)
+                    turno = TURNO_MAP.get(match.group(2), 0) if match else 0
+                    
+                    if turno:
+                        files.append((csv_path, fecha, turno, semana_name))
+                
+                await load_files_pipeline(async_session, files)
                 
                 if files_found == 0:
                     logger.warning(f"No se encontraron archivos para la fecha {specific_date}")
@@ -101,30 +195,31 @@ async def main(year: int = 2022, week: str = None, specific_date: str = None):
             logger.info(f"Modo: Carga de semana específica - {week}")
             
             week_path = Path(f"/app/data/{year}/{week}")
-            if week_path.exists():
-                csv_files = list(week_path.glob("*.csv"))
+            loop = asyncio.get_running_loop()
+            if await loop.run_in_executor(None, week_path.exists):
+                csv_files = await loop.run_in_executor(None, lambda: list(week_path.glob("*.csv")))
                 logger.info(f"Encontrados {len(csv_files)} archivos en semana {week}")
                 
+                # Archivos con formato y turno reconocidos
+                files = []
                 for csv_file in csv_files:
+                    match = _DATE_RE.match(csv_file.stem)
+                    if not match:
+                        logger.warning(f"Formato no reconocido: {csv_file.name}")
+                        continue
+                    fecha_str, turno_str = match.groups()
+                    
                     try:
-                        filename = csv_file.stem
-                        parts = filename.split('_')
-                        fecha_str = parts[0]
-                        turno_str = parts[1]
-                        
-                        fecha = datetime.strptime(fecha_str, "%Y-%m-%d").date()
-                        turno_map = {"08-00": 1, "15-30": 2, "23-00": 3}
-                        turno = turno_map.get(turno_str, 0)
-                        
-                        if turno:
-                            await service.load_container_positions_csv(
-                                str(csv_file),
-                                fecha,
-                                turno,
-                                week
-                            )
-                    except Exception as e:
+                        fecha = _parse_fecha(fecha_str)
+                    except ValueError as e:
                         logger.error(f"Error procesando {csv_file.name}: {e}")
+                        continue
+                    turno = TURNO_MAP.get(turno_str, 0)
+                    
+                    if turno:
+                        files.append((str(csv_file), fecha, turno, week))
+                
+                await load_files_pipeline(async_session, files)
             else:
                 logger.error(f"No existe el directorio para la semana {week}")
                 
@@ -132,32 +227,89 @@ async def main(year: int = 2022, week: str = None, specific_date: str = None):
             # Cargar todo el año
             logger.info(f"Modo: Carga completa del año {year}")
             
-            total_records = await service.load_container_positions_year(year)
+            # Índices secundarios (no únicos): se reconstruyen una sola vez al final.
+            # El índice único se mantiene porque lo usa ON CONFLICT.
+            secondary_indexes = [
+                idx for idx in ContainerPosition.__table__.indexes if not idx.unique
+            ]
             
-            # Estadísticas finales
-            count_result = await db.execute(
-                text("SELECT COUNT(*) FROM container_positions WHERE EXTRACT(YEAR FROM fecha) = :year"),
-                {"year": year}
-            )
-            total_in_db = count_result.scalar()
+            # Registro de archivos cargados (una sola verificación de la tabla)
+            async with engine.begin() as conn:
+                await conn.run_sync(LoadedFile.__table__.create, checkfirst=True)
+            
+            if resume:
+                # Con --resume se confirma semana a semana: las filas de cada archivo
+                # quedan junto con su registro en loaded_files, y una interrupción
+                # conserva lo ya cargado. Si se corta antes del final, los índices
+                # se recrean al terminar la siguiente corrida con --resume.
+                for idx in secondary_indexes:
+                    await db.execute(text(f"DROP INDEX IF EXISTS {idx.name}"))
+                await db.commit()
+                
+                total_records = await service.load_container_positions_year(
+                    year, commit=False, resume=True, commit_semanal=True
+                )
+                
+                logger.info(f"Recreando {len(secondary_indexes)} índices secundarios...")
+                for idx in secondary_indexes:
+                    await db.execute(CreateIndex(idx, if_not_exists=True))
+                await db.commit()
+            else:
+                # Toda la carga en una sola transacción
+                async with db.begin():
+                    for idx in secondary_indexes:
+                        await db.execute(text(f"DROP INDEX IF EXISTS {idx.name}"))
+                    
+                    total_records = await service.load_container_positions_year(year, commit=False)
+                    
+                    logger.info(f"Recreando {len(secondary_indexes)} índices secundarios...")
+                    for idx in secondary_indexes:
+                        await db.execute(CreateIndex(idx, if_not_exists=True))
             
-            # Estadísticas por categoría
-            stats_result = await db.execute(text("""
-                SELECT 
-                    category,
-                    COUNT(*) as total,
-                    COUNT(DISTINCT gkey) as unique_containers,
-                    SUM(CASE WHEN nominal_length = 20 THEN 1 ELSE 0 END) as containers_20,
-                    SUM(CASE WHEN nominal_length = 40 THEN 1 ELSE 0 END) as containers_40,
-                    SUM(CASE WHEN requires_power THEN 1 ELSE 0 END) as reefer,
-                    SUM(CASE WHEN hazardous THEN 1 ELSE 0 END) as hazardous
-                FROM container_positions
-                WHERE EXTRACT(YEAR FROM fecha) = :year
-                GROUP BY category
-            """), {"year": year})
+            # Estadísticas frescas para el planner antes de los GROUP BY
+            await db.execute(text("ANALYZE container_positions"))
+            await db.commit()
+            
+            # Estadísticas finales: total, por categoría y por bloque en un solo scan
+            # en una sesión aparte de solo lectura, con snapshot propio
+            async with async_session() as stats_db:
+                await stats_db.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY"))
+                stats_result = await stats_db.execute(text("""
+                    WITH cp AS (
+                        SELECT category, bloque, fecha, turno, gkey,
+                               nominal_length, requires_power, hazardous
+                        FROM container_positions
+                        WHERE fecha >= :d0 AND fecha < :d1
+                    )
+                    SELECT 
+                        GROUPING(category) as g_category,
+                        GROUPING(bloque) as g_bloque,
+                        category,
+                        bloque,
+                        COUNT(*) as total,
+                        COUNT(DISTINCT gkey) as unique_containers,
+                        COUNT(*) FILTER (WHERE nominal_length = 20) as containers_20,
+                        COUNT(*) FILTER (WHERE nominal_length = 40) as containers_40,
+                        COUNT(*) FILTER (WHERE requires_power) as reefer,
+                        COUNT(*) FILTER (WHERE hazardous) as hazardous,
+                        COUNT(DISTINCT fecha) as dias,
+                        COUNT(DISTINCT CONCAT(fecha, '-', turno)) as turnos
+                    FROM cp
+                    GROUP BY GROUPING SETS ((category), (bloque), ())
+                    ORDER BY category, bloque
+                """), {"d0": date(year, 1, 1), "d1": date(year + 1, 1, 1)})
+                
+                rows = stats_result.all()
+            
+            category_rows = [row for row in rows if row.g_category == 0]
+            block_rows = [row for row in rows if row.g_bloque == 0]
+            total_in_db = next(
+                (row.total for row in rows if row.g_category == 1 and row.g_bloque == 1), 0
+            )
+            logger.info(f"\nTotal posiciones en BD para {year}: {total_in_db:,}")
             
             logger.info("\n=== ESTADÍSTICAS POR CATEGORÍA ===")
-            for row in stats_result:
+            for row in category_rows:
                 logger.info(f"\nCategoría: {row.category}")
                 logger.info(f"  Total posiciones: {row.total:,}")
                 logger.info(f"  Contenedores únicos: {row.unique_containers:,}")
@@ -166,26 +318,12 @@ async def main(year: int = 2022, week: str = None, specific_date: str = None):
                 logger.info(f"  Reefer: {row.reefer:,}")
                 logger.info(f"  Peligrosos: {row.hazardous:,}")
             
-            # Estadísticas por bloque
-            block_result = await db.execute(text("""
-                SELECT 
-                    bloque,
-                    COUNT(*) as total,
-                    COUNT(DISTINCT fecha) as dias,
-                    COUNT(DISTINCT CONCAT(fecha, '-', turno)) as turnos
-                FROM container_positions
-                WHERE EXTRACT(YEAR FROM fecha) = :year
-                GROUP BY bloque
-                ORDER BY bloque
-            """), {"year": year})
-            
             logger.info("\n=== ESTADÍSTICAS POR BLOQUE ===")
-            for row in block_result:
+            for row in block_rows:
                 logger.info(f"Bloque {row.bloque}: {row.total:,} posiciones, {row.dias} días, {row.turnos} turnos")
     
     # Tiempo total
-    end_time = datetime.now()
-    duration = end_time - start_time
+    duration = timedelta(seconds=time.perf_counter() - start_time)
     logger.info(f"\n⏱️  Tiempo total de ejecución: {duration}")
     logger.info("✅ Proceso completado exitosamente")
 
@@ -194,8 +332,11 @@ if __name__ == "__main__":
     parser.add_argument('--year', type=int, default=2022, help='Año de datos a cargar (default: 2022)')
     parser.add_argument('--week', type=str, help='Semana específica en formato ISO (ej: 2022-01-03)')
     parser.add_argument('--date', type=str, help='Fecha específica (ej: 2022-01-03)')
+    parser.add_argument('--init-schema', action='store_true', help='Crear tablas que no existan antes de cargar')
+    parser.add_argument('--resume', action='store_true', help='Omitir archivos ya cargados (mismo mtime) en la carga del año')
     
     args = parser.parse_args()
     
     # Ejecutar carga
-    asyncio.run(main(year=args.year, week=args.week, specific_date=args.date))
\ No newline at end of file
+    install_uvloop()
+    asyncio.run(main(year=args.year, week=args.week, specific_date=args.date, init_schema=args.init_schema, resume=args.resume))
\ No newline at end of file
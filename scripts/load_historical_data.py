@@ -1,23 +1,21 @@
 # scripts/load_historical_data.py
 import asyncio
+import os
 import sys
 from pathlib import Path
 import argparse
 import logging
+import time
 from datetime import datetime
-import subprocess
-import threading
-import queue
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.config import get_settings
+from scripts._engine import build_engine, build_session_factory, create_tables, install_uvloop, prewarm_pool
 from app.services.csv_loader import CSVLoaderService
-from app.models.base import Base
+from scripts.load_movement_flows import create_ultimo_bloque, load_flows, update_bloques
 
 # Configurar logging
 logging.basicConfig(
@@ -26,78 +24,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-settings = get_settings()
+# Formato de las filas de verificación (plantillas precompuestas)
+STATS_ROW = "{:<20} {:<15,} {:<15,} {:>7.1f}% {:<15,} {:>7.1f}%".format
+CDT_SAMPLE_ROW = "{:<12} {:<8} {:<10,} {:<15.2f} {:<12.2f}".format
 
-def read_output(pipe, q):
-    """Leer salida del subprocess en tiempo real"""
-    for line in iter(pipe.readline, ''):
-        q.put(line)
-    pipe.close()
-
-def load_movement_flows(clear_existing: bool = False):
-    """
-    Llamar al script load_movement_flows.py con salida en tiempo real
-    """
-    logger.info("\n📥 CARGANDO MOVEMENT FLOWS...")
-    logger.info("⚠️  Este proceso puede tomar varios minutos debido al tamaño del archivo...")
-    
-    cmd = ["python", "-u", "scripts/load_movement_flows.py", "--file", "data/Flujos.csv", "--year-from", "2017"]
-    
-    if clear_existing:
-        cmd.append("--clear")
-    
+def list_data_files(directory: str) -> set:
+    """Nombres de archivos del directorio en un solo listado; vacío si no existe"""
     try:
-        # Crear el proceso
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-        
-        # Cola para capturar salida
-        q = queue.Queue()
-        
-        # Thread para leer stdout
-        stdout_thread = threading.Thread(target=read_output, args=(process.stdout, q))
-        stdout_thread.daemon = True
-        stdout_thread.start()
-        
-        # Leer y mostrar salida en tiempo real
-        last_progress_time = datetime.now()
-        while True:
-            try:
-                line = q.get(timeout=1)
-                if line:
-                    # Mostrar líneas importantes
-                    if any(keyword in line for keyword in ['✅', '❌', 'registros', 'ERROR', 'Procesados', 'Total']):
-                        logger.info(f"  Movement Flows: {line.strip()}")
-            except queue.Empty:
-                # Verificar si el proceso terminó
-                if process.poll() is not None:
-                    break
-                
-                # Mostrar mensaje de progreso cada 30 segundos
-                if (datetime.now() - last_progress_time).seconds > 30:
-                    logger.info("  ⏳ Procesando Movement Flows...")
-                    last_progress_time = datetime.now()
-        
-        # Esperar a que termine
-        stdout_thread.join(timeout=1)
-        return_code = process.wait()
-        
-        if return_code == 0:
-            logger.info("✅ Movement Flows cargados exitosamente")
-            return True
-        else:
-            stderr = process.stderr.read()
-            logger.error(f"❌ Error al cargar Movement Flows: {stderr}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"❌ Error ejecutando load_movement_flows.py: {e}")
-        return False
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries}
+    except FileNotFoundError:
+        return set()
 
 async def update_blocks_from_flows(db: AsyncSession, year_from: int = 2017):
     """
@@ -125,62 +62,17 @@ async def update_blocks_from_flows(db: AsyncSession, year_from: int = 2017):
         logger.warning("No hay Movement Flows disponibles para actualizar bloques")
         return 0, 0
     
-    # Actualizar CDT
-    logger.info("Actualizando bloques en CDT...")
-    result = await db.execute(text("""
-        WITH ultimo_bloque AS (
-            SELECT DISTINCT ON (ime_ufv_gkey)
-                ime_ufv_gkey,
-                patio,
-                bloque,
-                ime_time
-            FROM movement_flows
-            WHERE patio IS NOT NULL 
-              AND bloque IS NOT NULL
-              AND ime_time >= :year_from
-            ORDER BY ime_ufv_gkey, ime_time DESC
-        )
-        UPDATE container_dwell_times cdt
-        SET 
-            patio = ub.patio,
-            bloque = ub.bloque,
-            updated_at = CURRENT_TIMESTAMP
-        FROM ultimo_bloque ub
-        WHERE cdt.iufv_gkey = ub.ime_ufv_gkey
-          AND (cdt.patio IS NULL OR cdt.bloque IS NULL)
-        RETURNING cdt.iufv_gkey;
-    """), {"year_from": year_from_date})
-    
-    cdt_updated = result.rowcount
-    await db.commit()
+    # Memoria solo para esta transacción: el índice parcial y el DISTINCT ON se
+    # resuelven en memoria sin tocar la configuración del resto de las sesiones
+    await db.execute(text("SET LOCAL work_mem = '1GB'"))
+    await db.execute(text("SET LOCAL maintenance_work_mem = '2GB'"))
     
-    # Actualizar TTT
-    logger.info("Actualizando bloques en TTT...")
-    result = await db.execute(text("""
-        WITH ultimo_bloque AS (
-            SELECT DISTINCT ON (ime_ufv_gkey)
-                ime_ufv_gkey,
-                patio,
-                bloque,
-                ime_time
-            FROM movement_flows
-            WHERE patio IS NOT NULL 
-              AND bloque IS NOT NULL
-              AND ime_time >= :year_from
-            ORDER BY ime_ufv_gkey, ime_time DESC
-        )
-        UPDATE truck_turnaround_times ttt
-        SET 
-            patio = ub.patio,
-            bloque = ub.bloque,
-            updated_at = CURRENT_TIMESTAMP
-        FROM ultimo_bloque ub
-        WHERE ttt.iufv_gkey = ub.ime_ufv_gkey
-          AND (ttt.patio IS NULL OR ttt.bloque IS NULL)
-        RETURNING ttt.iufv_gkey;
-    """), {"year_from": year_from_date})
+    # Último bloque conocido por contenedor (mismo cálculo que load_movement_flows)
+    # y ambos UPDATE en una sola sentencia: un viaje al servidor y un solo commit
+    await create_ultimo_bloque(db, year_from_date)
     
-    ttt_updated = result.rowcount
+    logger.info("Actualizando bloques en CDT y TTT...")
+    cdt_updated, ttt_updated = await update_bloques(db, "(t.patio IS NULL OR t.bloque IS NULL)")
     await db.commit()
     
     logger.info(f"✅ CDT actualizados: {cdt_updated:,} registros")
@@ -188,7 +80,7 @@ async def update_blocks_from_flows(db: AsyncSession, year_from: int = 2017):
     
     return cdt_updated, ttt_updated
 
-async def main(year: int = 2022, load_all: bool = False, clear_existing: bool = False, skip_flows: bool = False):
+async def main(year: int = 2022, load_all: bool = False, clear_existing: bool = False, skip_flows: bool = False, init_schema: bool = False):
     """
     Función principal para cargar datos históricos
     
@@ -197,24 +89,29 @@ async def main(year: int = 2022, load_all: bool = False, clear_existing: bool =
         load_all: Si True, carga todos los tipos de datos (movimientos, CDT, TTT, flows)
         clear_existing: Si True, limpia datos existentes antes de cargar
         skip_flows: Si True, omite la carga de Movement Flows
+        init_schema: Si True, crea las tablas que falten antes de cargar
     """
     # Crear engine
-    engine = create_async_engine(settings.DATABASE_URL)
+    engine = build_engine()
     
     # Crear tablas si no existen
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if init_schema:
+        await create_tables(engine)
     
     # Crear sesión
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async_session = build_session_factory(engine)
+    
+    # Conexiones listas antes de las cargas: sesión principal + 5 cargas en paralelo
+    await prewarm_pool(engine, 6)
     
     async with async_session() as db:
-        # Limpiar datos si se especifica (excepto movement_flows que se limpia en su propio script)
+        # Limpiar datos si se especifica (excepto movement_flows que se limpia en load_flows)
         if clear_existing:
             logger.info("🧹 Limpiando datos existentes...")
-            await db.execute(text("TRUNCATE TABLE historical_movements RESTART IDENTITY CASCADE"))
-            await db.execute(text("TRUNCATE TABLE container_dwell_times RESTART IDENTITY CASCADE"))
-            await db.execute(text("TRUNCATE TABLE truck_turnaround_times RESTART IDENTITY CASCADE"))
+            await db.execute(text(
+                "TRUNCATE TABLE historical_movements, container_dwell_times, truck_turnaround_times "
+                "RESTART IDENTITY CASCADE"
+            ))
             await db.commit()
             logger.info("✅ Datos existentes eliminados")
         
@@ -233,17 +130,40 @@ async def main(year: int = 2022, load_all: bool = False, clear_existing: bool =
                 'ttt_export': 0
             }
             
-            total_start = datetime.now()
+            total_start = time.perf_counter()
+            
+            # Archivos de movimientos, CDT y TTT: (clave, etiqueta, ruta, carga)
+            flows_path = "data/Flujos.csv"
+            load_tasks = [
+                ('movements', "Movimientos históricos", f"data/resultados_congestion_SAI_{year}.csv",
+                 lambda svc, path: svc.load_historical_csv(path)),
+                ('cdt_import', "CDT Import", f"data/resultados_CDT_impo_anio_SAI_{year}.csv",
+                 lambda svc, path: svc.load_cdt_csv(path, 'import')),
+                ('cdt_export', "CDT Export", f"data/resultados_CDT_expo_anio_SAI_{year}.csv",
+                 lambda svc, path: svc.load_cdt_csv(path, 'export')),
+                ('ttt_import', "TTT Import", f"data/resultados_TTT_impo_anio_SAI_{year}.csv",
+                 lambda svc, path: svc.load_ttt_csv(path, 'import')),
+                ('ttt_export', "TTT Export", f"data/resultados_TTT_expo_anio_SAI_{year}.csv",
+                 lambda svc, path: svc.load_ttt_csv(path, 'export')),
+            ]
+            
+            # Verificar todos los archivos con un solo listado de data/, fuera del event loop
+            loop = asyncio.get_running_loop()
+            present = await loop.run_in_executor(None, list_data_files, "data")
+            flows_exists = Path(flows_path).name in present
+            csv_exists = [Path(csv_path).name in present for _, _, csv_path, _ in load_tasks]
             
-            # 1. PRIMERO: Cargar Movement Flows usando el script externo (si no se omite)
+            # 1. PRIMERO: Cargar Movement Flows en este mismo proceso (si no se omite)
             if not skip_flows:
-                flows_path = "data/Flujos.csv"
-                if Path(flows_path).exists():
-                    flow_success = load_movement_flows(clear_existing)
-                    if flow_success:
-                        # Verificar cuántos se cargaron
-                        count_result = await db.execute(text("SELECT COUNT(*) FROM movement_flows"))
-                        results['flows'] = count_result.scalar() or 0
+                if flows_exists:
+                    logger.info("\n📥 CARGANDO MOVEMENT FLOWS...")
+                    logger.info("⚠️  Este proceso puede tomar varios minutos debido al tamaño del archivo...")
+                    try:
+                        results['flows'] = await load_flows(db, flows_path, 2017, clear_existing)
+                        logger.info("✅ Movement Flows cargados exitosamente")
+                    except Exception as e:
+                        await db.rollback()
+                        logger.error(f"❌ Error al cargar Movement Flows: {e}")
                 else:
                     logger.warning(f"❌ No se encontró archivo de flujos: {flows_path}")
             else:
@@ -255,85 +175,41 @@ async def main(year: int = 2022, load_all: bool = False, clear_existing: bool =
                     logger.info(f"   Movement Flows existentes: {existing_flows:,} registros")
                     results['flows'] = existing_flows
             
-            # 2. Cargar movimientos históricos
-            try:
-                csv_path = f"data/resultados_congestion_SAI_{year}.csv"
-                if Path(csv_path).exists():
-                    logger.info("\n📥 CARGANDO MOVIMIENTOS HISTÓRICOS...")
-                    hist_start = datetime.now()
-                    results['movements'] = await service.load_historical_csv(csv_path)
-                    hist_elapsed = (datetime.now() - hist_start).total_seconds()
-                    logger.info(f"✅ Movimientos: {results['movements']:,} registros en {hist_elapsed:.2f} segundos")
-                else:
-                    logger.warning(f"❌ No se encontró archivo de movimientos: {csv_path}")
-            except Exception as e:
-                logger.error(f"Error cargando movimientos: {e}")
-            
-            # 3-6. Cargar CDT y TTT (igual que antes)
-            # [El resto del código permanece igual...]
+            # 2-6. Movimientos, CDT y TTT van a tablas distintas y no dependen
+            # entre sí: se cargan en paralelo, cada uno con su propia sesión
+            async def run_load(label, csv_path, loader):
+                logger.info(f"\n📥 CARGANDO {label.upper()}...")
+                task_start = time.perf_counter()
+                async with async_session() as task_db:
+                    records = await loader(CSVLoaderService(task_db), csv_path)
+                task_elapsed = time.perf_counter() - task_start
+                logger.info(f"✅ {label}: {records:,} registros en {task_elapsed:.2f} segundos")
+                return records
             
-            # 3. Cargar CDT importación
-            try:
-                cdt_import_path = f"data/resultados_CDT_impo_anio_SAI_{year}.csv"
-                if Path(cdt_import_path).exists():
-                    logger.info("\n📥 CARGANDO CDT IMPORTACIÓN...")
-                    cdt_start = datetime.now()
-                    results['cdt_import'] = await service.load_cdt_csv(cdt_import_path, 'import')
-                    cdt_elapsed = (datetime.now() - cdt_start).total_seconds()
-                    logger.info(f"✅ CDT Import: {results['cdt_import']:,} registros en {cdt_elapsed:.2f} segundos")
+            existing_tasks = []
+            for task, exists in zip(load_tasks, csv_exists):
+                if exists:
+                    existing_tasks.append(task)
                 else:
-                    logger.warning(f"❌ No se encontró archivo CDT import: {cdt_import_path}")
-            except Exception as e:
-                logger.error(f"Error cargando CDT importación: {e}")
+                    logger.warning(f"❌ No se encontró archivo {task[1]}: {task[2]}")
             
-            # 4. Cargar CDT exportación
-            try:
-                cdt_export_path = f"data/resultados_CDT_expo_anio_SAI_{year}.csv"
-                if Path(cdt_export_path).exists():
-                    logger.info("\n📥 CARGANDO CDT EXPORTACIÓN...")
-                    cdt_start = datetime.now()
-                    results['cdt_export'] = await service.load_cdt_csv(cdt_export_path, 'export')
-                    cdt_elapsed = (datetime.now() - cdt_start).total_seconds()
-                    logger.info(f"✅ CDT Export: {results['cdt_export']:,} registros en {cdt_elapsed:.2f} segundos")
-                else:
-                    logger.warning(f"❌ No se encontró archivo CDT export: {cdt_export_path}")
-            except Exception as e:
-                logger.error(f"Error cargando CDT exportación: {e}")
-            
-            # 5. Cargar TTT importación
-            try:
-                ttt_import_path = f"data/resultados_TTT_impo_anio_SAI_{year}.csv"
-                if Path(ttt_import_path).exists():
-                    logger.info("\n📥 CARGANDO TTT IMPORTACIÓN...")
-                    ttt_start = datetime.now()
-                    results['ttt_import'] = await service.load_ttt_csv(ttt_import_path, 'import')
-                    ttt_elapsed = (datetime.now() - ttt_start).total_seconds()
-                    logger.info(f"✅ TTT Import: {results['ttt_import']:,} registros en {ttt_elapsed:.2f} segundos")
-                else:
-                    logger.warning(f"❌ No se encontró archivo TTT import: {ttt_import_path}")
-            except Exception as e:
-                logger.error(f"Error cargando TTT importación: {e}")
+            results_list = await asyncio.gather(
+                *(run_load(label, csv_path, loader) for _, label, csv_path, loader in existing_tasks),
+                return_exceptions=True
+            )
             
-            # 6. Cargar TTT exportación
-            try:
-                ttt_export_path = f"data/resultados_TTT_expo_anio_SAI_{year}.csv"
-                if Path(ttt_export_path).exists():
-                    logger.info("\n📥 CARGANDO TTT EXPORTACIÓN...")
-                    ttt_start = datetime.now()
-                    results['ttt_export'] = await service.load_ttt_csv(ttt_export_path, 'export')
-                    ttt_elapsed = (datetime.now() - ttt_start).total_seconds()
-                    logger.info(f"✅ TTT Export: {results['ttt_export']:,} registros en {ttt_elapsed:.2f} segundos")
+            for (result_key, label, _, _), outcome in zip(existing_tasks, results_list):
+                if isinstance(outcome, Exception):
+                    logger.error(f"Error cargando {label}: {outcome}")
                 else:
-                    logger.warning(f"❌ No se encontró archivo TTT export: {ttt_export_path}")
-            except Exception as e:
-                logger.error(f"Error cargando TTT exportación: {e}")
+                    results[result_key] = outcome
             
             # 7. ACTUALIZAR BLOQUES en CDT y TTT
             if results['flows'] > 0 and (results['cdt_import'] > 0 or results['cdt_export'] > 0 or 
                                        results['ttt_import'] > 0 or results['ttt_export'] > 0):
                 cdt_blocks, ttt_blocks = await update_blocks_from_flows(db)
             
-            total_elapsed = (datetime.now() - total_start).total_seconds()
+            total_elapsed = time.perf_counter() - total_start
             
             # Resumen final
             logger.info("\n" + "="*80)
@@ -361,54 +237,43 @@ async def main(year: int = 2022, load_all: bool = False, clear_existing: bool =
         if load_all:
             logger.info("\n=== VERIFICACIÓN DE DATOS ===")
             
-            # Verificar estadísticas generales
-            stats = await db.execute(text("""
-                SELECT 
-                    'Movement Flows' as tabla,
-                    COUNT(*) as total,
-                    COUNT(patio) as con_patio,
-                    COUNT(bloque) as con_bloque,
-                    ROUND(COUNT(patio)::numeric * 100.0 / NULLIF(COUNT(*), 0), 2) as pct_patio,
-                    ROUND(COUNT(bloque)::numeric * 100.0 / NULLIF(COUNT(*), 0), 2) as pct_bloque
-                FROM movement_flows
-                UNION ALL
-                SELECT 
-                    'CDT' as tabla,
-                    COUNT(*) as total,
-                    COUNT(patio) as con_patio,
-                    COUNT(bloque) as con_bloque,
-                    ROUND(COUNT(patio)::numeric * 100.0 / NULLIF(COUNT(*), 0), 2) as pct_patio,
-                    ROUND(COUNT(bloque)::numeric * 100.0 / NULLIF(COUNT(*), 0), 2) as pct_bloque
-                FROM container_dwell_times
-                UNION ALL
+            # Verificar estadísticas generales: una consulta por tabla, en paralelo
+            # y cada una en su propia sesión, para que los tres scans se solapen.
+            # Etiqueta y tabla van como literales (constantes del script): un bind
+            # sin tipo en el SELECT no lo puede inferir asyncpg
+            stats_sql = """
                 SELECT 
-                    'TTT' as tabla,
+                    '{label}'::text as tabla,
                     COUNT(*) as total,
                     COUNT(patio) as con_patio,
                     COUNT(bloque) as con_bloque,
                     ROUND(COUNT(patio)::numeric * 100.0 / NULLIF(COUNT(*), 0), 2) as pct_patio,
                     ROUND(COUNT(bloque)::numeric * 100.0 / NULLIF(COUNT(*), 0), 2) as pct_bloque
-                FROM truck_turnaround_times
-            """))
+                FROM {table}
+            """
+            
+            async def table_stats(label, table):
+                async with async_session() as stats_db:
+                    result = await stats_db.execute(text(stats_sql.format(label=label, table=table)))
+                    return result.first()
+            
+            stats = await asyncio.gather(
+                table_stats('Movement Flows', 'movement_flows'),
+                table_stats('CDT', 'container_dwell_times'),
+                table_stats('TTT', 'truck_turnaround_times'),
+            )
             
             logger.info(f"\n{'Tabla':<20} {'Total':<15} {'Con Patio':<15} {'%':<8} {'Con Bloque':<15} {'%':<8}")
             logger.info("-"*90)
             for row in stats:
                 # Manejar valores None
-                total = row.total or 0
-                con_patio = row.con_patio or 0
-                con_bloque = row.con_bloque or 0
-                pct_patio = row.pct_patio or 0.0
-                pct_bloque = row.pct_bloque or 0.0
-                
-                logger.info(
-                    f"{row.tabla:<20} {total:<15,} {con_patio:<15,} "
-                    f"{pct_patio:>7.1f}% {con_bloque:<15,} {pct_bloque:>7.1f}%"
-                )
+                logger.info(STATS_ROW(
+                    row.tabla, row.total or 0, row.con_patio or 0,
+                    row.pct_patio or 0.0, row.con_bloque or 0, row.pct_bloque or 0.0
+                ))
             
-            # Verificar CDT con patio/bloque
-# Verificar CDT con patio/bloque
-            cdt_check = await db.execute(
+            # Verificar CDT con patio/bloque (filas leídas a medida que llegan)
+            cdt_check = await db.stream(
                 text("""
                 SELECT 
                     patio,
@@ -426,20 +291,18 @@ async def main(year: int = 2022, load_all: bool = False, clear_existing: bool =
                 """)
             )
             
-            rows = cdt_check.fetchall()
-            if rows:
-                logger.info("\n📊 Muestra de datos CDT por patio/bloque:")
-                logger.info(f"{'Patio':<12} {'Bloque':<8} {'Total':<10} {'CDT Prom (h)':<15} {'CDT Prom (d)':<12}")
-                logger.info("-"*60)
-                for row in rows:
-                    total = row.total or 0
-                    avg_hours = row.avg_cdt_hours or 0.0
-                    avg_days = row.avg_cdt_days or 0.0
-                    
-                    logger.info(
-                        f"{row.patio:<12} {row.bloque:<8} {total:<10,} "
-                        f"{avg_hours:<15.2f} {avg_days:<12.2f}"
-                    )
+            header_logged = False
+            async for row in cdt_check:
+                if not header_logged:
+                    logger.info("\n📊 Muestra de datos CDT por patio/bloque:")
+                    logger.info(f"{'Patio':<12} {'Bloque':<8} {'Total':<10} {'CDT Prom (h)':<15} {'CDT Prom (d)':<12}")
+                    logger.info("-"*60)
+                    header_logged = True
+                
+                logger.info(CDT_SAMPLE_ROW(
+                    row.patio, row.bloque, row.total or 0,
+                    row.avg_cdt_hours or 0.0, row.avg_cdt_days or 0.0
+                ))
             
             logger.info("\n✅ PROCESO COMPLETADO EXITOSAMENTE!")
 
@@ -449,8 +312,10 @@ if __name__ == "__main__":
     parser.add_argument('--all', action='store_true', help='Cargar todos los tipos de datos (movimientos, CDT, TTT, flows)')
     parser.add_argument('--clear', action='store_true', help='Limpiar datos existentes antes de cargar')
     parser.add_argument('--skip-flows', action='store_true', help='Omitir la carga de Movement Flows')
+    parser.add_argument('--init-schema', action='store_true', help='Crear tablas que no existan antes de cargar')
     
     args = parser.parse_args()
     
     # Ejecutar carga
-    asyncio.run(main(year=args.year, load_all=args.all, clear_existing=args.clear, skip_flows=args.skip_flows))
\ No newline at end of file
+    install_uvloop()
+    asyncio.run(main(year=args.year, load_all=args.all, clear_existing=args.clear, skip_flows=args.skip_flows, init_schema=args.init_schema))
\ No newline at end of file
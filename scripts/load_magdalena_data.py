@@ -4,16 +4,28 @@ import os
 from pathlib import Path
 import sys
 import traceback
+from contextlib import asynccontextmanager
 from datetime import datetime
 import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor
+import re
+import numpy as np
 
 # Agregar el directorio raíz al path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.core.database import AsyncSessionLocal
+from app.core.database import AsyncSessionLocal, engine
+from scripts._engine import install_uvloop
+from scripts._loader_common import (
+    FileRec, dir_signature, load_manifest, manifest_path, parse_iso_date, resolve_base_path, save_manifest,
+    scan_date_dirs, scan_subdirs
+)
 from app.services.optimization_loader import OptimizationLoader
+from app.utils.excel import read_workbook
 from sqlalchemy import text, delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.schema import CreateIndex
 from app.models.optimization import *
 
 # Configurar logging
@@ -105,10 +117,111 @@ DISTANCIAS_COSTANERA = {
     ('C9', 'SITIO_CARGA'): 540,
 }
 
-def get_week_from_date(date_str):
-    """Obtiene el número de semana ISO desde una fecha YYYY-MM-DD"""
-    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-    return date_obj.isocalendar()[1]
+# Tipo de cada nodo de DISTANCIAS_COSTANERA (universo fijo: una búsqueda en vez de comparar textos)
+TIPO_NODO = {f'C{i}': 'bloque' for i in range(1, 10)} | {
+    'GATE': 'gate',
+    'SITIO_SUR': 'sitio',
+    'SITIO_NORTE': 'sitio',
+    'SITIO_CARGA': 'sitio',
+    'PATIO': 'patio',
+}
+
+# Nodos del grafo de distancias y su índice en la matriz
+NODOS = list(TIPO_NODO)
+NODO_INDEX = {nodo: i for i, nodo in enumerate(NODOS)}
+
+def build_matriz_distancias() -> np.ndarray:
+    """Matriz densa int16 (origen x destino) de DISTANCIAS_COSTANERA; -1 donde no hay distancia"""
+    matriz = np.full((len(NODOS), len(NODOS)), -1, dtype=np.int16)
+    for (origen, destino), distancia in DISTANCIAS_COSTANERA.items():
+        matriz[NODO_INDEX[origen], NODO_INDEX[destino]] = distancia
+    return matriz
+
+# Las consultas de distancia son MATRIZ_DISTANCIAS[NODO_INDEX[o], NODO_INDEX[d]], sin hashear tuplas
+MATRIZ_DISTANCIAS = build_matriz_distancias()
+
+# Participación (60-80) y dispersión opcional (K/N) en el nombre del archivo de resultado,
+# p. ej. resultado_2022-01-03_68_K.xlsx: primer segmento numérico en rango y el siguiente
+# segmento; se aplica al nombre completo (el fin del segmento puede ser la extensión)
+RESULTADO_RE = re.compile(r'(?:^|_)0*(6\d|7\d|80)(?:_([KN]))?(?=_|\.xlsx$)')
+
+# Segmentos "_<n>_" (con la dispersión que siga, si hay) y "_<n>..." en nombres de archivo
+SEGMENTO_RE = re.compile(r'_(\d+)(?=_([KN])?)')
+NUMERO_RE = re.compile(r'_(\d+)')
+
+def index_instancias(instancia_files: list) -> dict:
+    """
+    Indexar archivos de instancia por (participación, dispersión) en una pasada.
+    Equivale a buscar "_<p>_" / "_<p>_<K|N>" en el nombre: gana el primer archivo que calce.
+    """
+    index = {}
+    for inst in instancia_files:
+        for match in SEGMENTO_RE.finditer(inst.name):
+            index.setdefault((match.group(1), None), inst)
+            if match.group(2):
+                index.setdefault((match.group(1), match.group(2)), inst)
+    return index
+
+def index_distancias(distancia_files: list) -> dict:
+    """
+    Indexar archivos de distancia del modelo (sin Costanera) por participación.
+    Equivale a buscar "_<p>" en el nombre: gana el primer archivo que calce.
+    """
+    index = {}
+    for dist in distancia_files:
+        if 'Costanera' in dist.name:
+            continue
+        for match in NUMERO_RE.finditer(dist.name):
+            digits = match.group(1)
+            for end in range(1, len(digits) + 1):
+                index.setdefault(digits[:end], dist)
+    return index
+
+@asynccontextmanager
+async def safe_load(db, label: str):
+    """Ejecutar una carga en un savepoint: si falla se registra el error y solo se deshace esa carga"""
+    try:
+        async with db.begin_nested():
+            yield
+    except Exception as e:
+        logger.error(f"   ❌ {label} Error: {str(e)}")
+        if os.environ.get("DEBUG"):
+            traceback.print_exc()
+
+# Parámetros de carga que apuntan a libros Excel
+EXCEL_PARAMS = ('resultado_filepath', 'instancia_filepath', 'flujos_filepath', 'distancias_filepath')
+
+# Tipo de archivo Excel según el prefijo del nombre
+PREFIJOS_ARCHIVO = {
+    'resultado_': 'resultado',
+    'Distancias_': 'distancias',
+    'Flujos_': 'flujos',
+    'Instancia_': 'instancia',
+}
+
+def classify_dir(directory: Path) -> dict:
+    """Archivos .xlsx (FileRec) de un directorio agrupados por tipo, en un solo listado; vacío si no existe"""
+    archivos = {tipo: [] for tipo in PREFIJOS_ARCHIVO.values()}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.xlsx') or not entry.is_file():
+                    continue
+                for prefijo, tipo in PREFIJOS_ARCHIVO.items():
+                    if entry.name.startswith(prefijo):
+                        archivos[tipo].append(FileRec(entry.name, entry.path))
+                        break
+    except FileNotFoundError:
+        pass
+    return archivos
+
+def discover_fecha(fecha_dir: Path, instancia_dir: Path = None) -> tuple:
+    """Clasificar los archivos de una fecha y de su directorio de instancias, con su huella (bloqueante)"""
+    instancia_files = classify_dir(instancia_dir) if instancia_dir else {tipo: [] for tipo in PREFIJOS_ARCHIVO.values()}
+    return classify_dir(fecha_dir), instancia_files, dir_signature(fecha_dir, instancia_dir)
+
+# Clave del advisory lock de Postgres que serializa las cargas de distancias
+DISTANCIAS_LOCK_KEY = 918273645
 
 async def load_distancias_hardcoded():
     """Carga las distancias hardcodeadas en la base de datos"""
@@ -116,52 +229,51 @@ async def load_distancias_hardcoded():
     
     async with AsyncSessionLocal() as db:
         try:
-            # Verificar si ya hay distancias
-            result = await db.execute(text("SELECT COUNT(*) FROM distancias_reales"))
-            count_before = result.scalar()
-            
-            if count_before > 0:
-                logger.info(f"Ya existen {count_before} distancias en la BD, saltando carga")
+            # Solo una carga de distancias a la vez: si otro proceso tiene el lock, ya las está cargando
+            # (el lock se libera solo al terminar la transacción)
+            got_lock = (await db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": DISTANCIAS_LOCK_KEY}
+            )).scalar()
+            if not got_lock:
+                logger.info("Otra carga de distancias está en curso, saltando carga")
                 return True
             
-            # Cargar distancias hardcodeadas
-            for (origen, destino), distancia in DISTANCIAS_COSTANERA.items():
-                # Determinar tipos
-                tipo_origen = 'bloque' if origen.startswith('C') and len(origen) == 2 else \
-                             'gate' if 'GATE' in origen else \
-                             'sitio' if 'SITIO' in origen else \
-                             'patio' if 'PATIO' in origen else 'otro'
-                
-                tipo_destino = 'bloque' if destino.startswith('C') and len(destino) == 2 else \
-                              'gate' if 'GATE' in destino else \
-                              'sitio' if 'SITIO' in destino else \
-                              'patio' if 'PATIO' in destino else 'otro'
-                
-                # Verificar si ya existe
-                existing = await db.execute(
-                    select(DistanciaReal).where(
-                        (DistanciaReal.origen == origen) &
-                        (DistanciaReal.destino == destino)
-                    )
+            # Índice único (origen, destino) del modelo: lo requiere el ON CONFLICT y las
+            # consultas por par (en bases creadas antes de agregarlo al modelo)
+            origen_destino_idx = next(
+                idx for idx in DistanciaReal.__table__.indexes if idx.name == 'idx_distancia_origen_destino'
+            )
+            await db.execute(CreateIndex(origen_destino_idx, if_not_exists=True))
+            
+            # Todas las filas de una vez; los pares ya existentes los descarta el índice único
+            # (origen, destino), así no hace falta contar antes ni después
+            records = [
+                dict(
+                    origen=NODOS[i],
+                    destino=NODOS[j],
+                    distancia_metros=int(MATRIZ_DISTANCIAS[i, j]),
+                    tipo_origen=TIPO_NODO[NODOS[i]],
+                    tipo_destino=TIPO_NODO[NODOS[j]]
                 )
-                if not existing.scalar():
-                    dist = DistanciaReal(
-                        origen=origen,
-                        destino=destino,
-                        distancia_metros=distancia,
-                        tipo_origen=tipo_origen,
-                        tipo_destino=tipo_destino
-                    )
-                    db.add(dist)
+                for i, j in np.argwhere(MATRIZ_DISTANCIAS >= 0)
+            ]
             
-            await db.commit()
+            stmt = (
+                pg_insert(DistanciaReal)
+                .values(records)
+                .on_conflict_do_nothing(index_elements=['origen', 'destino'])
+                .returning(DistanciaReal.id)
+            )
+            result = await db.execute(stmt)
+            insertadas = len(result.all())
             
-            # Verificar cuántas se cargaron
-            result = await db.execute(text("SELECT COUNT(*) FROM distancias_reales"))
-            count_after = result.scalar()
+            await db.commit()
             
-            logger.info(f"✅ Distancias cargadas: {count_after - count_before} nuevas")
-            logger.info(f"📊 Total distancias en BD: {count_after}")
+            if insertadas == 0:
+                logger.info(f"Ya existen las {len(records)} distancias en la BD, saltando carga")
+            else:
+                logger.info(f"✅ Distancias cargadas: {insertadas} nuevas")
+                logger.info(f"📊 Total distancias hardcodeadas: {len(records)}")
             return True
             
         except Exception as e:
@@ -175,7 +287,7 @@ async def clean_all_data():
     
     async with AsyncSessionLocal() as db:
         try:
-            # Orden importante por las foreign keys
+            # Tablas de optimización (el orden ya no importa: TRUNCATE ... CASCADE resuelve las foreign keys)
             tables_to_clean = [
                 'logs_procesamiento',
                 'metricas_temporales',
@@ -192,10 +304,20 @@ async def clean_all_data():
                 'bloques'
             ]
             
+            # Registros por tabla para el log, en una consulta (estimación de las estadísticas de Postgres)
+            result = await db.execute(
+                text("SELECT relname, n_live_tup FROM pg_stat_user_tables WHERE relname = ANY(:names)"),
+                {"names": tables_to_clean}
+            )
+            counts = dict(result.all())
+            
+            # Un solo TRUNCATE: libera los archivos de las tablas sin borrar fila por fila
+            await db.execute(text(
+                f"TRUNCATE TABLE {', '.join(tables_to_clean)} RESTART IDENTITY CASCADE"
+            ))
+            
             for table in tables_to_clean:
-                result = await db.execute(text(f"DELETE FROM {table}"))
-                count = result.rowcount
-                logger.info(f"  - Eliminados {count:,} registros de {table}")
+                logger.info(f"  - Eliminados ~{counts.get(table, 0):,} registros de {table}")
             
             await db.commit()
             logger.info("✅ Base de datos limpiada completamente")
@@ -211,28 +333,32 @@ async def clean_instance_data(fecha_str: str = None, participacion: int = None):
     
     async with AsyncSessionLocal() as db:
         try:
-            # Construir query para buscar instancias
-            query = select(Instancia)
+            # Construir condiciones para buscar instancias
             conditions = []
             
             if fecha_str:
-                fecha = datetime.strptime(fecha_str, '%Y-%m-%d')
+                fecha = parse_iso_date(fecha_str)
+                if fecha is None:
+                    raise ValueError(f"Fecha inválida (se espera YYYY-MM-DD): {fecha_str}")
                 conditions.append(Instancia.fecha_inicio == fecha)
             
             if participacion:
                 conditions.append(Instancia.participacion == participacion)
             
-            if conditions:
-                query = query.where(*conditions)
+            instancia_ids = select(Instancia.id).where(*conditions)
             
-            result = await db.execute(query)
-            instancias = result.scalars().all()
+            # Borrado por conjuntos: un DELETE por tabla hija (las mismas del cascade de la
+            # relación en el modelo) y uno para las instancias, sin cargar objetos en la sesión
+            for relacion in Instancia.__mapper__.relationships:
+                hija = relacion.mapper.class_
+                await db.execute(delete(hija).where(hija.instancia_id.in_(instancia_ids)))
             
-            logger.info(f"Encontradas {len(instancias)} instancias para eliminar")
+            result = await db.execute(delete(Instancia).where(*conditions).returning(Instancia.codigo))
+            codigos = result.scalars().all()
             
-            for instancia in instancias:
-                logger.info(f"  - Eliminando: {instancia.codigo}")
-                await db.delete(instancia)
+            logger.info(f"Encontradas {len(codigos)} instancias para eliminar")
+            for codigo in codigos:
+                logger.info(f"  - Eliminando: {codigo}")
             
             await db.commit()
             logger.info("✅ Instancias eliminadas")
@@ -241,6 +367,19 @@ async def clean_instance_data(fecha_str: str = None, participacion: int = None):
             await db.rollback()
             logger.error(f"❌ Error eliminando instancias: {str(e)}")
             raise
+    
+    # Sacar del manifiesto las fechas afectadas: si no, la próxima carga las omitiría
+    # por no haber cambiado sus archivos. Sin --fecha, una participación puede estar
+    # en cualquier fecha: se descarta el manifiesto completo
+    base_path = resolve_base_path()
+    if base_path is not None:
+        ruta_manifiesto = manifest_path(base_path, 'magdalena')
+        manifiesto = load_manifest(ruta_manifiesto)
+        if fecha_str:
+            manifiesto.pop(fecha_str, None)
+        else:
+            manifiesto.clear()
+        save_manifest(ruta_manifiesto, manifiesto)
 
 async def verify_database():
     """Verifica el estado de la base de datos"""
@@ -248,24 +387,28 @@ async def verify_database():
     
     async with AsyncSessionLocal() as db:
         try:
-            queries = {
-                'instancias': "SELECT COUNT(*), COUNT(DISTINCT participacion), COUNT(DISTINCT semana) FROM instancias",
-                'movimientos_reales': "SELECT COUNT(*) FROM movimientos_reales",
-                'movimientos_modelo': "SELECT COUNT(*) FROM movimientos_modelo",
-                'kpis_comparativos': "SELECT COUNT(*) FROM kpis_comparativos",
-                'resultados_generales': "SELECT COUNT(*) FROM resultados_generales",
-                'bloques': "SELECT COUNT(*) FROM bloques",
-                'segregaciones': "SELECT COUNT(*) FROM segregaciones",
-                'distancias_reales': "SELECT COUNT(*) FROM distancias_reales"
-            }
-            
-            for tabla, query in queries.items():
-                result = await db.execute(text(query))
-                row = result.fetchone()
-                if tabla == 'instancias':
-                    logger.info(f"  - {tabla}: {row[0]:,} registros, {row[1]} participaciones, {row[2]} semanas")
-                else:
-                    logger.info(f"  - {tabla}: {row[0]:,} registros")
+            tablas = [
+                'movimientos_reales', 'movimientos_modelo', 'kpis_comparativos',
+                'resultados_generales', 'bloques', 'segregaciones', 'distancias_reales'
+            ]
+            
+            # Todos los conteos en una sola consulta (un viaje al servidor)
+            conteos = ",\n".join(f"(SELECT COUNT(*) FROM {tabla}) AS {tabla}" for tabla in tablas)
+            result = await db.execute(text(f"""
+                SELECT i.total, i.participaciones, i.semanas,
+                {conteos}
+                FROM (
+                    SELECT COUNT(*) AS total,
+                           COUNT(DISTINCT participacion) AS participaciones,
+                           COUNT(DISTINCT semana) AS semanas
+                    FROM instancias
+                ) i
+            """))
+            row = result.one()
+            
+            logger.info(f"  - instancias: {row.total:,} registros, {row.participaciones} participaciones, {row.semanas} semanas")
+            for tabla in tablas:
+                logger.info(f"  - {tabla}: {row._mapping[tabla]:,} registros")
                     
         except Exception as e:
             logger.error(f"❌ Error verificando base de datos: {str(e)}")
@@ -274,25 +417,18 @@ async def load_optimization_data(
     fecha_especifica: str = None,
     participacion_especifica: int = None,
     limite: int = None,
-    skip_existing: bool = False
+    skip_existing: bool = False,
+    force: bool = False
 ):
     """Carga datos de optimización con filtros opcionales"""
     
     # PRIMERO: Asegurar que las distancias estén cargadas
     await load_distancias_hardcoded()
     
-    optimization_path = os.environ.get('OPTIMIZATION_DATA_PATH', '/app/optimization_data')
-    base_path = Path(optimization_path)
+    base_path = resolve_base_path()
+    if base_path is None:
+        return
     
-    # Fallback a ruta local si no existe en Docker
-    if not base_path.exists():
-        local_path = Path('/home/nejoo/gurobi/resultados_generados')
-        if local_path.exists():
-            base_path = local_path
-        else:
-            logger.error(f"❌ No se encontró la ruta de datos en: {optimization_path}")
-            return
-        
     resultados_path = base_path / 'resultados_magdalena'
     instancias_path = base_path / 'instancias_magdalena'
     
@@ -305,24 +441,23 @@ async def load_optimization_data(
     instancias_exitosas = 0
     instancias_fallidas = 0
     instancias_omitidas = 0
+    fechas_sin_cambios = 0
     
-    # Validar formato de fecha ISO
-    def is_valid_iso_date(dirname):
-        if len(dirname) != 10:
-            return False
-        try:
-            datetime.strptime(dirname, '%Y-%m-%d')
-            return True
-        except ValueError:
-            return False
+    # Manifiesto de fechas ya cargadas: una fecha cuyos archivos no cambiaron se omite
+    # (salvo con --force). Con filtro de participación la fecha no queda completa
+    ruta_manifiesto = manifest_path(base_path, 'magdalena')
+    manifiesto = load_manifest(ruta_manifiesto)
+    registrar_manifiesto = participacion_especifica is None
+    
+    # Obtener directorios de fechas (un solo listado, cada nombre parseado una sola vez)
+    fechas_dirs = scan_date_dirs(resultados_path)
     
-    # Obtener directorios de fechas
-    all_dirs = [d for d in resultados_path.iterdir() if d.is_dir()]
-    fechas_dirs = sorted([d for d in all_dirs if is_valid_iso_date(d.name)])
+    # Fechas con directorio de instancias: un listado en vez de un exists() por fecha
+    instancia_fechas = {d.name for d in scan_subdirs(instancias_path)}
     
     # Aplicar filtro de fecha si se especifica
     if fecha_especifica:
-        fechas_dirs = [d for d in fechas_dirs if d.name == fecha_especifica]
+        fechas_dirs = [(d, fecha) for d, fecha in fechas_dirs if d.name == fecha_especifica]
         if not fechas_dirs:
             logger.warning(f"⚠️  No se encontró la fecha especificada: {fecha_especifica}")
             return
@@ -333,140 +468,223 @@ async def load_optimization_data(
     
     logger.info(f"📅 Procesando {len(fechas_dirs)} fechas\n")
     
-    # Obtener instancias existentes si skip_existing está activo
-    existing_codes = set()
-    if skip_existing:
+    # Cola productor/consumidor: el recorrido de fechas encola el trabajo de cada fecha y
+    # un número fijo de workers (sin superar el pool de conexiones) lo consume, cada uno
+    # con su propia sesión de larga duración
+    num_workers = max(1, min(len(fechas_dirs), engine.pool.size() - 1))
+    cola = asyncio.Queue(maxsize=num_workers * 2)
+    
+    # Resultado por fecha para el manifiesto: fecha -> (huella, completa)
+    fechas_cargadas = {}
+    
+    # Lectura de Excel (CPU) en otros procesos: no bloquea el event loop mientras
+    # las demás fechas escriben en la base
+    excel_pool = ProcessPoolExecutor()
+    
+    async def load_fecha(db, fecha_loads) -> bool:
+        """Cargar las instancias de una fecha en la sesión del worker; True si todas quedaron confirmadas"""
+        nonlocal instancias_exitosas, instancias_fallidas
+        # Libros de la fecha (el de flujos se comparte entre participaciones), leídos
+        # en el pool de procesos; si alguno falla, el loader lo abre y reporta el error
+        paths = list(dict.fromkeys(
+            params[key] for params in fecha_loads for key in EXCEL_PARAMS if params[key]
+        ))
+        loop = asyncio.get_running_loop()
+        leidos = await asyncio.gather(
+            *(loop.run_in_executor(excel_pool, read_workbook, path) for path in paths),
+            return_exceptions=True
+        )
+        workbooks = {path: wb for path, wb in zip(paths, leidos) if not isinstance(wb, Exception)}
+        
+        # Una sola transacción por fecha; cada carga en su savepoint, así un
+        # archivo con error no afecta a las demás cargas de la fecha
+        cargadas = 0
+        for params in fecha_loads:
+            etiqueta = f"{params['fecha_inicio']:%Y-%m-%d} P{params['participacion']}"
+            cargada = False
+            async with safe_load(db, etiqueta):
+                loader = OptimizationLoader(db, workbooks=workbooks)
+                instancia_id = await loader.load_optimization_results(**params, commit=False)
+                logger.info("   ✅ %s cargado exitosamente (ID: %s)", etiqueta, instancia_id)
+                cargada = True
+            
+            if cargada:
+                cargadas += 1
+            else:
+                instancias_fallidas += 1
+        
+        try:
+            await db.commit()
+            instancias_exitosas += cargadas
+        except Exception as e:
+            logger.error(f"   ❌ Error confirmando la fecha {fecha_loads[0]['fecha_inicio']:%Y-%m-%d}: {str(e)}")
+            instancias_fallidas += cargadas
+            # Dejar la sesión lista para la siguiente fecha del worker
+            await db.rollback()
+            return False
+        
+        return cargadas == len(fecha_loads)
+    
+    async def worker():
+        """Consumir fechas de la cola hasta recibir None"""
         async with AsyncSessionLocal() as db:
-            result = await db.execute(select(Instancia.codigo))
-            existing_codes = {row[0] for row in result.all()}
-            logger.info(f"📌 Encontradas {len(existing_codes)} instancias existentes que se omitirán")
+            while True:
+                item = await cola.get()
+                if item is None:
+                    return
+                fecha_str, firma, fecha_loads = item
+                try:
+                    completa = await load_fecha(db, fecha_loads)
+                except Exception as e:
+                    logger.error("   ❌ Error cargando la fecha %s: %s", fecha_str, e)
+                    await db.rollback()
+                    completa = False
+                fechas_cargadas[fecha_str] = (firma, completa)
+    
+    workers = [asyncio.create_task(worker()) for _ in range(num_workers)]
+    
+    # Listado de archivos en un thread, con una fecha de adelanto: el listado de la
+    # siguiente fecha corre mientras las cargas ya lanzadas escriben en la base
+    def discover(fecha_dir):
+        instancia_dir = instancias_path / fecha_dir.name if fecha_dir.name in instancia_fechas else None
+        return asyncio.create_task(asyncio.to_thread(discover_fecha, fecha_dir, instancia_dir))
     
-    for fecha_dir in fechas_dirs:
+    next_discovery = discover(fechas_dirs[0][0]) if fechas_dirs else None
+    
+    for i, (fecha_dir, fecha_inicio) in enumerate(fechas_dirs):
         fecha_str = fecha_dir.name
+        discovery = next_discovery
+        if i + 1 < len(fechas_dirs):
+            next_discovery = discover(fechas_dirs[i + 1][0])
         
         try:
-            fecha_inicio = datetime.strptime(fecha_str, '%Y-%m-%d')
-            semana = get_week_from_date(fecha_str)
+            semana = fecha_inicio.isocalendar()[1]
             anio = fecha_inicio.year
             
-            logger.info(f"\n📁 Procesando {fecha_str} (Año {anio}, Semana {semana})")
-            logger.info(f"{'-'*60}")
+            logger.info("\n📁 Procesando %s (Año %d, Semana %d)", fecha_str, anio, semana)
+            logger.info("-" * 60)
+            
+            # Buscar archivos (un solo listado por directorio, hecho en el thread)
+            fecha_files, instancia_dir_files, firma = await discovery
             
-            # Buscar archivos
-            resultado_files = list(fecha_dir.glob('resultado_*.xlsx'))
-            distancia_files = list(fecha_dir.glob('Distancias_*.xlsx'))
+            if not force and manifiesto.get(fecha_str) == firma:
+                logger.info("   ⏭️  Sin cambios desde la última carga, se omite (usar --force para recargar)")
+                fechas_sin_cambios += 1
+                continue
+            resultado_files = fecha_files['resultado']
+            distancia_files = fecha_files['distancias']
             
             # Buscar archivos de instancia
-            instancia_dir = instancias_path / fecha_str
-            flujos_files = []
-            instancia_files = []
+            flujos_files = instancia_dir_files['flujos']
+            instancia_files = instancia_dir_files['instancia']
             
-            if instancia_dir.exists():
-                flujos_files = list(instancia_dir.glob('Flujos_*.xlsx'))
-                instancia_files = list(instancia_dir.glob('Instancia_*.xlsx'))
+            logger.info("   Encontrados:")
+            logger.info("   - %d archivos de resultado", len(resultado_files))
+            logger.info("   - %d archivos de distancia", len(distancia_files))
+            logger.info("   - %d archivos de instancia", len(instancia_files))
+            logger.info("   - %d archivos de flujos", len(flujos_files))
             
-            logger.info(f"   Encontrados:")
-            logger.info(f"   - {len(resultado_files)} archivos de resultado")
-            logger.info(f"   - {len(distancia_files)} archivos de distancia")
-            logger.info(f"   - {len(instancia_files)} archivos de instancia")
-            logger.info(f"   - {len(flujos_files)} archivos de flujos")
+            # Índices de archivos relacionados: una pasada por fecha, búsquedas O(1) por resultado
+            instancias_por_clave = index_instancias(instancia_files)
+            distancias_por_participacion = index_distancias(distancia_files)
             
-            # Procesar cada archivo de resultado
+            # El archivo de flujos es el mismo para todas las participaciones de la fecha
+            flujos_file = flujos_files[0] if flujos_files else None
+            
+            # Candidatos de la fecha: (archivo, participación, dispersión, código)
+            candidatos = []
             for resultado_file in resultado_files:
-                # Extraer participación
-                parts = resultado_file.stem.split('_')
-                participacion = None
-                con_dispersion = None
-                
-                for i, part in enumerate(parts):
-                    if part.isdigit() and 60 <= int(part) <= 80:
-                        participacion = int(part)
-                        if i + 1 < len(parts):
-                            if parts[i + 1] == 'K':
-                                con_dispersion = True
-                            elif parts[i + 1] == 'N':
-                                con_dispersion = False
-                        break
-                
-                if participacion is None:
+                # Extraer participación y dispersión con una sola búsqueda
+                match = RESULTADO_RE.search(resultado_file.name)
+                if not match:
                     continue
                 
+                participacion = int(match.group(1))
+                dispersion = match.group(2)
+                con_dispersion = None if dispersion is None else dispersion == 'K'
+                
                 # Aplicar filtro de participación si se especifica
                 if participacion_especifica and participacion != participacion_especifica:
                     continue
                 
+                codigo = f"{fecha_str.replace('-', '')}_{participacion}_{dispersion or '?'}"
+                candidatos.append((resultado_file, participacion, con_dispersion, codigo))
+            
+            # Instancias ya cargadas: solo se consultan los códigos candidatos de la fecha
+            existing_codes = set()
+            if skip_existing and candidatos:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        select(Instancia.codigo).where(Instancia.codigo.in_([c[3] for c in candidatos]))
+                    )
+                    existing_codes = set(result.scalars())
+            
+            # Procesar cada archivo de resultado
+            fecha_loads = []
+            for resultado_file, participacion, con_dispersion, codigo in candidatos:
                 # Verificar si ya existe
                 dispersion_str = 'K' if con_dispersion else 'N' if con_dispersion is not None else '?'
-                codigo = f"{fecha_str.replace('-', '')}_{participacion}_{dispersion_str}"
                 
-                if skip_existing and codigo in existing_codes:
-                    logger.info(f"   ⏭️  Omitiendo P{participacion}_{dispersion_str} (ya existe)")
+                if codigo in existing_codes:
+                    logger.info("   ⏭️  Omitiendo P%d_%s (ya existe)", participacion, dispersion_str)
                     instancias_omitidas += 1
                     continue
                 
                 total_instancias += 1
                 
-                logger.info(f"\n   📊 Procesando P{participacion}_{dispersion_str}")
-                
-                # Buscar archivos relacionados
-                flujos_file = flujos_files[0] if flujos_files else None
-                distancia_file = None
-                instancia_file = None
+                logger.info("\n   📊 Procesando P%d_%s", participacion, dispersion_str)
                 
                 # Buscar archivo de distancia específico del modelo (NO Costanera)
-                for dist in distancia_files:
-                    if 'Costanera' in dist.name:
-                        continue
-                    if f"_{participacion}" in dist.name or f"_{participacion}_" in dist.name:
-                        distancia_file = dist
-                        break
+                distancia_file = distancias_por_participacion.get(str(participacion))
                 
                 # Buscar instancia específica
-                for inst in instancia_files:
-                    if f"_{participacion}_" in inst.name:
-                        if con_dispersion is not None:
-                            if f"_{participacion}_{'K' if con_dispersion else 'N'}" in inst.name:
-                                instancia_file = inst
-                                break
-                        else:
-                            instancia_file = inst
-                            break
+                instancia_file = instancias_por_clave.get(
+                    (str(participacion), None if con_dispersion is None else dispersion_str)
+                )
                 
-                logger.info(f"      - Resultado: {resultado_file.name}")
-                logger.info(f"      - Instancia: {instancia_file.name if instancia_file else 'No encontrada'}")
-                logger.info(f"      - Flujos: {flujos_file.name if flujos_file else 'No encontrado'}")
-                logger.info(f"      - Distancias modelo: {distancia_file.name if distancia_file else 'No encontrado'}")
+                # Formato diferido (%s): con el nivel en WARNING no se arma ningún texto por archivo
+                logger.info("      - Resultado: %s", resultado_file.name)
+                logger.info("      - Instancia: %s", instancia_file.name if instancia_file else 'No encontrada')
+                logger.info("      - Flujos: %s", flujos_file.name if flujos_file else 'No encontrado')
+                logger.info("      - Distancias modelo: %s", distancia_file.name if distancia_file else 'No encontrado')
                 
-                try:
-                    async with AsyncSessionLocal() as db:
-                        loader = OptimizationLoader(db)
-                        
-                        instancia_id = await loader.load_optimization_results(
-                            resultado_filepath=str(resultado_file),
-                            instancia_filepath=str(instancia_file) if instancia_file else None,
-                            flujos_filepath=str(flujos_file) if flujos_file else None,
-                            distancias_filepath=str(distancia_file) if distancia_file else None,
-                            fecha_inicio=fecha_inicio,
-                            semana=semana,
-                            anio=anio,
-                            participacion=participacion,
-                            con_dispersion=con_dispersion
-                        )
-                        
-                        await db.commit()
-                        logger.info(f"   ✅ Cargado exitosamente (ID: {instancia_id})")
-                        instancias_exitosas += 1
-                        
-                except Exception as e:
-                    logger.error(f"   ❌ Error: {str(e)}")
-                    if os.environ.get("DEBUG"):
-                        traceback.print_exc()
-                    instancias_fallidas += 1
+                fecha_loads.append(dict(
+                    resultado_filepath=resultado_file.path,
+                    instancia_filepath=instancia_file.path if instancia_file else None,
+                    flujos_filepath=flujos_file.path if flujos_file else None,
+                    distancias_filepath=distancia_file.path if distancia_file else None,
+                    fecha_inicio=fecha_inicio,
+                    semana=semana,
+                    anio=anio,
+                    participacion=participacion,
+                    con_dispersion=con_dispersion
+                ))
+            
+            if fecha_loads:
+                # Encolar la fecha; si la cola está llena, el recorrido espera a los workers
+                await cola.put((fecha_str, firma, fecha_loads))
+            elif registrar_manifiesto:
+                manifiesto[fecha_str] = firma
                     
         except Exception as e:
-            logger.error(f"⚠️ Error procesando {fecha_str}: {str(e)}")
+            logger.error("⚠️ Error procesando %s: %s", fecha_str, e)
             continue
     
+    # Fin del trabajo: un None por worker y esperar a que terminen las fechas encoladas
+    for _ in workers:
+        await cola.put(None)
+    await asyncio.gather(*workers)
+    excel_pool.shutdown()
+    
+    # Registrar en el manifiesto solo las fechas cargadas por completo
+    if registrar_manifiesto:
+        for fecha_str, (firma, completa) in fechas_cargadas.items():
+            if completa:
+                manifiesto[fecha_str] = firma
+            else:
+                manifiesto.pop(fecha_str, None)
+        save_manifest(ruta_manifiesto, manifiesto)
+    
     # Resumen final
     logger.info(f"\n{'='*80}")
     logger.info(f"✅ CARGA COMPLETA - {datetime.now()}")
@@ -476,6 +694,7 @@ async def load_optimization_data(
     logger.info(f"   - Exitosas: {instancias_exitosas}")
     logger.info(f"   - Fallidas: {instancias_fallidas}")
     logger.info(f"   - Omitidas: {instancias_omitidas}")
+    logger.info(f"   - Fechas sin cambios: {fechas_sin_cambios}")
     if total_instancias > 0:
         logger.info(f"   - Tasa de éxito: {(instancias_exitosas/total_instancias*100):.1f}%")
 
@@ -504,6 +723,9 @@ Ejemplos de uso:
   # Omitir instancias ya cargadas
   python %(prog)s --skip-existing
   
+  # Recargar también las fechas sin cambios desde la última carga
+  python %(prog)s --force
+  
   # Ver estado de la base de datos
   python %(prog)s --verify-only
         """
@@ -526,6 +748,8 @@ Ejemplos de uso:
                         help='Limitar cantidad de fechas a procesar')
     parser.add_argument('--skip-existing', action='store_true',
                         help='Omitir instancias que ya existen en la base de datos')
+    parser.add_argument('--force', action='store_true',
+                        help='Recargar fechas aunque sus archivos no hayan cambiado')
     
     # Opciones
     parser.add_argument('--debug', action='store_true',
@@ -566,7 +790,8 @@ Ejemplos de uso:
                 fecha_especifica=args.fecha,
                 participacion_especifica=args.participacion,
                 limite=args.limite,
-                skip_existing=args.skip_existing
+                skip_existing=args.skip_existing,
+                force=args.force or args.clean_all
             )
             
             # Verificar después de cargar
@@ -576,6 +801,7 @@ Ejemplos de uso:
     logger.info(f"🚀 Iniciando - {datetime.now()}")
     logger.info(f"="*80)
     
+    install_uvloop()
     asyncio.run(run_actions())
 
 if __name__ == "__main__":
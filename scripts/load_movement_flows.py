@@ -4,15 +4,16 @@ import sys
 from pathlib import Path
 import argparse
 import logging
+import time
 from datetime import datetime
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
 
-from app.core.config import get_settings
+from scripts._engine import build_engine, build_session_factory, install_uvloop
 from app.services.movement_flow_loader import MovementFlowLoaderService
 from app.models.base import Base
 from app.models.movement_flow import MovementFlow
@@ -23,21 +24,78 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-settings = get_settings()
+async def create_ultimo_bloque(db: AsyncSession, year_from_date: datetime):
+    """
+    Materializar el último bloque conocido por contenedor en una tabla temporal
+    (se elimina al confirmar la transacción): un solo DISTINCT ON para ambos UPDATE.
+    El índice parcial idx_mf_gkey_time_notnull (ime_ufv_gkey, ime_time DESC) INCLUDE
+    (patio, bloque) permite resolverlo con un index-only scan, sin ordenar la tabla.
+    """
+    # Índice parcial del modelo (en bases creadas antes de agregarlo)
+    gkey_time_idx = next(
+        idx for idx in MovementFlow.__table__.indexes if idx.name == 'idx_mf_gkey_time_notnull'
+    )
+    await db.execute(CreateIndex(gkey_time_idx, if_not_exists=True))
+    
+    await db.execute(text("""
+        CREATE TEMP TABLE ultimo_bloque ON COMMIT DROP AS
+        SELECT DISTINCT ON (ime_ufv_gkey)
+            ime_ufv_gkey,
+            patio,
+            bloque,
+            ime_time
+        FROM movement_flows
+        WHERE patio IS NOT NULL 
+          AND bloque IS NOT NULL
+          AND ime_time >= :year_from
+        ORDER BY ime_ufv_gkey, ime_time DESC
+    """), {"year_from": year_from_date})
+    await db.execute(text("CREATE INDEX ON ultimo_bloque (ime_ufv_gkey)"))
+    await db.execute(text("ANALYZE ultimo_bloque"))
 
-async def update_blocks_only(year_from: int = 2017):
+async def update_bloques(db: AsyncSession, condicion: str) -> tuple[int, int]:
+    """
+    Asignar a CDT y TTT el último bloque conocido por contenedor (tabla ultimo_bloque)
+    en una sola sentencia: dos UPDATE como CTE de escritura, un solo viaje al servidor.
+    condicion: filtro sobre el alias t de la fila a actualizar. Retorna (cdt, ttt) actualizados.
+    """
+    result = await db.execute(text(f"""
+        WITH upd_cdt AS (
+            UPDATE container_dwell_times t
+            SET 
+                patio = ub.patio,
+                bloque = ub.bloque,
+                updated_at = CURRENT_TIMESTAMP
+            FROM ultimo_bloque ub
+            WHERE t.iufv_gkey = ub.ime_ufv_gkey
+              AND {condicion}
+            RETURNING 1
+        ),
+        upd_ttt AS (
+            UPDATE truck_turnaround_times t
+            SET 
+                patio = ub.patio,
+                bloque = ub.bloque,
+                updated_at = CURRENT_TIMESTAMP
+            FROM ultimo_bloque ub
+            WHERE t.iufv_gkey = ub.ime_ufv_gkey
+              AND {condicion}
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM upd_cdt) AS cdt_n,
+               (SELECT COUNT(*) FROM upd_ttt) AS ttt_n
+    """))
+    row = result.one()
+    return row.cdt_n, row.ttt_n
+
+async def update_blocks_only(async_session: async_sessionmaker, year_from: int = 2017):
     """
     Solo actualizar bloques en CDT y TTT sin cargar datos nuevos
+    (con la fábrica de sesiones del engine que crea main)
     """
     logger.info(f"=== ACTUALIZANDO BLOQUES EN CDT Y TTT ===")
     logger.info(f"Usando movimientos desde año: {year_from}")
     
-    # Crear engine
-    engine = create_async_engine(settings.DATABASE_URL)
-    
-    # Crear sesión
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-    
     async with async_session() as db:
         # Convertir year_from a datetime para evitar error de tipo
         year_from_date = datetime(year_from, 1, 1)
@@ -54,62 +112,12 @@ async def update_blocks_only(year_from: int = 2017):
         count_row = count_result.first()
         logger.info(f"Movement Flows disponibles: {count_row.total:,} total, {count_row.con_patio:,} con patio, {count_row.con_bloque:,} con bloque")
         
-        # Actualizar CDT con el último bloque conocido por contenedor
-        logger.info("\nActualizando CDT...")
-        result = await db.execute(text("""
-            WITH ultimo_bloque AS (
-                SELECT DISTINCT ON (ime_ufv_gkey)
-                    ime_ufv_gkey,
-                    patio,
-                    bloque,
-                    ime_time
-                FROM movement_flows
-                WHERE patio IS NOT NULL 
-                  AND bloque IS NOT NULL
-                  AND ime_time >= :year_from
-                ORDER BY ime_ufv_gkey, ime_time DESC
-            )
-            UPDATE container_dwell_times cdt
-            SET 
-                patio = ub.patio,
-                bloque = ub.bloque,
-                updated_at = CURRENT_TIMESTAMP
-            FROM ultimo_bloque ub
-            WHERE cdt.iufv_gkey = ub.ime_ufv_gkey
-              AND (cdt.patio IS NULL OR cdt.bloque IS NULL)
-            RETURNING cdt.iufv_gkey;
-        """), {"year_from": year_from_date})
-        
-        cdt_updated = result.rowcount
-        await db.commit()
+        # Último bloque conocido por contenedor, calculado una sola vez para CDT y TTT
+        await create_ultimo_bloque(db, year_from_date)
         
-        # Actualizar TTT con el último bloque conocido por contenedor
-        logger.info("Actualizando TTT...")
-        result = await db.execute(text("""
-            WITH ultimo_bloque AS (
-                SELECT DISTINCT ON (ime_ufv_gkey)
-                    ime_ufv_gkey,
-                    patio,
-                    bloque,
-                    ime_time
-                FROM movement_flows
-                WHERE patio IS NOT NULL 
-                  AND bloque IS NOT NULL
-                  AND ime_time >= :year_from
-                ORDER BY ime_ufv_gkey, ime_time DESC
-            )
-            UPDATE truck_turnaround_times ttt
-            SET 
-                patio = ub.patio,
-                bloque = ub.bloque,
-                updated_at = CURRENT_TIMESTAMP
-            FROM ultimo_bloque ub
-            WHERE ttt.iufv_gkey = ub.ime_ufv_gkey
-              AND (ttt.patio IS NULL OR ttt.bloque IS NULL)
-            RETURNING ttt.iufv_gkey;
-        """), {"year_from": year_from_date})
-        
-        ttt_updated = result.rowcount
+        # Actualizar CDT y TTT con el último bloque conocido por contenedor
+        logger.info("\nActualizando CDT y TTT...")
+        cdt_updated, ttt_updated = await update_bloques(db, "(t.patio IS NULL OR t.bloque IS NULL)")
         await db.commit()
         
         logger.info(f"\n✅ CDT actualizados: {cdt_updated:,} registros")
@@ -146,8 +154,33 @@ async def update_blocks_only(year_from: int = 2017):
                 f"{row.tabla:<5} {row.total:<10,} {row.con_patio:<10,} {row.pct_con_patio:<6}% "
                 f"{row.con_bloque:<10,} {row.pct_con_bloque:<6}%"
             )
+
+async def load_flows(db: AsyncSession, file_path: str, year_from: int = 2017, clear_existing: bool = False, year_to: int = None) -> int:
+    """
+    Cargar el CSV de flujos en la sesión entregada (sin crear engine propio)
+    
+    Usado por main() y directamente por load_historical_data.py. Retorna los registros cargados.
+    """
+    if clear_existing:
+        logger.info("Limpiando datos existentes...")
+        await db.execute(text("TRUNCATE TABLE movement_flows RESTART IDENTITY CASCADE"))
+        await db.commit()
+    
+    service = MovementFlowLoaderService(db)
     
-    await engine.dispose()
+    start_time = time.perf_counter()
+    records = await service.load_movement_flows_csv(
+        file_path, 
+        year_from=year_from,
+        year_to=year_to
+    )
+    elapsed_time = time.perf_counter() - start_time
+    
+    logger.info(f"✅ Proceso completado en {elapsed_time:.2f} segundos")
+    logger.info(f"✅ {records:,} registros cargados")
+    logger.info(f"✅ Velocidad: {records/elapsed_time:.0f} registros/segundo")
+    
+    return records
 
 async def main(
     file_path: str = "/data/Flujos.csv", 
@@ -159,47 +192,43 @@ async def main(
     """
     Cargar archivo de flujos de movimiento con filtro de años
     """
-    # Si solo es actualización, ejecutar función específica
-    if update_only:
-        await update_blocks_only(year_from)
-        return
+    # Un solo engine por proceso para ambos caminos; se libera aunque la carga falle
+    engine = build_engine()
+    async_session = build_session_factory(engine)
     
+    try:
+        # Si solo es actualización, ejecutar función específica
+        if update_only:
+            await update_blocks_only(async_session, year_from)
+        else:
+            await load_and_update(engine, async_session, file_path, clear_existing, year_from, year_to)
+    finally:
+        await engine.dispose()
+
+async def load_and_update(
+    engine: AsyncEngine,
+    async_session: async_sessionmaker,
+    file_path: str,
+    clear_existing: bool,
+    year_from: int,
+    year_to: int
+):
+    """
+    Cargar el CSV de flujos y actualizar bloques en CDT y TTT
+    """
     logger.info(f"=== INICIANDO CARGA DE FLUJOS ===")
     logger.info(f"Archivo: {file_path}")
     logger.info(f"Filtro de años: {year_from} - {year_to or 'actual'}")
     logger.info(f"Limpiar datos existentes: {clear_existing}")
     
-    # Crear engine
-    engine = create_async_engine(settings.DATABASE_URL)
-    
     # Crear tablas si no existen
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     
-    # Crear sesión
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-    
     async with async_session() as db:
-        if clear_existing:
-            logger.info("Limpiando datos existentes...")
-            await db.execute(text("TRUNCATE TABLE movement_flows RESTART IDENTITY CASCADE"))
-            await db.commit()
-        
-        service = MovementFlowLoaderService(db)
-        
         # Cargar archivo con filtro de años
         if Path(file_path).exists():
-            start_time = datetime.now()
-            records = await service.load_movement_flows_csv(
-                file_path, 
-                year_from=year_from,
-                year_to=year_to
-            )
-            elapsed_time = (datetime.now() - start_time).total_seconds()
-            
-            logger.info(f"✅ Proceso completado en {elapsed_time:.2f} segundos")
-            logger.info(f"✅ {records:,} registros cargados")
-            logger.info(f"✅ Velocidad: {records/elapsed_time:.0f} registros/segundo")
+            await load_flows(db, file_path, year_from, clear_existing, year_to)
         else:
             logger.error(f"❌ No se encontró el archivo: {file_path}")
             return
@@ -210,60 +239,11 @@ async def main(
         # Convertir year_from a datetime para evitar error de tipo
         year_from_date = datetime(year_from, 1, 1)
         
-        # Actualizar CDT con el último bloque conocido por contenedor
-        result = await db.execute(text("""
-            WITH ultimo_bloque AS (
-                SELECT DISTINCT ON (ime_ufv_gkey)
-                    ime_ufv_gkey,
-                    patio,
-                    bloque,
-                    ime_time
-                FROM movement_flows
-                WHERE patio IS NOT NULL 
-                  AND bloque IS NOT NULL
-                  AND ime_time >= :year_from
-                ORDER BY ime_ufv_gkey, ime_time DESC
-            )
-            UPDATE container_dwell_times cdt
-            SET 
-                patio = ub.patio,
-                bloque = ub.bloque,
-                updated_at = CURRENT_TIMESTAMP
-            FROM ultimo_bloque ub
-            WHERE cdt.iufv_gkey = ub.ime_ufv_gkey
-              AND cdt.patio IS NULL
-            RETURNING cdt.iufv_gkey;
-        """), {"year_from": year_from_date})
-        
-        cdt_updated = result.rowcount
-        await db.commit()
-        
-        # Actualizar TTT con el último bloque conocido por contenedor
-        result = await db.execute(text("""
-            WITH ultimo_bloque AS (
-                SELECT DISTINCT ON (ime_ufv_gkey)
-                    ime_ufv_gkey,
-                    patio,
-                    bloque,
-                    ime_time
-                FROM movement_flows
-                WHERE patio IS NOT NULL 
-                  AND bloque IS NOT NULL
-                  AND ime_time >= :year_from
-                ORDER BY ime_ufv_gkey, ime_time DESC
-            )
-            UPDATE truck_turnaround_times ttt
-            SET 
-                patio = ub.patio,
-                bloque = ub.bloque,
-                updated_at = CURRENT_TIMESTAMP
-            FROM ultimo_bloque ub
-            WHERE ttt.iufv_gkey = ub.ime_ufv_gkey
-              AND ttt.patio IS NULL
-            RETURNING ttt.iufv_gkey;
-        """), {"year_from": year_from_date})
+        # Último bloque conocido por contenedor, calculado una sola vez para CDT y TTT
+        await create_ultimo_bloque(db, year_from_date)
         
-        ttt_updated = result.rowcount
+        # Actualizar CDT y TTT con el último bloque conocido por contenedor
+        cdt_updated, ttt_updated = await update_bloques(db, "t.patio IS NULL")
         await db.commit()
         
         logger.info(f"CDT actualizados: {cdt_updated:,} registros")
@@ -307,8 +287,6 @@ async def main(
                 f"{row.tabla:<20} {row.total:<10,} {row.con_patio:<10,} {row.con_bloque:<10,} "
                 f"{str(row.fecha_min)[:19]:<20} {str(row.fecha_max)[:19]:<20}"
             )
-    
-    await engine.dispose()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Cargar flujos de movimiento con filtro de años')
@@ -325,6 +303,7 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     
+    install_uvloop()
     asyncio.run(main(
         file_path=args.file, 
         clear_existing=args.clear,
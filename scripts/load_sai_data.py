@@ -2,18 +2,54 @@
 # scripts/load_sai_data.py
 
 import asyncio
+import logging
 import os
 from pathlib import Path
 import sys
 import traceback
+from dataclasses import dataclass
 from datetime import datetime
 import re
 
 # Agregar el directorio raíz al path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.core.database import AsyncSessionLocal
+from app.core.database import AsyncSessionLocal, engine
 from app.services.sai_flujos_loader import SAIFlujosLoader
+from scripts._engine import install_uvloop
+from scripts._loader_common import FileRec
+
+# El detalle del recorrido de archivos va al logger en DEBUG (un print por archivo es
+# una escritura a stdout por archivo); el resto del progreso sigue en print
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Patrones de archivos (formato de fecha con guiones) en una sola expresión: un intento
+# de búsqueda por archivo; el grupo con nombre que calza indica el tipo
+ARCHIVO_SAI_RE = re.compile(
+    r'(?:Flujos_w(?P<flujos>\d{4}-\d{2}-\d{2})'
+    r'|Instancia_(?P<instancia>\d{4}-\d{2}-\d{2})_(?P<participacion>\d+)'
+    r'|evolucion_turnos_w(?P<evolucion>\d{4}-\d{2}-\d{2}))'
+    r'.*\.xlsx'
+)
+
+@dataclass(frozen=True, slots=True)
+class InstanciaSAI:
+    """Archivo de instancia con sus parámetros, leídos del nombre una sola vez al descubrirlo"""
+    archivo: FileRec
+    participacion: int
+    con_dispersion: bool
+
+def listar_xlsx(date_dir: str) -> list:
+    """Archivos .xlsx de un directorio de fecha (os.scandir: el tipo sale del listado, sin stat)"""
+    with os.scandir(date_dir) as entries:
+        return [
+            FileRec(entry.name, entry.path) for entry in entries
+            if entry.name.endswith('.xlsx') and entry.is_file()
+        ]
 
 async def load_sai_data():
     """Carga inicial de datos SAI"""
@@ -22,65 +58,67 @@ async def load_sai_data():
     base_path = os.environ.get('SAI_DATA_PATH', '/app/data/magdalena/2022/instancias_magdalena')
     data_path = Path(base_path)
     
-    # Patrones de archivos - ajustados para el formato con guiones
-    flujos_pattern = re.compile(r'.*Flujos_w(\d{4}-\d{2}-\d{2}).*\.xlsx')
-    instancia_pattern = re.compile(r'.*Instancia_(\d{4}-\d{2}-\d{2})_(\d+).*\.xlsx')
-    evolucion_pattern = re.compile(r'.*evolucion_turnos_w(\d{4}-\d{2}-\d{2}).*\.xlsx')
-    
     print("🚀 Iniciando carga de datos SAI")
     print(f"📁 Buscando archivos en: {data_path}")
     
-    # Verificar que el directorio existe
-    if not data_path.exists():
-        print(f"❌ Error: No existe el directorio {data_path}")
-        return
-    
     # Buscar archivos
     flujos_files = {}
     instancia_files = {}
     evolucion_files = {}
     
-    # Buscar en todos los subdirectorios de fechas
-    for date_dir in sorted(data_path.glob('2022-*')):
-        if not date_dir.is_dir():
-            continue
-        
-        print(f"🔍 Revisando directorio: {date_dir.name}")
+    # Subdirectorios de fechas en un solo listado, filtrando por nombre antes de mirar el tipo
+    # (si el directorio no existe lo avisa el propio listado, sin un exists() previo)
+    try:
+        with os.scandir(data_path) as entries:
+            date_dirs = sorted(
+                (entry.name, entry.path) for entry in entries
+                if entry.name.startswith('2022-') and entry.is_dir(follow_symlinks=False)
+            )
+    except FileNotFoundError:
+        print(f"❌ Error: No existe el directorio {data_path}")
+        return 0, 0
+    
+    # Listar los directorios en paralelo (en volúmenes montados cada listado es un viaje)
+    listados = await asyncio.gather(*(asyncio.to_thread(listar_xlsx, path) for _, path in date_dirs))
+    
+    for (date_name, _), xlsx_files in zip(date_dirs, listados):
+        logger.debug("🔍 Revisando directorio: %s", date_name)
         
-        # Buscar archivos xlsx en cada subdirectorio
-        for file in date_dir.glob('*.xlsx'):
+        # Archivos xlsx de cada subdirectorio
+        for file in xlsx_files:
             filename = file.name
             
             # Limpiar nombre si empieza con $
             clean_filename = filename.lstrip('$')
             
+            match = ARCHIVO_SAI_RE.search(clean_filename)
+            if not match:
+                continue
+            
             # Verificar si es archivo de flujos
-            flujos_match = flujos_pattern.match(clean_filename)
-            if flujos_match:
-                fecha_str = flujos_match.group(1)
+            if match['flujos']:
+                fecha_str = match['flujos']
                 flujos_files[fecha_str] = file
-                print(f"   ✓ Encontrado archivo de flujos: {filename}")
+                logger.debug("   ✓ Encontrado archivo de flujos: %s", filename)
                 continue
             
             # Verificar si es archivo de instancia
-            instancia_match = instancia_pattern.match(clean_filename)
-            if instancia_match:
-                fecha_str = instancia_match.group(1)
-                participacion = int(instancia_match.group(2))
+            if match['instancia']:
+                fecha_str = match['instancia']
+                participacion = int(match['participacion'])
                 # Detectar si tiene _K basándose en el nombre
                 con_dispersion = '_K' in filename
                 
                 key = f"{fecha_str}_{participacion}_{'K' if con_dispersion else 'C'}"
-                instancia_files[key] = file
-                print(f"   ✓ Encontrado archivo de instancia: {filename}")
+                instancia_files[key] = InstanciaSAI(file, participacion, con_dispersion)
+                logger.debug("   ✓ Encontrado archivo de instancia: %s", filename)
                 continue
             
             # Verificar si es archivo de evolución
-            evolucion_match = evolucion_pattern.match(clean_filename)
-            if evolucion_match:
-                fecha_str = evolucion_match.group(1)
+            if match['evolucion']:
+                fecha_str = match['evolucion']
                 evolucion_files[fecha_str] = file
-                print(f"   ✓ Encontrado archivo de evolución: {filename}")
+                logger.debug("   ✓ Encontrado archivo de evolución: %s", filename)
     
     print(f"\n📊 Archivos encontrados:")
     print(f"   - Flujos: {len(flujos_files)}")
@@ -93,14 +131,11 @@ async def load_sai_data():
         for fecha, file in list(flujos_files.items())[:3]:
             print(f"   - {fecha}: {file.name}")
     
-    # Procesar cada conjunto de archivos
-    processed_count = 0
-    error_count = 0
-    
-    for fecha_str, flujos_file in flujos_files.items():
+    async def process_date(db, fecha_str, flujos_file):
+        """Cargar instancia, flujos y evolución de una fecha con la sesión del worker; True si se cargó"""
         try:
             # Parsear fecha con el formato correcto
-            fecha = datetime.strptime(fecha_str, '%Y-%m-%d')
+            fecha = datetime.fromisoformat(fecha_str)
             semana = fecha.isocalendar()[1]
             
             print(f"\n🔄 Procesando fecha {fecha.date()} (Semana {semana})")
@@ -118,69 +153,92 @@ async def load_sai_data():
                             break
                     else:
                         print(f"   ⚠️  No se encontró instancia para {fecha_str}")
-                        continue
+                        return None
             
-            instancia_file = instancia_files[instancia_key]
+            instancia = instancia_files[instancia_key]
+            instancia_file = instancia.archivo
             evolucion_file = evolucion_files.get(fecha_str)
             
-            # Determinar parámetros desde la key
-            parts = instancia_key.split('_')
-            participacion = int(parts[1]) if len(parts) > 1 else 68
-            con_dispersion = parts[2] == 'K' if len(parts) > 2 else True
+            # Parámetros ya resueltos al descubrir el archivo
+            participacion = instancia.participacion
+            con_dispersion = instancia.con_dispersion
             
-            print(f"   📄 Flujos: {flujos_file.name}")
-            print(f"   📋 Instancia: {instancia_file.name}")
+            print(f"   [{fecha_str}] 📄 Flujos: {flujos_file.name}")
+            print(f"   [{fecha_str}] 📋 Instancia: {instancia_file.name}")
             if evolucion_file:
-                print(f"   📈 Evolución: {evolucion_file.name}")
+                print(f"   [{fecha_str}] 📈 Evolución: {evolucion_file.name}")
             
             # Cargar datos
-            async with AsyncSessionLocal() as db:
-                loader = SAIFlujosLoader(db)
+            loader = SAIFlujosLoader(db)
+            
+            try:
+                # 1. Cargar instancia (segregaciones y capacidades)
+                print(f"   [{fecha_str}] 1️⃣  Cargando instancia...")
+                instancia_stats = await loader.load_instancia_file(instancia_file.path)
+                print(f"   [{fecha_str}]    ✅ Segregaciones: {instancia_stats['segregaciones']}")
+                print(f"   [{fecha_str}]    ✅ Capacidades: {instancia_stats['capacidades']}")
                 
-                try:
-                    # 1. Cargar instancia (segregaciones y capacidades)
-                    print("   1️⃣  Cargando instancia...")
-                    instancia_stats = await loader.load_instancia_file(str(instancia_file))
-                    print(f"      ✅ Segregaciones: {instancia_stats['segregaciones']}")
-                    print(f"      ✅ Capacidades: {instancia_stats['capacidades']}")
-                    
-                    # 2. Cargar flujos
-                    print("   2️⃣  Cargando flujos...")
-                    config_id = await loader.load_flujos_file(
-                        str(flujos_file),
-                        fecha,
-                        semana,
-                        participacion,
-                        con_dispersion
+                # 2. Cargar flujos
+                print(f"   [{fecha_str}] 2️⃣  Cargando flujos...")
+                config_id = await loader.load_flujos_file(
+                    flujos_file.path,
+                    fecha,
+                    semana,
+                    participacion,
+                    con_dispersion
+                )
+                print(f"   [{fecha_str}]    ✅ Config ID: {config_id}")
+                
+                # 3. Cargar evolución si existe
+                if evolucion_file:
+                    print(f"   [{fecha_str}] 3️⃣  Cargando evolución...")
+                    evol_stats = await loader.load_evolucion_file(
+                        evolucion_file.path,
+                        config_id
                     )
-                    print(f"      ✅ Config ID: {config_id}")
-                    
-                    # 3. Cargar evolución si existe
-                    if evolucion_file:
-                        print("   3️⃣  Cargando evolución...")
-                        evol_stats = await loader.load_evolucion_file(
-                            str(evolucion_file),
-                            config_id
-                        )
-                        print(f"      ✅ Volumen bloques: {evol_stats['volumen_bloques']}")
-                        print(f"      ✅ Volumen segregaciones: {evol_stats['volumen_segregaciones']}")
-                    
-                    print(f"   ✅ Carga completa para {fecha.date()}")
-                    processed_count += 1
-                    
-                except Exception as e:
-                    print(f"   ❌ Error: {str(e)}")
-                    traceback.print_exc()
-                    error_count += 1
-                    try:
-                        await db.rollback()
-                    except:
-                        pass
-                    
+                    print(f"   [{fecha_str}]    ✅ Volumen bloques: {evol_stats['volumen_bloques']}")
+                    print(f"   [{fecha_str}]    ✅ Volumen segregaciones: {evol_stats['volumen_segregaciones']}")
+                
+                print(f"   ✅ Carga completa para {fecha.date()}")
+                return True
+                
+            except Exception as e:
+                print(f"   ❌ [{fecha_str}] Error: {str(e)}")
+                traceback.print_exc()
+                try:
+                    await db.rollback()
+                except:
+                    pass
+                return False
+                
         except Exception as e:
             print(f"❌ Error procesando {fecha_str}: {str(e)}")
             traceback.print_exc()
-            error_count += 1
+            return False
+
+    # Procesar fechas en paralelo sin superar el pool de conexiones: cada worker abre una
+    # sola sesión y la reutiliza para todas sus fechas (el loader confirma o revierte cada
+    # archivo, así que un error solo deshace lo de esa fecha)
+    cola = asyncio.Queue()
+    for item in flujos_files.items():
+        cola.put_nowait(item)
+    num_workers = max(1, min(len(flujos_files), engine.pool.size() - 1))
+    
+    async def worker():
+        """Consumir fechas de la cola hasta vaciarla"""
+        resultados = []
+        async with AsyncSessionLocal() as db:
+            while not cola.empty():
+                fecha_str, flujos_file = cola.get_nowait()
+                resultados.append(await process_date(db, fecha_str, flujos_file))
+        return resultados
+    
+    resultados = [
+        r for parcial in await asyncio.gather(*(worker() for _ in range(num_workers)))
+        for r in parcial
+    ]
+    processed_count = sum(1 for r in resultados if r is True)
+    error_count = sum(1 for r in resultados if r is False)
     
     print(f"\n✅ Proceso de carga completado")
     print(f"   - Procesados exitosamente: {processed_count}")
@@ -204,15 +262,16 @@ async def verify_loaded_data_simple():
             config_count = await db.scalar(select(func.count(SAIConfiguration.id)))
             print(f"\n📊 Total de configuraciones cargadas: {config_count}")
             
-            # Listar algunas configuraciones
+            # Listar algunas configuraciones (solo las columnas que se muestran, sin
+            # construir objetos ORM)
             configs = await db.execute(
-                select(SAIConfiguration)
+                select(SAIConfiguration.semana, SAIConfiguration.fecha)
                 .order_by(SAIConfiguration.fecha)
                 .limit(5)
             )
             
             print(f"\n📅 Primeras configuraciones:")
-            for config in configs.scalars():
+            for config in configs:
                 print(f"   - Semana {config.semana}: {config.fecha.date()}")
                 
     except Exception as e:
@@ -255,5 +314,6 @@ if __name__ == "__main__":
     print(f"✅ Directorio de datos encontrado: {data_path}")
     
     # Ejecutar carga
+    install_uvloop()
     asyncio.run(load_sai_data())
     
\ No newline at end of file
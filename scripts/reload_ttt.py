@@ -2,16 +2,15 @@
 import asyncio
 import sys
 from pathlib import Path
+from typing import Optional
 import logging
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy import text
 
-from app.core.config import get_settings
 from app.services.csv_loader import CSVLoaderService
+from scripts._engine import build_engine, build_session_factory, install_uvloop
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,49 +18,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-settings = get_settings()
+# Tabla de staging sin WAL: los archivos se cargan aquí y la tabla real solo se
+# reemplaza (en una transacción) si la carga terminó
+TTT_STAGE_TABLE = "truck_turnaround_times_stage"
+
+# Directorios donde buscar los CSV TTT, en orden de preferencia
+TTT_DATA_DIRS = ("data", "../data")
+
+def find_ttt_file(kind: str, year: int):
+    """
+    Ruta del CSV TTT (kind: 'impo' o 'expo'), con un glob por directorio en vez de
+    probar cada nombre: data/ antes que ../data/ y el nombre exacto antes que
+    copias como "... 1.csv". None si no hay
+    """
+    patron = f"resultados_TTT_{kind}_anio_SAI_{year}*.csv"
+    for data_dir in TTT_DATA_DIRS:
+        candidatos = sorted(Path(data_dir).glob(patron), key=lambda p: (len(p.name), p.name))
+        if candidatos:
+            return str(candidatos[0])
+    return None
+
+def _fmt_minutos(valor, spec: str = '') -> str:
+    """Minutos con el formato indicado, o N/A si el agregado viene NULL"""
+    return "N/A" if valor is None else f"{format(valor, spec)} min"
 
 async def reload_ttt_data(year: int = 2022):
     """Recargar solo datos TTT"""
     
-    engine = create_async_engine(settings.DATABASE_URL)
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    # Engine de los scripts de carga masiva (pool para las cargas en paralelo y
+    # parámetros de servidor de carga); se libera al terminar
+    engine = build_engine()
+    async_session = build_session_factory(engine)
     
     async with async_session() as db:
-        # Limpiar datos TTT existentes
-        logger.info("Limpiando datos TTT existentes...")
-        await db.execute(text("TRUNCATE TABLE truck_turnaround_times RESTART IDENTITY CASCADE"))
+        # Preparar la tabla de staging vacía (los datos TTT existentes siguen visibles)
+        logger.info("Preparando tabla de staging TTT...")
+        await db.execute(text(
+            f"CREATE UNLOGGED TABLE IF NOT EXISTS {TTT_STAGE_TABLE} "
+            f"(LIKE truck_turnaround_times INCLUDING DEFAULTS) "
+            f"WITH (autovacuum_enabled = false)"  # se vacía en cada recarga, no hay nada que limpiar
+        ))
+        await db.execute(text(f"TRUNCATE TABLE {TTT_STAGE_TABLE}"))
         await db.commit()
         
-        service = CSVLoaderService(db)
-        
         results = {
             'ttt_import': 0,
             'ttt_export': 0
         }
         
-        # Buscar archivos con diferentes patrones
-        possible_paths = [
-            f"data/resultados_TTT_impo_anio_SAI_{year}.csv",
-            f"data/resultados_TTT_impo_anio_SAI_{year} 1.csv",  # Con espacio
-            f"../data/resultados_TTT_impo_anio_SAI_{year}.csv",
-            f"../data/resultados_TTT_impo_anio_SAI_{year} 1.csv"
-        ]
-        
-        # Cargar TTT importación
-        ttt_import_loaded = False
-        for path in possible_paths:
+        async def load_ttt(operation_type: str, etiqueta: str, kind: str) -> Optional[bool]:
+            """Cargar el archivo TTT de la operación en su propia sesión.
+            
+            None si no hay archivo, True si se cargó completo y False si falló.
+            """
+            # Un glob por directorio, fuera del event loop
+            path = await asyncio.to_thread(find_ttt_file, kind, year)
+            if path is None:
+                return None
             try:
-                if Path(path).exists():
-                    logger.info(f"Encontrado archivo TTT import en: {path}")
-                    results['ttt_import'] = await service.load_ttt_csv(path, 'import')
-                    logger.info(f"✅ TTT Import: {results['ttt_import']} registros")
-                    ttt_import_loaded = True
-                    break
+                logger.info(f"Encontrado archivo TTT {operation_type} en: {path}")
+                async with async_session() as db_carga:
+                    service = CSVLoaderService(db_carga)
+                    results[f'ttt_{operation_type}'] = await service.load_ttt_csv(
+                        path, operation_type, staging_table=TTT_STAGE_TABLE
+                    )
+                logger.info(f"✅ TTT {operation_type.capitalize()}: {results[f'ttt_{operation_type}']} registros")
+                return True
             except Exception as e:
-                logger.error(f"Error cargando TTT importación desde {path}: {e}")
+                logger.error(f"Error cargando TTT {etiqueta} desde {path}: {e}")
+                return False
+        
+        # Cargar TTT importación y exportación en paralelo, cada una con su conexión
+        # (ambas escriben en la tabla de staging; son operation_type distintos)
+        ttt_import_loaded, ttt_export_loaded = await asyncio.gather(
+            load_ttt('import', 'importación', 'impo'),
+            load_ttt('export', 'exportación', 'expo')
+        )
         
-        if not ttt_import_loaded:
+        if ttt_import_loaded is None:
             logger.warning("❌ No se encontró archivo TTT importación")
             logger.info("Archivos en data/:")
             data_dir = Path("data")
@@ -69,72 +103,102 @@ async def reload_ttt_data(year: int = 2022):
                 for f in data_dir.glob("*TTT*"):
                     logger.info(f"  - {f}")
         
-        # Cargar TTT exportación
-        possible_paths_export = [
-            f"data/resultados_TTT_expo_anio_SAI_{year}.csv",
-            f"data/resultados_TTT_expo_anio_SAI_{year} 1.csv",
-            f"../data/resultados_TTT_expo_anio_SAI_{year}.csv",
-            f"../data/resultados_TTT_expo_anio_SAI_{year} 1.csv"
-        ]
+        if ttt_export_loaded is None:
+            logger.warning("❌ No se encontró archivo TTT exportación")
         
-        ttt_export_loaded = False
-        for path in possible_paths_export:
-            try:
-                if Path(path).exists():
-                    logger.info(f"Encontrado archivo TTT export en: {path}")
-                    results['ttt_export'] = await service.load_ttt_csv(path, 'export')
-                    logger.info(f"✅ TTT Export: {results['ttt_export']} registros")
-                    ttt_export_loaded = True
-                    break
-            except Exception as e:
-                logger.error(f"Error cargando TTT exportación desde {path}: {e}")
+        # El TRUNCATE vacía ambas operaciones: solo se reemplaza si todos los archivos
+        # encontrados se cargaron completos (si no, se perderían filas de la otra)
+        estados = [s for s in (ttt_import_loaded, ttt_export_loaded) if s is not None]
+        reemplazar = bool(estados) and all(estados)
         
-        if not ttt_export_loaded:
-            logger.warning("❌ No se encontró archivo TTT exportación")
+        # Reemplazar los datos TTT en una sola transacción: si algo falla antes del
+        # commit, la tabla real queda como estaba (DDL incluido, también los índices)
+        if reemplazar:
+            logger.info("Reemplazando datos TTT existentes...")
+            
+            # Memoria para ordenar al reconstruir los índices (solo en esta transacción;
+            # synchronous_commit y work_mem ya vienen en la conexión de build_engine)
+            await db.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+            
+            # Índices secundarios: se eliminan antes del INSERT y se crean de nuevo al
+            # final (un solo ordenamiento por índice en vez de una inserción por fila).
+            # Se mantienen la PK y el único (iufv_gkey, operation_type)
+            indices_result = await db.execute(text("""
+                SELECT ci.relname AS indexname, pg_get_indexdef(ix.indexrelid) AS indexdef
+                FROM pg_index ix
+                JOIN pg_class ci ON ci.oid = ix.indexrelid
+                WHERE ix.indrelid = 'truck_turnaround_times'::regclass
+                  AND NOT ix.indisunique
+                  AND NOT ix.indisprimary
+            """))
+            indices = indices_result.all()
+            for indice in indices:
+                await db.execute(text(f'DROP INDEX "{indice.indexname}"'))
+            
+            # Sin CASCADE: ninguna tabla referencia a truck_turnaround_times; si alguna
+            # llegara a hacerlo, el TRUNCATE falla (y revierte todo) en vez de vaciarla
+            await db.execute(text("TRUNCATE TABLE truck_turnaround_times RESTART IDENTITY"))
+            await db.execute(text(f"INSERT INTO truck_turnaround_times SELECT * FROM {TTT_STAGE_TABLE}"))
+            await db.execute(text(f"TRUNCATE TABLE {TTT_STAGE_TABLE}"))
+            
+            for indice in indices:
+                await db.execute(text(indice.indexdef))
+            logger.info(f"Índices TTT reconstruidos: {len(indices)}")
+            
+            # Estadísticas frescas tras la carga masiva (para la verificación y las
+            # consultas de la API); ANALYZE sí corre dentro de la transacción
+            await db.execute(text("ANALYZE truck_turnaround_times"))
+            await db.commit()
+        elif estados:
+            logger.error("❌ Carga TTT incompleta: se mantienen los datos existentes")
+            await db.execute(text(f"TRUNCATE TABLE {TTT_STAGE_TABLE}"))
+            await db.commit()
+        else:
+            logger.warning("⚠️  Sin archivos TTT cargados: se mantienen los datos existentes")
         
         # Verificar datos cargados
         logger.info("\n=== VERIFICACIÓN TTT ===")
         
-        # Total registros
-        total_result = await db.execute(text("""
-            SELECT COUNT(*) as total,
-                   COUNT(DISTINCT iufv_gkey) as gkeys_unicos,
-                   COUNT(ttt) as con_ttt_valido
+        # Total y estadísticas por tipo de operación en una sola pasada por la tabla
+        # (GROUPING SETS: la fila del total y una por operation_type)
+        verificacion = await db.execute(text("""
+            SELECT 
+                GROUPING(operation_type) AS es_total,
+                operation_type,
+                COUNT(*) as total,
+                COUNT(DISTINCT iufv_gkey) as gkeys_unicos,
+                COUNT(ttt) as con_ttt,
+                AVG(ttt) FILTER (WHERE ttt > 0 AND ttt < 480) as promedio,
+                MIN(ttt) FILTER (WHERE ttt > 0) as minimo,
+                MAX(ttt) FILTER (WHERE ttt < 480) as maximo
             FROM truck_turnaround_times
+            GROUP BY GROUPING SETS ((), (operation_type))
+            ORDER BY es_total DESC, operation_type
         """))
-        total = total_result.first()
+        total, *por_operacion = verificacion.all()
         logger.info(f"Total registros: {total.total}")
         logger.info(f"GKeys únicos: {total.gkeys_unicos}")
-        logger.info(f"Con TTT válido: {total.con_ttt_valido}")
+        logger.info(f"Con TTT válido: {total.con_ttt}")
         
-        if total.total > 0:
-            # Estadísticas TTT
-            stats_result = await db.execute(text("""
-                SELECT 
-                    operation_type,
-                    COUNT(*) as total,
-                    COUNT(ttt) as con_ttt,
-                    AVG(CASE WHEN ttt > 0 AND ttt < 480 THEN ttt END) as promedio,
-                    MIN(CASE WHEN ttt > 0 THEN ttt END) as minimo,
-                    MAX(CASE WHEN ttt < 480 THEN ttt END) as maximo
-                FROM truck_turnaround_times
-                GROUP BY operation_type
-            """))
-            
+        if total.total > 0 and logger.isEnabledFor(logging.INFO):
+            # Estadísticas TTT (formato diferido; N/A si el agregado viene NULL)
             logger.info("\nEstadísticas por tipo de operación:")
-            for row in stats_result:
-                logger.info(f"\n{row.operation_type}:")
-                logger.info(f"  Total: {row.total}")
-                logger.info(f"  Con TTT: {row.con_ttt}")
-                logger.info(f"  Promedio: {row.promedio:.2f} min" if row.promedio else "  Promedio: N/A")
-                logger.info(f"  Mínimo: {row.minimo} min" if row.minimo else "  Mínimo: N/A")
-                logger.info(f"  Máximo: {row.maximo} min" if row.maximo else "  Máximo: N/A")
+            for row in por_operacion:
+                # Un solo registro de log por tipo de operación
+                logger.info(
+                    "\n%s:\n  Total: %s\n  Con TTT: %s\n  Promedio: %s\n  Mínimo: %s\n  Máximo: %s",
+                    row.operation_type, row.total, row.con_ttt,
+                    _fmt_minutos(row.promedio, '.2f'), _fmt_minutos(row.minimo), _fmt_minutos(row.maximo)
+                )
         
         # Mostrar resumen final
         logger.info(f"\n=== RESUMEN FINAL ===")
         logger.info(f"TTT Importación cargados: {results['ttt_import']}")
         logger.info(f"TTT Exportación cargados: {results['ttt_export']}")
         logger.info(f"Total TTT cargados: {results['ttt_import'] + results['ttt_export']}")
+    
+    await engine.dispose()
 
 if __name__ == "__main__":
+    install_uvloop()
     asyncio.run(reload_ttt_data())
\ No newline at end of file
@@ -6,29 +6,30 @@ sys.path.append(str(Path(__file__).parent.parent))
 
 from sqlalchemy import text
 from app.core.database import engine
+from scripts._engine import install_uvloop
 
 async def test_connection():
     """Test database connection"""
     try:
         async with engine.connect() as conn:
-            result = await conn.execute(text("SELECT 1"))
+            # Version and databases in a single round trip (the query itself tests the connection)
+            result = await conn.execute(text(
+                "SELECT version() AS version, "
+                "ARRAY(SELECT datname FROM pg_database WHERE datistemplate = false) AS databases"
+            ))
+            row = result.one()
             print("✓ Database connection successful!")
             
             # Test PostgreSQL version
-            result = await conn.execute(text("SELECT version()"))
-            version = result.scalar()
-            print(f"✓ PostgreSQL version: {version}")
+            print(f"✓ PostgreSQL version: {row.version}")
             
             # List databases
-            result = await conn.execute(
-                text("SELECT datname FROM pg_database WHERE datistemplate = false")
-            )
-            databases = [row[0] for row in result]
-            print(f"✓ Available databases: {databases}")
+            print(f"✓ Available databases: {list(row.databases)}")
             
     except Exception as e:
         print(f"✗ Connection failed: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
+    install_uvloop()
     asyncio.run(test_connection())
\ No newline at end of file